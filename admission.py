@@ -0,0 +1,143 @@
+import math
+import time
+import logging
+
+# Backend latency above which a call counts as a sign of overload. Signup
+# derives keys and transfer waits on the RPC node, so both are slower by
+# nature.
+DEFAULT_LATENCY_TARGET = 1.0
+LATENCY_TARGETS = {
+    '/api/signup': 5.0,
+    '/api/transfer': 5.0,
+}
+
+# Outcomes of AdmissionController.acquire
+BUSY = 'busy'
+USER_BUSY = 'user_busy'
+
+
+class AdmissionController:
+    def __init__(self, initial_limit=32, min_limit=4, max_limit=256, per_user=1, targets=None,
+                 backoff=0.7, cooldown=1.0, clock=time.monotonic):
+        """
+        Caps backend-calling flow actions with a limit that adapts to
+        backend latency (AIMD)
+
+        Every backend response is reported to `observe`. A fast, successful
+        one raises the limit by 1/limit, i.e. by about one per limit's worth
+        of calls; a slow one, a 5xx or a transport error cuts it by
+        `backoff`, at most once per `cooldown` seconds so one slow burst
+        counts once. Actions beyond the limit, or beyond `per_user` for one
+        user, are turned away at once instead of queueing behind the slow
+        backend. While a user's action runs, the same command sent again is
+        dropped before it reaches the update queue.
+
+        Args:
+            initial_limit (int): Actions allowed in flight at start
+            min_limit (int): Floor of the adaptive limit
+            max_limit (int): Ceiling of the adaptive limit
+            per_user (int): Actions one user may have in flight
+            targets (dict): Endpoint -> latency in seconds above which a
+                response counts as overload
+            backoff (float): Multiplier applied to the limit on overload
+            cooldown (float): Minimum seconds between two decreases
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.per_user = per_user
+        self.targets = {**LATENCY_TARGETS, **(targets or {})}
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.clock = clock
+        self.in_flight = 0
+        # user_id -> commands of the user's actions in flight
+        self._users = {}
+        self._last_decrease = float('-inf')
+        # Smoothed backend latency, for the "try again in Ns" hint
+        self.latency = 0.0
+
+        # Metrics
+        self.admitted = 0
+        self.rejected = {BUSY: 0, USER_BUSY: 0}
+        self.duplicates = 0
+        self.decreases = 0
+
+    def observe(self, endpoint, seconds, failed):
+        """
+        BackendClient observer: adapt the limit to one backend response
+        """
+        self.latency = seconds if not self.latency else 0.2 * seconds + 0.8 * self.latency
+        if failed or seconds > self.targets.get(endpoint, DEFAULT_LATENCY_TARGET):
+            now = self.clock()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.decreases += 1
+                self.logger.info(f"Backend overloaded ({endpoint} {seconds:.2f}s), admission limit {int(self.limit)}")
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def retry_after(self):
+        """
+        Seconds a turned away user should wait, from the current latency
+        """
+        return min(30, max(1, math.ceil(2 * self.latency)))
+
+    def acquire(self, user_id, command):
+        """
+        Admit one action of `user_id`
+
+        Returns:
+            str: None when admitted, else BUSY or USER_BUSY
+        """
+        commands = self._users.get(user_id, ())
+        if len(commands) >= self.per_user:
+            self.rejected[USER_BUSY] += 1
+            return USER_BUSY
+        if self.in_flight >= int(self.limit):
+            self.rejected[BUSY] += 1
+            return BUSY
+        self.in_flight += 1
+        self._users.setdefault(user_id, []).append(command)
+        self.admitted += 1
+        return None
+
+    def release(self, user_id, command):
+        self.in_flight -= 1
+        commands = self._users.get(user_id)
+        if commands is not None:
+            commands.remove(command)
+            if not commands:
+                del self._users[user_id]
+
+    def shed(self, update):
+        """
+        Update processor hook: a reply to send instead of processing
+        `update`, or None to process it
+
+        A command whose action is still in flight for the same user is
+        answered straight away instead of waiting in the user's queue.
+        """
+        user = update.effective_user
+        message = update.message
+        if user is None or message is None or not message.text or user.id not in self._users:
+            return None
+        command = message.text.split()[0][1:].split('@')[0].lower() if message.text.startswith('/') else None
+        if command is None or command not in self._users[user.id]:
+            return None
+        self.duplicates += 1
+        return message.reply_text(f"⏳ Still working on your /{command} request, hang on.")
+
+    def stats(self):
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'admitted': self.admitted,
+            'rejected_busy': self.rejected[BUSY],
+            'rejected_user': self.rejected[USER_BUSY],
+            'duplicates': self.duplicates,
+            'decreases': self.decreases,
+        }
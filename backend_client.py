@@ -0,0 +1,392 @@
+import time
+import random
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass
+
+import httpx
+
+from metrics import BACKEND_LATENCY, BACKEND_RESPONSES
+from structured_logging import TRACE_ID
+
+# Per-endpoint timeouts (seconds). Signup derives keys and transfer waits on
+# the RPC node, so both get more headroom than the read-only endpoints.
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+ENDPOINT_TIMEOUTS = {
+    '/api/signup': httpx.Timeout(20.0, connect=5.0),
+    '/api/balance': httpx.Timeout(10.0, connect=5.0),
+    '/api/transfer': httpx.Timeout(30.0, connect=5.0),
+    '/api/network/switch': httpx.Timeout(10.0, connect=5.0),
+    '/api/session': httpx.Timeout(10.0, connect=5.0),
+    '/api/balances': httpx.Timeout(15.0, connect=5.0),
+    # Long-lived event stream: the backend sends a heartbeat at least every
+    # 30 seconds, so a read gap of 90 means the connection is dead
+    '/api/events': httpx.Timeout(10.0, connect=5.0, read=90.0),
+}
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How a backend endpoint may be retried
+
+    Attributes:
+        attempts (int): Total tries, including the first
+        base_delay (float): Backoff base in seconds (full jitter)
+        max_delay (float): Backoff cap in seconds
+        retry_statuses (frozenset): HTTP statuses worth retrying
+        requires_idempotency_key (bool): Only retry when the caller supplied one
+        hedge_after (float): Send a second copy if the first is this slow (reads only)
+    """
+    attempts: int = 1
+    base_delay: float = 0.2
+    max_delay: float = 2.0
+    retry_statuses: frozenset = frozenset({502, 503, 504})
+    requires_idempotency_key: bool = False
+    hedge_after: float = None
+
+
+# Signup creates a wallet and has no idempotency support, so it is never retried
+ENDPOINT_POLICIES = {
+    '/api/signup': RetryPolicy(attempts=1),
+    '/api/balance': RetryPolicy(attempts=3, hedge_after=1.5),
+    '/api/transfer': RetryPolicy(attempts=3, requires_idempotency_key=True),
+    '/api/network/switch': RetryPolicy(attempts=2),
+    '/api/session': RetryPolicy(attempts=2),
+    '/api/balances': RetryPolicy(attempts=3),
+}
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """
+    Raised without calling the backend while the endpoint's circuit breaker is open
+    """
+
+
+# Errors raised before a request left this process
+NOT_SENT_ERRORS = (CircuitOpenError, httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def may_have_arrived(error):
+    """
+    Whether the backend may have received and acted on the request that
+    failed with `error`, e.g. after a read timeout or an unreadable reply.
+    Such a transfer must not be offered for resending as if it never went out.
+    """
+    return not isinstance(error, NOT_SENT_ERRORS)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        """
+        Fail fast after repeated failures of one backend endpoint
+
+        Only transport errors and the endpoint's retryable statuses (e.g. a
+        502 from the proxy) count as failures; any other response means the
+        endpoint is up. Closed: calls pass through. After `failure_threshold`
+        consecutive failures it opens and rejects calls for `reset_timeout`
+        seconds, then lets a single probe through (half-open) to decide
+        whether to close.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            reset_timeout (float): Seconds to stay open before probing
+            clock (callable): Monotonic time source
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def abandon(self):
+        """
+        A call was cancelled before its outcome was known; free the probe slot
+        """
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self._probing = False
+
+
+# Keep-alive pool shared by every handler
+POOL_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=30.0
+)
+
+
+def _http2_available():
+    """
+    Check whether the optional `h2` package is installed
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class BackendClient:
+    def __init__(self, server_url, timeouts=None, policies=None, limits=POOL_LIMITS, breaker_factory=CircuitBreaker,
+                 transport=None, observer=None):
+        """
+        Shared async client for the wallet backend
+
+        Args:
+            server_url (str): Backend server host (without scheme)
+            timeouts (dict): Optional endpoint -> httpx.Timeout overrides
+            policies (dict): Optional endpoint -> RetryPolicy overrides
+            limits (httpx.Limits): Connection pool limits
+            breaker_factory (callable): Creates the CircuitBreaker of each
+                endpoint, so one failing endpoint doesn't block the others
+            transport (httpx.AsyncBaseTransport): Optional transport, e.g. an
+                in-process stub backend for benchmarks
+            observer (callable): Called with (endpoint, seconds, failed) after
+                every request, e.g. AdmissionController.observe
+        """
+        self.logger = logging.getLogger(__name__)
+        self.base_url = f"http://{server_url}"
+        self.timeouts = {**ENDPOINT_TIMEOUTS, **(timeouts or {})}
+        self.policies = {**ENDPOINT_POLICIES, **(policies or {})}
+        self.limits = limits
+        self.breaker_factory = breaker_factory
+        # endpoint -> CircuitBreaker
+        self._breakers = {}
+        self.transport = transport
+        self.observer = observer
+        self._client = None
+        # call id -> (endpoint, start time, trace ID), for diagnostics
+        self._in_flight = {}
+        self._call_ids = itertools.count()
+
+    async def start(self):
+        """
+        Open the connection pool. Called from the Application post_init hook.
+        """
+        if self._client is not None:
+            return
+        http2 = _http2_available()
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=self.limits,
+            timeout=DEFAULT_TIMEOUT,
+            http2=http2,
+            transport=self.transport
+        )
+        self.logger.info(f"Backend client started (http2={http2})")
+
+    async def close(self):
+        """
+        Close the connection pool. Called from the Application post_shutdown hook.
+        """
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+
+    def breaker(self, endpoint):
+        """
+        Circuit breaker of `endpoint`, created on first use
+        """
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = self.breaker_factory()
+        return breaker
+
+    def _policy(self, endpoint):
+        return self.policies.get(endpoint, RetryPolicy())
+
+    async def _send(self, endpoint, payload, headers):
+        """
+        One guarded request: consults and updates the endpoint's circuit breaker
+        """
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Backend circuit open, not calling {endpoint}")
+        trace_id = TRACE_ID.get()
+        if trace_id is not None:
+            # Lets the backend's logs be joined with ours
+            headers = {**(headers or {}), 'X-Trace-Id': trace_id}
+        started = time.perf_counter()
+        call_id = next(self._call_ids)
+        self._in_flight[call_id] = (endpoint, started, trace_id)
+        try:
+            response = await self._client.post(
+                endpoint,
+                json=payload,
+                headers=headers,
+                timeout=self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+            )
+        except httpx.TransportError:
+            breaker.record_failure()
+            BACKEND_RESPONSES.inc(endpoint=endpoint, status='error')
+            self._observe(endpoint, started, failed=True)
+            raise
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        finally:
+            del self._in_flight[call_id]
+            BACKEND_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+        BACKEND_RESPONSES.inc(endpoint=endpoint, status=str(response.status_code))
+        # Other errors (e.g. a 500 for one bad request) come from a live backend
+        if response.status_code in self._policy(endpoint).retry_statuses:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        self._observe(
+            endpoint,
+            started,
+            failed=response.status_code >= 500 or response.status_code == 429,
+            status=response.status_code
+        )
+        return response
+
+    def _observe(self, endpoint, started, failed, status='error'):
+        seconds = time.perf_counter() - started
+        if self.observer is not None:
+            self.observer(endpoint, seconds, failed)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                f"{endpoint} {status} in {seconds:.3f}s",
+                extra={'endpoint': endpoint, 'status': status, 'duration_ms': round(seconds * 1000, 1)}
+            )
+
+    def in_flight(self):
+        """
+        Backend calls waiting for a response, oldest first
+        """
+        now = time.perf_counter()
+        return [
+            {'endpoint': endpoint, 'seconds': now - started, 'trace_id': trace_id}
+            for endpoint, started, trace_id in self._in_flight.values()
+        ]
+
+    def stream(self, endpoint, payload, headers=None):
+        """
+        Open a streaming POST, e.g. to a server-sent event endpoint. Not
+        retried: long-lived streams reconnect on their own schedule.
+
+        Returns:
+            An async context manager yielding the httpx.Response
+        """
+        if self._client is None:
+            raise RuntimeError("Backend client is not started")
+        return self._client.stream(
+            'POST',
+            endpoint,
+            json=payload,
+            headers=headers,
+            timeout=self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+        )
+
+    async def _hedged_send(self, endpoint, payload, headers, hedge_after):
+        """
+        Send a request and, if it is slower than `hedge_after`, a second copy;
+        return whichever finishes first without a transport error
+        """
+        tasks = [asyncio.create_task(self._send(endpoint, payload, headers))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done or self.breaker(endpoint).state != 'closed':
+                return await tasks[0]
+
+            tasks.append(asyncio.create_task(self._send(endpoint, payload, headers)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Also when we are cancelled: the losing copy must not outlive
+            # this call, and its breaker bookkeeping must have run
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def post(self, endpoint, payload, idempotency_key=None):
+        """
+        POST a JSON payload to a backend endpoint, retrying per RetryPolicy
+
+        Args:
+            endpoint (str): Path such as '/api/balance'
+            payload (dict): JSON body
+            idempotency_key (str): Sent as Idempotency-Key; required for
+                endpoints that are only safe to retry with one
+
+        Returns:
+            httpx.Response: Backend response (the last one if all retries failed)
+        """
+        if self._client is None:
+            await self.start()
+
+        policy = self._policy(endpoint)
+        attempts = policy.attempts
+        if policy.requires_idempotency_key and idempotency_key is None:
+            attempts = 1
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+        # Failure of an attempt that may have reached the backend; reported
+        # instead of a later attempt that certainly didn't
+        arrived = None
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                if policy.hedge_after is not None:
+                    response = await self._hedged_send(endpoint, payload, headers, policy.hedge_after)
+                else:
+                    response = await self._send(endpoint, payload, headers)
+            except CircuitOpenError:
+                if arrived is not None:
+                    raise arrived
+                raise
+            except httpx.TransportError as e:
+                if may_have_arrived(e):
+                    arrived = e
+                if last_attempt:
+                    if arrived is not None:
+                        raise arrived
+                    raise
+                self.logger.warning(f"{endpoint} failed ({e!r}), retry {attempt + 1}/{attempts - 1}")
+            else:
+                if response.status_code not in policy.retry_statuses or last_attempt:
+                    return response
+                self.logger.warning(
+                    f"{endpoint} returned {response.status_code}, retry {attempt + 1}/{attempts - 1}"
+                )
+
+            # Full jitter backoff
+            await asyncio.sleep(random.uniform(0, min(policy.max_delay, policy.base_delay * 2 ** attempt)))
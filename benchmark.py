@@ -0,0 +1,581 @@
+"""
+Offline throughput benchmark for the Solana wallet bot
+
+Drives the real Application and handlers from bot.py with synthetic
+updates for many simulated users. Telegram and the backend are replaced by
+in-process stubs, so no token or server is needed:
+
+    python benchmark.py --users 2000 --latency-ms 40 --error-rate 0.01
+
+Each simulated user runs the chosen flows one after another and waits for
+the bot's reply before sending the next message, like a real user would.
+"""
+import json
+import time
+import random
+import logging
+import asyncio
+import argparse
+import tracemalloc
+from collections import Counter, defaultdict
+
+import httpx
+import telegram
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import bot as bot_module
+from backend_client import BackendClient
+from rpc_health import RpcHealth
+from rate_limiter import OutboundScheduler
+from update_processor import UserShardedUpdateProcessor
+
+FAKE_TOKEN = '123456:benchmark'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+# Message scripts per flow; every step gets exactly one reply from the bot.
+# Signup opens a backend session, so the flows after it aren't asked for
+# the password; run signup first.
+RECEIVER = '9xQeWvG816bUx9EPjHmaT23yvVM2ZWbrrpZb9PusVFin'
+
+# Ten /bulktransfer rows over two source wallets
+BULK_ROWS = '\n'.join(
+    f"{RECEIVER},0.{row:02d}" + (',savings' if row % 2 else '') for row in range(1, 11)
+)
+
+FLOWS = {
+    'signup': ['/signup', 'hunter22', 'main'],
+    'balance': ['/balance', 'main'],
+    'balances': ['/balances'],
+    'transfer': ['/transfer', RECEIVER, '0.5', 'main', 'yes'],
+    'bulktransfer': ['/bulktransfer', BULK_ROWS, 'main', 'yes'],
+    'switchnetwork': ['/switchnetwork', 'devnet'],
+    'autonetwork': ['/switchnetwork', 'devnet:auto'],
+}
+
+# The same flows answered with inline buttons where the bot offers them;
+# TAP(n) presses the n-th button of the last prompt. Signup also teaches
+# the wallet picker 'main'.
+def TAP(index):
+    return ('tap', index)
+
+
+BUTTON_FLOWS = {
+    'signup': FLOWS['signup'],
+    'balance': ['/balance', TAP(0)],
+    'balances': FLOWS['balances'],
+    'transfer': ['/transfer', RECEIVER, TAP(1), TAP(0), TAP(0)],
+    'bulktransfer': ['/bulktransfer', BULK_ROWS, TAP(0), TAP(0)],
+    'switchnetwork': ['/switchnetwork', TAP(4)],
+    'autonetwork': ['/switchnetwork', TAP(5)],
+}
+
+
+class FakeTelegram(BaseRequest):
+    def __init__(self):
+        """
+        Bot API stand-in that answers every call locally and records it
+        """
+        self.calls = Counter()
+        self.replies = defaultdict(asyncio.Queue)
+        # chat_id -> (message id, callback_data of each button) of the last prompt
+        self.keyboards = {}
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, text, message_id=None):
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': text or '',
+        }
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        params = request_data.parameters if request_data else {}
+
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint == 'getMyCommands':
+            result = []
+        elif endpoint in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = int(params.get('chat_id', 0))
+            message_id = params.get('message_id')
+            result = self._message(chat_id, params.get('text'), int(message_id) if message_id else None)
+            markup = params.get('reply_markup')
+            markup = json.loads(markup) if isinstance(markup, str) else markup or {}
+            # Documents and edits of older messages (transfer status
+            # updates) leave the current prompt's buttons alone
+            if endpoint == 'sendMessage' or self.keyboards.get(chat_id, (None,))[0] == result['message_id']:
+                self.keyboards[chat_id] = (result['message_id'], [
+                    button['callback_data']
+                    for row in markup.get('inline_keyboard', [])
+                    for button in row
+                    if 'callback_data' in button
+                ])
+            self.replies[chat_id].put_nowait(
+                (time.perf_counter(), endpoint, result['message_id'], params.get('text'))
+            )
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+class StubBackend:
+    def __init__(self, latency_ms=30.0, jitter=0.5, error_rate=0.0, timeout_rate=0.0, batch=True, seed=None):
+        """
+        In-process replacement for API_BASE_URL
+
+        Args:
+            latency_ms (float): Median response latency
+            jitter (float): Log-normal sigma of the latency distribution
+            error_rate (float): Share of requests answered with HTTP 500
+            timeout_rate (float): Share of requests failing with a read timeout
+            batch (bool): Serve /api/balances; otherwise it answers 404
+            seed (int): Random seed for reproducible runs
+        """
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.batch = batch
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.sessions = set()
+        self.status_polls = Counter()
+        self.rpc_urls = Counter()
+        # /api/events stand-in: events queued here are streamed to the bot,
+        # `events_per_connection` per connection to exercise resuming
+        self.events = asyncio.Queue()
+        self.events_per_connection = 100
+        self.event_cursors = []
+        self._event_id = 0
+
+    async def __call__(self, request):
+        self.calls[request.url.path] += 1
+        await asyncio.sleep(self.latency * self.random.lognormvariate(0, self.jitter))
+
+        roll = self.random.random()
+        if roll < self.timeout_rate:
+            raise httpx.ReadTimeout('stub timeout', request=request)
+        if roll < self.timeout_rate + self.error_rate:
+            return httpx.Response(500, json={'error': 'Internal Server Error'})
+
+        path = request.url.path
+        body = json.loads(request.content or b'{}')
+        if 'sessionToken' in body and body['sessionToken'] not in self.sessions:
+            return httpx.Response(401, json={'error': 'Session expired'})
+        if path == '/api/session':
+            token = f"session-{len(self.sessions)}"
+            self.sessions.add(token)
+            return httpx.Response(200, json={'token': token, 'expiresIn': 900})
+        if path == '/api/signup':
+            return httpx.Response(201, json={'publicKey': '4Nd1mBQtrMJVYVfKf2PJy9NZUZdTAsp7D4xWLs4gDB4T'})
+        if path == '/api/balance':
+            return httpx.Response(200, json={'balance': 1_500_000_000})
+        if path == '/api/balances' and self.batch:
+            return httpx.Response(200, json={'balances': [
+                {'walletName': 'main', 'balance': 1_500_000_000},
+                {'walletName': 'savings', 'balance': 250_000_000},
+            ]})
+        if path == '/api/transfer':
+            signature = f"5{len(self.status_polls):087d}"
+            self.status_polls[signature] = 0
+            return httpx.Response(200, json={'signature': signature})
+        if path == '/api/transfer/status':
+            # Confirmed on the first poll, finalized on the second
+            statuses = {}
+            for signature in body.get('signatures', []):
+                self.status_polls[signature] += 1
+                status = 'confirmed' if self.status_polls[signature] == 1 else 'finalized'
+                statuses[signature] = {'status': status}
+            return httpx.Response(200, json={'statuses': statuses})
+        if path == '/api/network/switch':
+            if body.get('rpcUrl'):
+                self.rpc_urls[body['rpcUrl']] += 1
+            return httpx.Response(200, json={'success': True})
+        if path == '/api/events':
+            self.event_cursors.append(request.headers.get('Last-Event-ID'))
+            return httpx.Response(200, headers={'Content-Type': 'text/event-stream'}, content=self.stream_events())
+        return httpx.Response(404, json={'error': 'Not Found'})
+
+    def push_event(self, telegram_id, lamports):
+        """
+        Queue a transfer.received event for the bot's event stream
+        """
+        self.events.put_nowait((telegram_id, lamports))
+
+    async def stream_events(self):
+        yield b': connected\n\n'
+        for _ in range(self.events_per_connection):
+            telegram_id, lamports = await self.events.get()
+            self._event_id += 1
+            data = json.dumps({
+                'telegramId': str(telegram_id),
+                'walletName': 'main',
+                'amount': lamports,
+                'from': '9xQeWvG816bUx9EPjHmaT23yvVM2ZWbrrpZb9PusVFin',
+                'signature': f"4{self._event_id:087d}",
+            })
+            yield f"id: {self._event_id}\nevent: transfer.received\ndata: {data}\n\n".encode('utf-8')
+
+
+class StubRpc:
+    # Devnet candidates with their median latency; the lagging one is
+    # healthy but 1000 slots behind
+    ENDPOINTS = {
+        'https://fast.devnet.stub': (0.005, 0),
+        'https://slow.devnet.stub': (0.050, 0),
+        'https://lagging.devnet.stub': (0.002, 1000),
+    }
+
+    def __init__(self, seed=None):
+        """
+        In-process Solana RPC endpoints for the RPC health prober
+        """
+        self.random = random.Random(seed)
+        self.calls = Counter()
+
+    async def __call__(self, request):
+        url = f"{request.url.scheme}://{request.url.host}"
+        self.calls[url] += 1
+        latency, lag = self.ENDPOINTS[url]
+        await asyncio.sleep(latency * self.random.lognormvariate(0, 0.3))
+        slot = 300_000_000 - lag
+        return httpx.Response(200, json=[
+            {'jsonrpc': '2.0', 'id': 1, 'result': 'ok'},
+            {'jsonrpc': '2.0', 'id': 2, 'result': slot},
+            {'jsonrpc': '2.0', 'id': 3, 'result': 'EtWTRABZaYq6iMfeYKouRu166VU2xqa1wcaWoxPkrZBG'},
+        ])
+
+
+def make_update(update_id, user_id, text):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'language_code': 'en'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_callback_update(update_id, user_id, message_id, data):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'language_code': 'en'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '',
+            },
+        },
+    }
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.telegram = FakeTelegram()
+        self.backend = StubBackend(
+            latency_ms=args.latency_ms,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            timeout_rate=args.timeout_rate,
+            batch=not args.no_batch,
+            seed=args.seed
+        )
+        self.flows = BUTTON_FLOWS if args.buttons else FLOWS
+        self.latencies = defaultdict(list)
+        self.timeouts = 0
+        self.status_edits = 0
+        self._update_id = 0
+
+        self.bot = bot_module.SolanaWalletTelegramBot(bot_token=FAKE_TOKEN, server_url='stub')
+        self.bot.backend = BackendClient(
+            'stub',
+            transport=httpx.MockTransport(self.backend),
+            observer=self.bot.admission.observe
+        )
+        self.bot.transfers.backend = self.bot.backend
+        self.bot.transfers.poll_interval = args.poll_interval
+        self.bot.events.backend = self.bot.backend
+        self.rpc = StubRpc(seed=args.seed)
+        self.bot.rpc_health = RpcHealth(
+            candidates={'devnet': list(StubRpc.ENDPOINTS)},
+            transport=httpx.MockTransport(self.rpc)
+        )
+
+        builder = (
+            Application.builder()
+            .token(FAKE_TOKEN)
+            .request(self.telegram)
+            .get_updates_request(FakeTelegram())
+            .concurrent_updates(UserShardedUpdateProcessor(
+                concurrency=args.concurrency,
+                admission=self.bot.admission
+            ))
+        )
+        if args.rate_limit:
+            builder = builder.rate_limiter(OutboundScheduler())
+        self.application = builder.build()
+        self.bot.setup_handlers(self.application)
+
+    async def send(self, user_id, text):
+        """
+        Feed one message, or a TAP() button press, to the Application and
+        wait for the bot's reply
+
+        Returns:
+            float: Seconds until the reply went out, or None on timeout
+        """
+        self._update_id += 1
+        tapped = None
+        if isinstance(text, tuple):
+            tapped, buttons = self.telegram.keyboards.get(user_id, (0, []))
+            if text[1] >= len(buttons):
+                self.timeouts += 1
+                return None
+            data = make_callback_update(self._update_id, user_id, tapped, buttons[text[1]])
+        else:
+            data = make_update(self._update_id, user_id, text)
+        update = telegram.Update.de_json(data, self.application.bot)
+        started = time.perf_counter()
+        deadline = started + self.args.reply_timeout
+        await self.application.update_queue.put(update)
+        while True:
+            try:
+                replied_at, endpoint, message_id, _ = await asyncio.wait_for(
+                    self.telegram.replies[user_id].get(), max(deadline - time.perf_counter(), 0)
+                )
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return None
+            # A reply is a new message or an edit of the pressed prompt;
+            # anything else is background transfer progress
+            if endpoint == 'sendMessage' or message_id == tapped:
+                return replied_at - started
+            self.status_edits += 1
+
+    async def run_user(self, user_id, flows):
+        for flow in flows:
+            for step, text in enumerate(self.flows[flow]):
+                latency = await self.send(user_id, text)
+                if latency is None:
+                    break
+                self.latencies[f"{flow}[{step}]"].append(latency)
+
+    async def measure_conversation_memory(self, users):
+        """
+        Park `users` users in the middle of /transfer and report traced
+        memory per live conversation
+        """
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        first_id = 10_000_000
+        for user_id in range(first_id, first_id + users):
+            await self.send(user_id, '/transfer')
+            await self.send(user_id, RECEIVER)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return (current - baseline) / users
+
+    async def measure_notifications(self, events):
+        """
+        Stream `events` incoming transfers to 100 subscribed users through
+        the stub event server and time until every notification is sent
+        """
+        first_id = 20_000_000
+        for user_id in range(first_id, first_id + 100):
+            self.bot.notifier.subscribe(str(user_id))
+        started = time.perf_counter()
+        for index in range(events):
+            self.backend.push_event(first_id + index % 100, 1_000_000 * (index + 1))
+        deadline = started + self.args.settle_timeout
+        while time.perf_counter() < deadline:
+            stats = self.bot.notifier.stats()
+            if stats['sent'] + stats['dropped'] + stats['failed'] >= events:
+                break
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        return {
+            'events': events,
+            'seconds': round(elapsed, 3),
+            **self.bot.notifier.stats(),
+            'stream': self.bot.events.stats(),
+            'resumed_from': [cursor for cursor in self.backend.event_cursors if cursor],
+        }
+
+    async def run(self):
+        flows = self.args.flows.split(',')
+        async with self.application:
+            await self.bot.backend.start()
+            await self.bot.transfers.start(self.application.bot)
+            self.bot.bot_data = self.application.bot_data
+            self.bot.notifier.load(self.bot.bot_data)
+            await self.bot.notifier.start(self.application.bot)
+            await self.bot.events.start()
+            await self.application.start()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self.run_user(user_id, flows) for user_id in range(1, self.args.users + 1)
+            ))
+            elapsed = time.perf_counter() - started
+
+            # Give bulk lists time to finish and the transfer tracker time
+            # to settle what it is following
+            settle_deadline = time.perf_counter() + self.args.settle_timeout
+            while time.perf_counter() < settle_deadline:
+                transfer_stats = self.bot.transfers.stats()
+                if not transfer_stats['queued'] and not transfer_stats['tracking'] \
+                        and not self.bot.bulk_transfers.running:
+                    break
+                await asyncio.sleep(0.1)
+
+            memory_per_conversation = await self.measure_conversation_memory(self.args.memory_users)
+            notifications = await self.measure_notifications(self.args.events)
+
+            await self.application.stop()
+            await self.bot.events.stop()
+            await self.bot.notifier.stop()
+            await self.bot.transfers.stop()
+            await self.bot.backend.close()
+            await self.bot.rpc_health.close()
+
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        return {
+            'users': self.args.users,
+            'flows': flows,
+            'updates': len(all_latencies),
+            'timeouts': self.timeouts,
+            'elapsed_seconds': round(elapsed, 3),
+            'updates_per_second': round(len(all_latencies) / elapsed, 1) if elapsed else 0.0,
+            'latency_ms': {
+                'p50': round(percentile(all_latencies, 0.50) * 1000, 2),
+                'p95': round(percentile(all_latencies, 0.95) * 1000, 2),
+                'p99': round(percentile(all_latencies, 0.99) * 1000, 2),
+            },
+            'latency_ms_by_step': {
+                step: {
+                    'p50': round(percentile(values, 0.50) * 1000, 2),
+                    'p95': round(percentile(values, 0.95) * 1000, 2),
+                    'p99': round(percentile(values, 0.99) * 1000, 2),
+                }
+                for step, values in sorted(self.latencies.items())
+            },
+            'memory_bytes_per_conversation': round(memory_per_conversation),
+            'transfers': self.bot.transfers.stats(),
+            'bulk_transfers': self.bot.bulk_transfers.stats(),
+            'admission': self.bot.admission.stats(),
+            'notifications': notifications,
+            'status_edits': self.status_edits,
+            'bot_api_calls': dict(self.telegram.calls),
+            'backend_calls': dict(self.backend.calls),
+            'rpc_probes': dict(self.rpc.calls),
+            'switched_to_rpc': dict(self.backend.rpc_urls),
+        }
+
+
+def print_report(report):
+    print(f"👥 Users: {report['users']}  Flows: {', '.join(report['flows'])}")
+    print(f"📨 Updates: {report['updates']} in {report['elapsed_seconds']}s "
+          f"({report['updates_per_second']} updates/s), timeouts: {report['timeouts']}")
+    latency = report['latency_ms']
+    print(f"⏱️  Reply latency p50/p95/p99: {latency['p50']} / {latency['p95']} / {latency['p99']} ms")
+    for step, values in report['latency_ms_by_step'].items():
+        print(f"   {step:<18} {values['p50']:>9} {values['p95']:>9} {values['p99']:>9}")
+    print(f"🧠 Memory per active conversation: {report['memory_bytes_per_conversation']} bytes")
+    transfers = report['transfers']
+    print(f"💸 Transfers: {transfers['submitted']} sent, {transfers['finalized']} finalized, "
+          f"{transfers['failed']} failed, {transfers['status_requests']} status requests")
+    bulk = report['bulk_transfers']
+    if bulk['lists']:
+        print(f"🚚 Bulk transfers: {bulk['lists']} lists, {bulk['sent']} rows sent, "
+              f"{bulk['rejected']} rejected, {bulk['progress_edits']} progress edits")
+    notifications = report['notifications']
+    if notifications['events']:
+        print(f"🔔 Notifications: {notifications['sent']}/{notifications['events']} events delivered in "
+              f"{notifications['seconds']}s over {notifications['stream']['connects']} stream connections")
+    admission = report['admission']
+    print(f"🚦 Admission: limit {admission['limit']}, {admission['admitted']} admitted, "
+          f"{admission['rejected_busy']} turned away busy, {admission['duplicates']} duplicates dropped, "
+          f"{admission['decreases']} limit cuts")
+    print(f"📤 Bot API calls: {report['bot_api_calls']}")
+    print(f"🔌 Backend calls: {report['backend_calls']}")
+    if report['rpc_probes']:
+        print(f"🩺 RPC probes: {report['rpc_probes']}, switched to: {report['switched_to_rpc']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help='simulated users')
+    parser.add_argument('--flows', default='signup,balance,transfer,switchnetwork',
+                        help='comma separated flows each user runs in order')
+    parser.add_argument('--concurrency', type=int, default=bot_module.UPDATE_CONCURRENCY,
+                        help='update shards (UPDATE_CONCURRENCY)')
+    parser.add_argument('--latency-ms', type=float, default=30.0, help='median backend latency')
+    parser.add_argument('--jitter', type=float, default=0.5, help='log-normal sigma of backend latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of backend HTTP 500s')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='share of backend timeouts')
+    parser.add_argument('--buttons', action='store_true', help='answer with inline buttons where offered')
+    parser.add_argument('--no-batch', action='store_true', help='stub backend without /api/balances')
+    parser.add_argument('--rate-limit', action='store_true', help='enable the outbound Telegram rate limiter')
+    parser.add_argument('--memory-users', type=int, default=500, help='parked conversations for the memory probe')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='transfer status poll interval')
+    parser.add_argument('--settle-timeout', type=float, default=10.0,
+                        help='seconds to wait for tracked transfers to finalize')
+    parser.add_argument('--events', type=int, default=0,
+                        help='incoming transfer events streamed to subscribed users')
+    parser.add_argument('--reply-timeout', type=float, default=60.0, help='seconds to wait for each reply')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    flows = args.flows.split(',')
+    for flow in flows:
+        if flow not in FLOWS:
+            parser.error(f"unknown flow {flow!r}, choose from {', '.join(FLOWS)}")
+    if flows[0] != 'signup':
+        parser.error("the first flow must be signup, it opens the session the others use")
+
+    # One INFO line per stub request would dominate the run
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    report = asyncio.run(Benchmark(args).run())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
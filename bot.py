@@ -1,19 +1,180 @@
 import os
+import re
+import json
+import asyncio
+import hmac
+import hashlib
+import signal
+import urllib.parse
+import contextlib
+import functools
+import secrets
+import uuid
 import logging
-import requests
+import httpx
 import telegram
 from telegram.ext import (
-    Updater, CommandHandler, ConversationHandler, 
-    MessageHandler, filters as Filters, Application,
-    CallbackQueryHandler
+    CommandHandler, Application,
+    CallbackQueryHandler, TypeHandler
 )
 from dotenv import load_dotenv
 
+from backend_client import BackendClient
+from webhook_server import run_webhook, run_ingress_webhook, RouteApp, BackgroundServer
+from worker_pool import WorkerPool, serve_inbox
+from graceful import run_polling, SourceWatcher, restart_process
+from persistence import StatePersistence, MemoryStore, store_from_url
+from cache import TTLCache
+from session_tokens import SessionTokenCache
+from transfer_pipeline import TransferPipeline, TransferJob, TransferRejected, SessionExpired
+from notifications import EventStream, Notifier, CURSOR_KEY
+from rpc_health import RpcHealth
+from admission import AdmissionController, BUSY
+from bulk_transfer import BulkTransferRunner, BulkTransfer, BulkRow, parse_rows, is_solana_address
+from broadcast import RecipientStore, BroadcastRunner, Broadcast, ALL
+from rate_limiter import OutboundScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from update_processor import UserShardedUpdateProcessor
+from conversation_state import ConversationLifecycle, FLOW_TIMEOUTS
+from flow_router import FlowRouter, Flow, Step, RetryStep, required, one_of
+from structured_logging import LogPipeline
+from diagnostics import LoopLagMonitor, SamplingProfiler, dump_tasks
+from metrics import (
+    SERVER_ERRORS, handle_metrics, instrument_handler,
+    timed_callback, track_component, track_conversations
+)
+
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 API_BASE_URL = os.getenv('API_BASE_URL')
 API_TOKEN = os.getenv('API_TOKEN')
 
+# Serving mode: 'polling' (default) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+PORT = int(os.getenv('PORT', '8080'))
+
+# Conversation and user_data store shared by all workers; empty disables it
+PERSISTENCE_URL = os.getenv('PERSISTENCE_URL', 'sqlite:///bot_state.sqlite3')
+
+# Balance cache
+BALANCE_CACHE_TTL = float(os.getenv('BALANCE_CACHE_TTL', '15'))
+BALANCE_CACHE_SIZE = int(os.getenv('BALANCE_CACHE_SIZE', '10000'))
+# /balances requests in flight per user when the backend has no batch endpoint
+BALANCE_FANOUT_CONCURRENCY = int(os.getenv('BALANCE_FANOUT_CONCURRENCY', '4'))
+
+# Background transfer sending and confirmation tracking
+TRANSFER_WORKERS = int(os.getenv('TRANSFER_WORKERS', '8'))
+TRANSFER_POLL_INTERVAL = float(os.getenv('TRANSFER_POLL_INTERVAL', '2'))
+TRANSFER_TRACK_TIMEOUT = float(os.getenv('TRANSFER_TRACK_TIMEOUT', '300'))
+
+# /bulktransfer: rows and CSV size accepted, transfers sent at once across
+# every list, and minimum seconds between progress edits
+BULK_MAX_ROWS = int(os.getenv('BULK_MAX_ROWS', '1000'))
+BULK_MAX_FILE_SIZE = int(os.getenv('BULK_MAX_FILE_SIZE', str(256 * 1024)))
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '4'))
+BULK_PROGRESS_INTERVAL = float(os.getenv('BULK_PROGRESS_INTERVAL', '2'))
+
+# Admission control: backend-calling flow actions allowed in flight at
+# start, and the bounds the limit adapts between as backend latency changes
+ADMISSION_INITIAL_LIMIT = int(os.getenv('ADMISSION_INITIAL_LIMIT', '32'))
+ADMISSION_MIN_LIMIT = int(os.getenv('ADMISSION_MIN_LIMIT', '4'))
+ADMISSION_MAX_LIMIT = int(os.getenv('ADMISSION_MAX_LIMIT', '256'))
+
+# Push notifications: whether this process holds the backend event stream
+# (enable it on exactly one replica), senders draining the notification
+# queue, and how many notifications may wait before new ones are dropped
+EVENT_STREAM = os.getenv('EVENT_STREAM', 'on') == 'on'
+NOTIFICATION_WORKERS = int(os.getenv('NOTIFICATION_WORKERS', '2'))
+NOTIFICATION_QUEUE_SIZE = int(os.getenv('NOTIFICATION_QUEUE_SIZE', '10000'))
+
+# RPC health probing: extra candidate endpoints per cluster as JSON, e.g.
+# {"devnet": ["https://devnet.example.com"]}, seconds a probe is reused (and
+# between background re-probes), probe timeout, how many slots an endpoint
+# may trail its cluster, and whether custom RPC URLs may point at private
+# addresses (e.g. a local validator)
+RPC_CANDIDATES = json.loads(os.getenv('RPC_CANDIDATES') or '{}')
+RPC_PROBE_TTL = float(os.getenv('RPC_PROBE_TTL', '60'))
+RPC_PROBE_TIMEOUT = float(os.getenv('RPC_PROBE_TIMEOUT', '3'))
+RPC_MAX_SLOT_LAG = int(os.getenv('RPC_MAX_SLOT_LAG', '150'))
+RPC_ALLOW_PRIVATE = os.getenv('RPC_ALLOW_PRIVATE', 'off') == 'on'
+
+# Backend session tokens: upper bound on their lifetime and sessions kept
+SESSION_TTL = float(os.getenv('SESSION_TTL', '600'))
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+
+# Updates from different users handled in parallel; one user's stay in order
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+UPDATE_SHARD_BACKLOG = int(os.getenv('UPDATE_SHARD_BACKLOG', '64'))
+
+# Supervisor mode: worker processes each running the full bot, fed by one
+# ingress that keeps every user on the same worker ('auto' is one per core;
+# 1 runs the bot in this process), updates allowed to wait per worker, and
+# seconds between per-worker load reports
+WORKERS = os.cpu_count() if os.getenv('WORKERS') == 'auto' else int(os.getenv('WORKERS', '1'))
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '1000'))
+WORKER_REPORT_INTERVAL = float(os.getenv('WORKER_REPORT_INTERVAL', '60'))
+
+# Telegram's overall outbound message limit, split between workers
+BOT_API_RATE = 30
+
+# Conversation lifecycle
+MAX_CONVERSATIONS = int(os.getenv('MAX_CONVERSATIONS', '10000'))
+USER_DATA_IDLE_TTL = float(os.getenv('USER_DATA_IDLE_TTL', '900'))
+SWEEP_INTERVAL = float(os.getenv('SWEEP_INTERVAL', '60'))
+# How often idle flows are checked for their timeout, in seconds
+FLOW_EXPIRY_INTERVAL = float(os.getenv('FLOW_EXPIRY_INTERVAL', '5'))
+
+# Logging: root level, 'json' lines or 'text', share of records kept per
+# level as JSON (e.g. {"DEBUG": 0.05}; WARNING and above are always kept,
+# and a trace is kept or dropped whole), records allowed to wait for the
+# writer thread, and seconds after which an update is logged as slow
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_SAMPLE_RATES = json.loads(os.getenv('LOG_SAMPLE_RATES') or '{}')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+SLOW_UPDATE_SECONDS = float(os.getenv('SLOW_UPDATE_SECONDS', '5'))
+
+# Shutdown: seconds updates already received get to finish once fetching
+# stops; updates not started by then are replayed by the next process.
+# DEV_RELOAD=on restarts the bot the same way whenever a .py file in this
+# directory changes (development only; polling with one process)
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '10'))
+DEV_RELOAD = os.getenv('DEV_RELOAD', 'off') == 'on'
+
+# Diagnostics: telegram ids allowed to use /diag and /broadcast (comma
+# separated; empty disables them), seconds without an event loop heartbeat logged as a stall
+# with the blocking stack (0 disables the monitor), and the longest profile
+ADMIN_IDS = {admin_id.strip() for admin_id in os.getenv('ADMIN_IDS', '').split(',') if admin_id.strip()}
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.25'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+
+# /broadcast (ADMIN_IDS only): messages waiting for the outbound limiter at
+# once, whether to send with allow_paid_broadcast (Telegram Stars are charged
+# above 30 messages/s), the paid rate, and seconds between progress edits
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '50'))
+BROADCAST_PAID = os.getenv('BROADCAST_PAID', 'off') == 'on'
+BROADCAST_PAID_RATE = float(os.getenv('BROADCAST_PAID_RATE', '1000'))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '5'))
+
+# Local Prometheus endpoint; empty METRICS_PORT disables it
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = os.getenv('METRICS_PORT', '9090')
+
+NETWORKS = ['mainnet-beta', 'testnet', 'devnet', 'custom']
+# "<cluster>:auto" switches to the cluster's fastest healthy RPC endpoint
+AUTO_SUFFIX = ':auto'
+# Amount buttons offered by /transfer, in SOL
+TRANSFER_PRESETS = ['0.1', '0.5', '1']
+# Wallet names offered by the wallet picker
+RECENT_WALLETS = 5
+# Inline button data of the main menu: 'menu|<command>'
+MENU_CALLBACK_PREFIX = 'menu|'
+# bot_data key of the last update id seen and the updates a drain set aside
+UPDATES_KEY = 'update_processor'
+
 default_keys = [
     {
         'name': 'Help',
@@ -37,42 +198,118 @@ commands = [
     {"command": "help", "description": "Get a list of available commands with their use."},
     {"command": "signup", "description": "Register with your telegram account."},
     {"command": "balance", "description": "Check wallet balance."},
+    {"command": "balances", "description": "Check the balance of all your wallets."},
     {"command": "transfer", "description": "Transfer SOL to another wallet."},
+    {"command": "bulktransfer", "description": "Send SOL to many addresses from a CSV list."},
     {"command": "switchnetwork", "description": "Switch Solana networks."},
+    {"command": "notifications", "description": "Turn incoming transfer notifications on or off."},
+    {"command": "cancel", "description": "Cancel the current operation."},
 ]
 
+# Per-language command lists, keyed by IETF language code. `commands` is
+# registered as the default for every user whose language is not listed here.
+localized_commands = {}
+
 class SolanaWalletTelegramBot:
-    def __init__(self, bot_token, server_url):
+    def __init__(self, bot_token, server_url, worker=None):
         """
         Initialize Telegram Solana Wallet Bot
         
         Args:
             bot_token (str): Telegram Bot API token
             server_url (str): Backend server base URL
+            worker (tuple): (index, count) when running as a supervised
+                worker process
         """
-        # Logging setup
-        logging.basicConfig(
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-            level=logging.INFO
+        # Logging setup: records are queued and written by a background thread
+        self.log_pipeline = LogPipeline(
+            level=LOG_LEVEL,
+            sample_rates=LOG_SAMPLE_RATES,
+            queue_size=LOG_QUEUE_SIZE,
+            json_output=LOG_FORMAT == 'json'
         )
+        self.log_pipeline.install()
         self.logger = logging.getLogger(__name__)
         
         # Bot configuration
         self.bot_token = bot_token
         self.server_url = server_url
-        
-        # Conversation states
-        (
-            self.SIGNUP_PASSWORD,
-            self.NETWORK_SELECTION,
-            self.CUSTOM_RPC_URL,
-            self.WALLET_NAME,
-            self.BALANCE,
-            self.TRANSFER_RECEIVER,
-            self.TRANSFER_AMOUNT,
-            self.TRANSFER_WALLET
-        ) = range(8)
-            
+        self.worker = worker
+        # The supervisor serves METRICS_PORT, worker N the N+1th port after it;
+        # each worker resumes the event stream from its own cursor
+        self.metrics_port = int(METRICS_PORT) if METRICS_PORT else None
+        self.cursor_key = CURSOR_KEY
+        self.updates_key = UPDATES_KEY
+        if worker is not None:
+            if self.metrics_port is not None:
+                self.metrics_port += 1 + worker[0]
+            self.cursor_key = f"{CURSOR_KEY}:{worker[0]}"
+            self.updates_key = f"{UPDATES_KEY}:{worker[0]}"
+        self.admission = AdmissionController(
+            initial_limit=ADMISSION_INITIAL_LIMIT,
+            min_limit=ADMISSION_MIN_LIMIT,
+            max_limit=ADMISSION_MAX_LIMIT
+        )
+        self.backend = BackendClient(server_url, observer=self.admission.observe)
+        self.balance_cache = TTLCache(maxsize=BALANCE_CACHE_SIZE, ttl=BALANCE_CACHE_TTL)
+        # Per-process key so cache entries are bound to the password that
+        # fetched them without keeping the password itself around
+        self._cache_key_secret = secrets.token_bytes(32)
+        self.transfers = TransferPipeline(
+            self.backend,
+            submit=self.send_transfer,
+            on_change=self.transfer_changed,
+            api_token=API_TOKEN,
+            workers=TRANSFER_WORKERS,
+            poll_interval=TRANSFER_POLL_INTERVAL,
+            track_timeout=TRANSFER_TRACK_TIMEOUT
+        )
+        self.bulk_transfers = BulkTransferRunner(
+            submit=self.send_transfer,
+            on_change=self.transfer_changed,
+            concurrency=BULK_CONCURRENCY,
+            progress_interval=BULK_PROGRESS_INTERVAL
+        )
+        self.notifier = Notifier(workers=NOTIFICATION_WORKERS, queue_size=NOTIFICATION_QUEUE_SIZE)
+        self.events = EventStream(self.backend, on_event=self.handle_account_event, api_token=API_TOKEN)
+        self.bot_data = {}
+        self.rpc_health = RpcHealth(
+            candidates=RPC_CANDIDATES,
+            ttl=RPC_PROBE_TTL,
+            timeout=RPC_PROBE_TIMEOUT,
+            max_slot_lag=RPC_MAX_SLOT_LAG,
+            allow_private=RPC_ALLOW_PRIVATE
+        )
+        self.sessions = SessionTokenCache(maxsize=SESSION_CACHE_SIZE, max_ttl=SESSION_TTL)
+        # Cleared if the backend turns out not to have /api/session
+        self.sessions_supported = True
+        # Cleared if the backend turns out not to have /api/balances
+        self.batch_balances_supported = True
+        # Users seen in private chats, the audience of /broadcast
+        self.recipients = RecipientStore(store_from_url(PERSISTENCE_URL) if PERSISTENCE_URL else MemoryStore())
+        self.broadcasts = BroadcastRunner(
+            self.recipients,
+            on_blocked=self.notifier.unsubscribe,
+            owner=worker[0] if worker is not None else 0,
+            concurrency=BROADCAST_CONCURRENCY,
+            paid=BROADCAST_PAID,
+            progress_interval=BROADCAST_PROGRESS_INTERVAL
+        )
+        self.metrics_server = None
+        self.loop_monitor = LoopLagMonitor(threshold=LOOP_LAG_THRESHOLD)
+        self.profiler = SamplingProfiler()
+        self.lifecycle = ConversationLifecycle(
+            max_conversations=MAX_CONVERSATIONS,
+            idle_ttl=USER_DATA_IDLE_TTL,
+            owns_user=self.owns_user
+        )
+        self.router = FlowRouter(
+            self.build_flows(),
+            timeout_message="⌛ Session timed out. Start again whenever you're ready.",
+            max_document_size=BULK_MAX_FILE_SIZE
+        )
+        self.lifecycle.attach(self.router)
+
     def extract_telegram_user_info(self, update):
         """
         Extract comprehensive user information from Telegram
@@ -89,17 +326,17 @@ class SolanaWalletTelegramBot:
             'language_code': user.language_code
         }
 
-    async def handle_server_error(self, update, error_response):
+    def format_server_error(self, error_response):
         """
-        Standardized error handling for server responses
-        
+        User-facing text for an error response from the server
+
         Args:
-            update (Update): Telegram update object
             error_response (dict): Error response from server
         """
         # Extract error details
         error = error_response.get('error', 'Unknown Error')
         details = error_response.get('details', '')
+        SERVER_ERRORS.inc(category=str(error)[:64])
 
         if error == "Account not found":
             error = "You have 0 SOL in your account. Please deposit some SOL to continue."
@@ -113,78 +350,696 @@ class SolanaWalletTelegramBot:
                 error_message += f"\n📝 Details: The wallet you sent the index for doesn't exist."
             else:    
                 error_message += f"\n📝 Details: {details}"
+        return error_message
+
+    async def handle_server_error(self, update, error_response):
+        """
+        Standardized error handling for server responses
         
+        Args:
+            update (Update): Telegram update object
+            error_response (dict): Error response from server
+        """
         # Send error to user
-        await update.message.reply_text(error_message)
+        await update.effective_message.reply_text(self.format_server_error(error_response))
     
-    async def set_commands(self, update):
-        response = requests.post(
-            f"https://api.telegram.org/bot{self.bot_token}/setMyCommands",
-            json={"commands": commands}
+    async def post_init(self, application):
+        """
+        Application startup hook: open the shared backend connection pool,
+        register the command menu and start the metrics endpoint
+        """
+        await self.backend.start()
+        if LOOP_LAG_THRESHOLD > 0:
+            await self.loop_monitor.start()
+        await self.transfers.start(application.bot)
+        await self.rpc_health.start()
+        # Subscriptions and the event cursor live in bot_data so they are
+        # persisted; resume the stream where the last process left it
+        self.bot_data = application.bot_data
+        self.notifier.load(self.bot_data)
+        self.events.cursor = self.bot_data.get(self.cursor_key)
+        await self.notifier.start(application.bot)
+        if EVENT_STREAM:
+            await self.events.start()
+        await self.register_commands(application.bot)
+        # Resume flows that were in progress when the last process stopped,
+        # then the updates it didn't get to
+        self.router.restore(application)
+        if hasattr(application.update_processor, 'resume'):
+            application.update_processor.resume(application, self.bot_data.setdefault(self.updates_key, {}))
+        await self.recipients.start()
+        await self.broadcasts.resume(application)
+
+        if application.job_queue is not None:
+            application.job_queue.run_repeating(
+                self.router.expire,
+                interval=FLOW_EXPIRY_INTERVAL,
+                first=FLOW_EXPIRY_INTERVAL,
+                name='flow_expiry'
+            )
+            application.job_queue.run_repeating(
+                self.rpc_health.refresh,
+                interval=RPC_PROBE_TTL,
+                first=1,
+                name='rpc_probe'
+            )
+            application.job_queue.run_repeating(
+                self.lifecycle.sweep,
+                interval=SWEEP_INTERVAL,
+                first=SWEEP_INTERVAL,
+                name='conversation_sweeper'
+            )
+
+        track_component('balance_cache', self.balance_cache.stats)
+        track_component('sessions', self.sessions.stats)
+        track_component('transfers', self.transfers.stats)
+        track_component('bulk_transfers', self.bulk_transfers.stats)
+        track_component('event_stream', self.events.stats)
+        track_component('rpc_health', self.rpc_health.stats)
+        track_component('admission', self.admission.stats)
+        track_component('notifications', self.notifier.stats)
+        track_component('conversations', self.lifecycle.stats)
+        track_component('flows', self.router.stats)
+        track_component('logging', self.log_pipeline.stats)
+        track_component('event_loop', self.loop_monitor.stats)
+        track_component('recipients', self.recipients.stats)
+        track_component('broadcasts', self.broadcasts.stats)
+        if hasattr(application.bot.rate_limiter, 'stats'):
+            track_component('outbound', application.bot.rate_limiter.stats)
+        if hasattr(application.update_processor, 'stats'):
+            track_component('update_shards', application.update_processor.stats)
+        if self.metrics_port:
+            self.metrics_server = BackgroundServer(
+                RouteApp({
+                    ('GET', '/metrics'): handle_metrics,
+                    ('GET', '/debug/tasks'): self.handle_debug_tasks,
+                    ('GET', '/debug/profile'): self.handle_debug_profile,
+                }),
+                host=METRICS_LISTEN,
+                port=self.metrics_port
+            )
+            await self.metrics_server.start()
+
+    async def post_stop(self, application):
+        """
+        Application stop hook: close the event stream, then let queued
+        notifications and transfers go out while the bot can still send
+        """
+        await self.events.stop()
+        await self.notifier.stop()
+        await self.transfers.stop()
+        await self.broadcasts.stop()
+        await self.recipients.stop()
+
+    async def post_shutdown(self, application):
+        """
+        Application shutdown hook: close the shared backend connection pool,
+        the RPC prober and the metrics server
+        """
+        await self.backend.close()
+        await self.rpc_health.close()
+        await self.recipients.store.close()
+        await self.loop_monitor.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+
+    @staticmethod
+    def commands_digest(command_list):
+        """
+        Stable hash of a command list, used to detect changes
+
+        Args:
+            command_list (list): Dicts with 'command' and 'description' keys
+        """
+        encoded = json.dumps(
+            [[c['command'], c['description']] for c in command_list],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    async def register_commands(self, bot):
+        """
+        Push the command menu to Telegram, once per language scope, only if
+        what Telegram currently reports differs from our `commands` lists.
+        """
+        scopes = {None: commands, **localized_commands}
+        for language_code, command_list in scopes.items():
+            try:
+                current = await bot.get_my_commands(language_code=language_code)
+                current_digest = self.commands_digest(
+                    [{'command': c.command, 'description': c.description} for c in current]
+                )
+                if current_digest == self.commands_digest(command_list):
+                    continue
+
+                await bot.set_my_commands(
+                    [(c['command'], c['description']) for c in command_list],
+                    language_code=language_code
+                )
+                self.logger.info(f"Registered bot commands (language={language_code or 'default'})")
+            except telegram.error.TelegramError as e:
+                self.logger.error(f"Command registration error: {e}")
+
+    async def send_reply(self, update, context, text, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        Reply in the update's chat with an outbound queue priority.
+        Message.reply_text can't carry rate_limit_args, so go through the bot.
+        """
+        rate_limit_args = {'priority': priority} if context.bot.rate_limiter else None
+        return await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+            rate_limit_args=rate_limit_args,
+            **kwargs
         )
-        if response.status_code != 200:
-            await self.handle_server_error(update, response.json())
 
     async def start_command(self, update, context): 
         """
         Start command handler
         """
-        await self.set_commands(update) # Set commands
-        await update.message.reply_text(
+        await self.send_reply(update, context,
         "🚀 **Welcome to the Solana Wallet Bot!**\n\n"
         "Here's how you can get started:\n\n"
         "1️⃣ /signup - Register your telegram account\n"
         "💰 /balance - Check your wallet balance\n"
+        "📊 /balances - Check all your wallets at once\n"
         "💸 /transfer - Send SOL to another wallet\n"
-        "🌐 /switchnetwork - Switch between Solana networks\n\n"
+        "🚚 /bulktransfer - Send SOL to many addresses from a CSV list\n"
+        "🌐 /switchnetwork - Switch between Solana networks\n"
+        "🔔 /notifications - Get notified of incoming transfers\n"
+        "❌ /cancel - Cancel the current operation\n\n"
         "🔹 Available Networks:\n"
         "   - mainnet-beta\n"
         "   - testnet\n"
         "   - devnet\n"
         "   - custom (connect to Solana using your own RPC URL)\n\n"
-        "🔄 Use /help anytime to view this message again!"
+        "🔄 Use /help anytime to view this message again!",
+        priority=PRIORITY_LOW,
+        reply_markup=self.menu_keyboard()
     )
 
+    @staticmethod
+    def menu_keyboard():
+        """
+        Inline main menu built from `default_keys`, two buttons per row
+        """
+        buttons = [
+            telegram.InlineKeyboardButton(key['name'], callback_data=f"{MENU_CALLBACK_PREFIX}{key['command']}")
+            for key in default_keys
+        ]
+        return telegram.InlineKeyboardMarkup([buttons[i:i + 2] for i in range(0, len(buttons), 2)])
 
-    async def signup_command(self, update, context):
+    async def menu_callback(self, update, context):
         """
-        Initiate signup process
+        Main menu button: turn the menu message into the first prompt of
+        the chosen flow
         """
-        await update.message.reply_text(
-            "🚀 Welcome to Solana Wallet Signup!\n"
-            "Please enter a secure password to create your wallet:"
+        query = update.callback_query
+        await query.answer()
+        command = query.data[len(MENU_CALLBACK_PREFIX):]
+        flow = self.router.flow_for_command(command)
+        if flow is not None:
+            await self.router.begin(update, context, flow, edit=True)
+        else:
+            await self.start_command(update, context)
+
+
+    async def notifications_command(self, update, context):
+        """
+        Toggle push notifications for incoming transfers
+        """
+        telegram_id = str(update.effective_user.id)
+        if self.notifier.is_subscribed(telegram_id):
+            self.notifier.unsubscribe(telegram_id)
+            await update.effective_message.reply_text(
+                "🔕 Notifications off. Send /notifications to turn them back on."
+            )
+            return
+        self.notifier.subscribe(telegram_id)
+        await update.effective_message.reply_text(
+            "🔔 Notifications on. You'll get a message whenever SOL arrives in your wallets."
+        )
+
+    async def diag_command(self, update, context):
+        """
+        Admin diagnostics: `/diag` for event loop health, `/diag tasks` for
+        live tasks and backend calls, `/diag profile [seconds]` for a
+        sampling profile by handler
+        """
+        if str(update.effective_user.id) not in ADMIN_IDS:
+            return
+        args = context.args or []
+        command = args[0].lower() if args else ''
+        if command == 'tasks':
+            await self.send_diagnostics(update, context, dump_tasks(self.backend), 'tasks.txt', "🧵 Live tasks")
+        elif command == 'profile':
+            if self.profiler.running:
+                await update.effective_message.reply_text("⏳ A profile is already running.")
+                return
+            try:
+                seconds = min(PROFILE_MAX_SECONDS, max(1.0, float(args[1]))) if len(args) > 1 else 10.0
+            except ValueError:
+                await update.effective_message.reply_text("❌ Usage: /diag profile [seconds]")
+                return
+            await update.effective_message.reply_text(f"🔬 Profiling for {seconds:g}s…")
+            # In the background, so the admin's update shard isn't held up
+            context.application.create_task(self.profile_to_chat(update, context, seconds), update=update)
+        else:
+            loop = self.loop_monitor.stats()
+            await update.effective_message.reply_text(
+                f"🩺 Event loop: {loop['stalls']} stalls, max lag {loop['max_lag_ms']}ms\n"
+                f"Tasks: {len(asyncio.all_tasks())}, backend calls in flight: {len(self.backend.in_flight())}\n"
+                "Use /diag tasks or /diag profile [seconds] for details."
+            )
+
+    async def profile_to_chat(self, update, context, seconds):
+        report = await self.profiler.profile(seconds)
+        await self.send_diagnostics(update, context, report, 'profile.txt', f"🔬 Profile of {seconds:g}s")
+
+    async def send_diagnostics(self, update, context, report, filename, caption):
+        try:
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id,
+                document=report.encode('utf-8'),
+                filename=filename,
+                caption=caption
+            )
+        except telegram.error.TelegramError as e:
+            self.logger.error(f"Diagnostics reply error: {e}")
+
+    async def handle_debug_tasks(self, scope, body):
+        """
+        RouteApp handler for GET /debug/tasks
+        """
+        return 200, 'text/plain; charset=utf-8', dump_tasks(self.backend).encode('utf-8')
+
+    async def handle_debug_profile(self, scope, body):
+        """
+        RouteApp handler for GET /debug/profile?seconds=N
+        """
+        query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        try:
+            seconds = min(PROFILE_MAX_SECONDS, max(1.0, float(query.get('seconds', ['10'])[0])))
+        except ValueError:
+            return 400, 'text/plain', b'seconds must be a number'
+        if self.profiler.running:
+            return 409, 'text/plain', b'A profile is already running'
+        report = await self.profiler.profile(seconds)
+        return 200, 'text/plain; charset=utf-8', report.encode('utf-8')
+
+    async def cancel_command(self, update, context):
+        """
+        Abort the current flow and forget what it collected
+        """
+        self.router.end(context.application, update.effective_user.id, discard=True)
+
+        await update.effective_message.reply_text(
+            "🚫 Operation cancelled.",
+            reply_markup=telegram.ReplyKeyboardRemove()
+        )
+
+    @staticmethod
+    def parse_amount(text):
+        try:
+            return float(text)
+        except ValueError:
+            raise ValueError("❌ Invalid amount. Please enter a valid number.")
+
+    @staticmethod
+    def parse_address(text):
+        text = (text or '').strip()
+        if not is_solana_address(text):
+            raise ValueError("❌ Invalid address. Please enter a valid Solana wallet address:")
+        return text
+
+    def parse_bulk_rows(self, text):
+        return parse_rows(text, self.parse_amount, max_rows=BULK_MAX_ROWS)
+
+    @staticmethod
+    def wallet_choices(user_data):
+        return [(name, name) for name in user_data.get('wallets', [])]
+
+    @staticmethod
+    def remember_wallet(context, wallet_name):
+        """
+        Keep the user's most recently used wallet names for the wallet picker
+        """
+        wallets = [name for name in context.user_data.get('wallets', []) if name != wallet_name]
+        context.user_data['wallets'] = [wallet_name] + wallets[:RECENT_WALLETS - 1]
+
+    @staticmethod
+    def transfer_summary(user_data):
+        return (
+            f"📝 Send {user_data.get('transfer_amount')} SOL\n"
+            f"From: {user_data.get('wallet_name')}\n"
+            f"To: {user_data.get('receiver_address')}\n\n"
+        )
+
+    @staticmethod
+    def bulk_summary(user_data):
+        rows = user_data.get('bulk_rows') or []
+        total = sum(row[2] for row in rows)
+        return (
+            f"📝 Send {len(rows)} transfers, {total:g} SOL in total\n"
+            f"From: {user_data.get('wallet_name')} (unless a row names another wallet)\n\n"
+        )
+
+    @staticmethod
+    def network_choices(user_data):
+        # Each cluster next to its fastest-endpoint variant, custom last
+        choices = []
+        for network in NETWORKS:
+            choices.append((network, network))
+            if network != 'custom':
+                choices.append((f"⚡ {network} fastest", network + AUTO_SUFFIX))
+        return choices
+
+    @staticmethod
+    def is_admin(update):
+        return str(update.effective_user.id) in ADMIN_IDS
+
+    def parse_segment(self, text):
+        segment = (text or '').strip().lower()
+        if segment != ALL and segment not in dict(self.recipients.languages()):
+            raise ValueError("❌ Unknown audience. Choose one of the options, or send a language code:")
+        return segment
+
+    def segment_choices(self, user_data):
+        return [(f"Everyone ({len(self.recipients)})", ALL)] + [
+            (f"{language} ({count})", language) for language, count in self.recipients.languages()
+        ]
+
+    @staticmethod
+    def broadcast_summary(user_data):
+        return (
+            f"📣 To: {user_data.get('broadcast_segment')}\n\n"
+            f"{user_data.get('broadcast_text')}\n\n"
         )
-        return self.SIGNUP_PASSWORD
 
-    async def password_handler(self, update, context):
+    def has_session(self, update):
+        return self.sessions.has(str(update.effective_user.id))
+
+    @staticmethod
+    def custom_rpc_step(update, context):
+        if context.user_data.get('network') == 'custom' and not context.user_data.get('rpc_url'):
+            return 'rpc_url'
+        return None
+
+    def build_flows(self):
+        """
+        Step tables of every conversation. Each step stores its validated
+        answer under `key` in user_data; the action runs after the last one.
+        """
+        password_prompt = "🔑 Enter your password:"
+        return [
+            Flow(
+                name='signup',
+                command='signup',
+                first='password',
+                timeout=FLOW_TIMEOUTS['signup'],
+                action=timed_callback(self.admitted(self.process_signup, 'signup'), record_lag=False),
+                steps={
+                    'password': Step(
+                        key='password',
+                        prompt="🚀 Welcome to Solana Wallet Signup!\n"
+                               "Please enter a secure password to create your wallet:",
+                        validate=required("Password cannot be empty. Please enter a valid password:"),
+                        next='wallet_name'
+                    ),
+                    'wallet_name': Step(
+                        key='wallet_name',
+                        prompt="Great! Now, please enter a name for your wallet:",
+                        validate=required("Wallet name cannot be empty. Please enter a valid name:")
+                    ),
+                }
+            ),
+            Flow(
+                name='switchnetwork',
+                command='switchnetwork',
+                first='network',
+                timeout=FLOW_TIMEOUTS['switchnetwork'],
+                action=timed_callback(self.admitted(self.process_network_switch, 'switchnetwork'), record_lag=False),
+                steps={
+                    'network': Step(
+                        key='network',
+                        prompt="🌐 Select a Solana network:",
+                        validate=one_of(
+                            NETWORKS + [network + AUTO_SUFFIX for network in NETWORKS if network != 'custom'],
+                            "❌ Invalid network selected. Please choose from the available options:"
+                        ),
+                        next=lambda update, context: (
+                            self.custom_rpc_step(update, context) if self.has_session(update) else 'password'
+                        ),
+                        choices=self.network_choices,
+                        columns=2
+                    ),
+                    'password': Step(key='password', prompt=password_prompt, next=self.custom_rpc_step),
+                    'rpc_url': Step(
+                        key='rpc_url',
+                        prompt="🔗 Enter your custom RPC URL:",
+                        validate=required("🔗 Enter your custom RPC URL:")
+                    ),
+                }
+            ),
+            Flow(
+                name='balance',
+                command='balance',
+                first='wallet_name',
+                timeout=FLOW_TIMEOUTS['balance'],
+                action=timed_callback(self.admitted(self.process_balance, 'balance'), record_lag=False),
+                steps={
+                    'wallet_name': Step(
+                        key='wallet_name',
+                        prompt="🏦 Enter the wallet name to check balance:",
+                        validate=required("Wallet name cannot be empty. Please enter a valid name:"),
+                        next=lambda update, context: None if self.has_session(update) else 'password',
+                        choices=self.wallet_choices
+                    ),
+                    'password': Step(key='password', prompt=password_prompt),
+                }
+            ),
+            Flow(
+                name='balances',
+                command='balances',
+                first=lambda update, context: None if self.has_session(update) else 'password',
+                timeout=FLOW_TIMEOUTS['balances'],
+                action=timed_callback(self.admitted(self.process_balances, 'balances'), record_lag=False),
+                steps={
+                    'password': Step(key='password', prompt=password_prompt),
+                }
+            ),
+            Flow(
+                name='transfer',
+                command='transfer',
+                first='receiver_address',
+                timeout=FLOW_TIMEOUTS['transfer'],
+                action=timed_callback(self.admitted(self.complete_transfer, 'transfer'), record_lag=False),
+                steps={
+                    'receiver_address': Step(
+                        key='receiver_address',
+                        prompt="💸 Enter receiver's wallet address:",
+                        validate=self.parse_address,
+                        next='transfer_amount'
+                    ),
+                    'transfer_amount': Step(
+                        key='transfer_amount',
+                        prompt="💰 Enter amount of SOL to transfer:",
+                        validate=self.parse_amount,
+                        next='wallet_name',
+                        choices=lambda user_data: [(f"{amount} SOL", amount) for amount in TRANSFER_PRESETS],
+                        columns=len(TRANSFER_PRESETS)
+                    ),
+                    'wallet_name': Step(
+                        key='wallet_name',
+                        prompt="🏦 Enter wallet name to send SOL from:",
+                        validate=required("Wallet name cannot be empty. Please enter a valid name:"),
+                        next=lambda update, context: 'confirm' if self.has_session(update) else 'password',
+                        choices=self.wallet_choices
+                    ),
+                    'confirm': Step(
+                        key='confirmed',
+                        prompt=lambda user_data: self.transfer_summary(user_data) + "Confirm the transfer?",
+                        validate=one_of(['yes'], "Tap ✅ Confirm or send /cancel."),
+                        choices=lambda user_data: [('✅ Confirm', 'yes')],
+                        cancel_button=True
+                    ),
+                    # Without a session, typing the password confirms the summary
+                    'password': Step(
+                        key='password',
+                        prompt=lambda user_data: self.transfer_summary(user_data) + "🔑 Enter your password to confirm:",
+                        cancel_button=True
+                    ),
+                }
+            ),
+            Flow(
+                name='bulktransfer',
+                command='bulktransfer',
+                first='bulk_rows',
+                timeout=FLOW_TIMEOUTS['bulktransfer'],
+                action=timed_callback(self.admitted(self.complete_bulk_transfer, 'bulktransfer'), record_lag=False),
+                steps={
+                    'bulk_rows': Step(
+                        key='bulk_rows',
+                        prompt="📄 Send a CSV file, or a message with one transfer per line:\n"
+                               "address,amount[,wallet name]",
+                        validate=self.parse_bulk_rows,
+                        next='wallet_name',
+                        accepts_document=True
+                    ),
+                    'wallet_name': Step(
+                        key='wallet_name',
+                        prompt="🏦 Enter wallet name to send SOL from:",
+                        validate=required("Wallet name cannot be empty. Please enter a valid name:"),
+                        next=lambda update, context: 'confirm' if self.has_session(update) else 'password',
+                        choices=self.wallet_choices
+                    ),
+                    'confirm': Step(
+                        key='confirmed',
+                        prompt=lambda user_data: self.bulk_summary(user_data) + "Confirm the transfers?",
+                        validate=one_of(['yes'], "Tap ✅ Confirm or send /cancel."),
+                        choices=lambda user_data: [('✅ Confirm', 'yes')],
+                        cancel_button=True
+                    ),
+                    'password': Step(
+                        key='password',
+                        prompt=lambda user_data: self.bulk_summary(user_data) + "🔑 Enter your password to confirm:",
+                        cancel_button=True
+                    ),
+                }
+            ),
+            Flow(
+                name='broadcast',
+                command='broadcast',
+                first=lambda update, context: 'segment' if self.is_admin(update) else None,
+                timeout=FLOW_TIMEOUTS['broadcast'],
+                action=timed_callback(self.complete_broadcast, record_lag=False),
+                steps={
+                    'segment': Step(
+                        key='broadcast_segment',
+                        prompt="📣 Who should get the announcement?",
+                        validate=self.parse_segment,
+                        next='broadcast_text',
+                        choices=self.segment_choices,
+                        columns=2
+                    ),
+                    'broadcast_text': Step(
+                        key='broadcast_text',
+                        prompt="✍️ Send the announcement text:",
+                        validate=required("The announcement cannot be empty. Send the text:"),
+                        next='confirm'
+                    ),
+                    'confirm': Step(
+                        key='confirmed',
+                        prompt=lambda user_data: self.broadcast_summary(user_data) + "Send it?",
+                        validate=one_of(['yes'], "Tap ✅ Send or send /cancel."),
+                        choices=lambda user_data: [('✅ Send', 'yes')],
+                        cancel_button=True
+                    ),
+                }
+            ),
+        ]
+
+    def admitted(self, action, command):
+        """
+        Run a flow action only if the admission controller lets it call the
+        backend now; otherwise re-ask the last step with a "busy" notice so
+        the user can retry without starting over
+        """
+        @functools.wraps(action)
+        async def wrapper(update, context):
+            user_id = update.effective_user.id
+            rejection = self.admission.acquire(user_id, command)
+            if rejection == BUSY:
+                raise RetryStep(
+                    f"🚦 The wallet service is busy right now. "
+                    f"Please try again in {self.admission.retry_after()}s."
+                )
+            if rejection is not None:
+                raise RetryStep("⏳ Your previous request is still running. Please try again in a moment.")
+            try:
+                await action(update, context)
+            finally:
+                self.admission.release(user_id, command)
+        return wrapper
+
+    async def open_session(self, telegram_id, password):
         """
-        Collect the user's password.
+        Exchange the password for a short-lived backend session token
+
+        Returns:
+            str: The token, or None if the backend didn't issue one
         """
-        password = update.message.text
-        if not password:
-            await update.message.reply_text("Password cannot be empty. Please enter a valid password:")
-            return self.SIGNUP_PASSWORD
+        if not self.sessions_supported:
+            return None
+        try:
+            response = await self.backend.post(
+                "/api/session",
+                {'telegramId': telegram_id, 'password': password, 'API_TOKEN': API_TOKEN}
+            )
+        except (httpx.HTTPError, ValueError) as e:
+            self.logger.error(f"Session error: {e}")
+            return None
 
-        context.user_data['password'] = password  # Store the password
-        await update.message.reply_text("Great! Now, please enter a name for your wallet:")
-        return self.WALLET_NAME
+        if response.status_code == 404:
+            # Backend without session support; keep sending the password
+            self.logger.warning("Backend has no /api/session, sessions disabled")
+            self.sessions_supported = False
+            return None
+        if response.status_code not in (200, 201):
+            return None
+        try:
+            session = response.json()
+        except ValueError as e:
+            self.logger.error(f"Session error: {e}")
+            return None
+        token = session.get('token')
+        if token:
+            self.sessions.put(telegram_id, token, session.get('expiresIn'))
+        return token
 
-    async def wallet_name_handler(self, update, context):
+    async def credentials(self, update, context):
         """
-        Collect the wallet name and finalize signup.
+        Auth fields for a backend call: the user's session token, else the
+        password entered in this flow (exchanged for a token on the way)
+
+        Returns:
+            dict: {'sessionToken': ...} or {'password': ...}, or None when
+            the user has neither and must be asked for the password
         """
-        wallet_name = update.message.text
-        if not wallet_name:
-            await update.message.reply_text("Wallet name cannot be empty. Please enter a valid name:")
-            return self.WALLET_NAME
+        telegram_id = str(update.effective_user.id)
+        token = self.sessions.get(telegram_id)
+        password = context.user_data.get('password')
+        if token is None and password:
+            token = await self.open_session(telegram_id, password)
+            if token is None:
+                return {'password': password}
+        return {'sessionToken': token} if token else None
 
-        # Store the wallet name
-        context.user_data['wallet_name'] = wallet_name
+    async def reauthenticate(self, update, context, flow_name):
+        """
+        Drop the user's session and send them back to the password step of
+        `flow_name`, keeping the other answers
+        """
+        self.sessions.revoke(str(update.effective_user.id))
+        await self.router.goto(update, context, flow_name, 'password', notice="🔒 Your session has expired.")
 
-        # Proceed with signup
-        await self.process_signup(update, context)
-        return ConversationHandler.END
+    async def post_authenticated(self, update, context, flow_name, endpoint, payload, **kwargs):
+        """
+        POST `payload` with the user's credentials
 
+        Returns:
+            httpx.Response: The response, or None when the session had
+            expired and the user was asked for the password again
+        """
+        credentials = await self.credentials(update, context)
+        if credentials is None:
+            await self.reauthenticate(update, context, flow_name)
+            return None
+        response = await self.backend.post(endpoint, {**payload, **credentials}, **kwargs)
+        if response.status_code == 401 and 'sessionToken' in credentials:
+            await self.reauthenticate(update, context, flow_name)
+            return None
+        return response
 
     async def process_signup(self, update, context):
         """
@@ -195,8 +1050,8 @@ class SolanaWalletTelegramBot:
 
         # Validate inputs
         if not password or not wallet_name:
-            await update.message.reply_text("Error: Missing password or wallet name. Please restart with /signup.")
-            return ConversationHandler.END
+            await update.effective_message.reply_text("Error: Missing password or wallet name. Please restart with /signup.")
+            return
 
         
         # Prepare signup payload
@@ -209,22 +1064,27 @@ class SolanaWalletTelegramBot:
         
         try:
             # Send signup request to backend
-            response = requests.post(
-                f"http://{self.server_url}/api/signup", 
-                json=signup_payload
+            response = await self.backend.post(
+                "/api/signup",
+                signup_payload
             )
             
             if response.status_code == 201:
                 # Successful signup
                 wallet_data = response.json()
+                self.remember_wallet(context, wallet_name)
                 
                 # Securely send wallet details
-                await update.message.reply_text(
+                await update.effective_message.reply_text(
                     "🎉 Wallet created successfully!\n\n"
                     "🔑 Your wallet details have been generated securely. "
                     "Please keep your mnemonic and private key safe.\n\n"
                     f"🔐 Public Key: {wallet_data.get('publicKey')}"
                 )
+                # The password was just entered; trade it for a session
+                # so the next operations don't ask for it again
+                await self.open_session(signup_payload['telegramId'], password)
+                self.notifier.subscribe(signup_payload['telegramId'])
                 
                 # Optionally, send mnemonic via private message
                 # Check if it works
@@ -239,388 +1099,724 @@ class SolanaWalletTelegramBot:
                 # Handle signup errors
                 await self.handle_server_error(update, response.json())
         
-        except requests.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             self.logger.error(f"Signup error: {e}")
-            await update.message.reply_text(
+            await update.effective_message.reply_text(
                 "🔴 Network error. Please try again later."
             )
-        
-        return ConversationHandler.END
-
-    async def switchnetwork_command(self, update, context):
-        """
-        Network switching interface
-        """
-        # Predefined network options
-        networks = [
-            'mainnet-beta', 
-            'testnet', 
-            'devnet', 
-            'custom'
-        ]
-        
-        # Create keyboard markup
-        keyboard = [
-            [telegram.KeyboardButton(network)] 
-            for network in networks
-        ]
-        reply_markup = telegram.ReplyKeyboardMarkup(
-            keyboard, 
-            one_time_keyboard=True
-        )
-        
-        await update.message.reply_text(
-            "🌐 Select a Solana network:",
-            reply_markup=reply_markup
-        )
-        
-        return self.SIGNUP_PASSWORD  # Reuse password collection state
-    
-    async def process_password_for_network_switch(self, update, context):
-        """
-        Collect password for network switch
-        """
-        network = update.message.text
-
-        valid_networks = ['mainnet-beta', 'testnet', 'devnet', 'custom']
-
-        # Validate the network selection
-        if network not in valid_networks:
-            await update.message.reply_text(
-                "❌ Invalid network selected. Please choose from the available options:"
-            )
-            return self.NETWORK_SELECTION  # Repeat the selection step
-
-        # Store the selected network in user_data
-        context.user_data['network'] = network
-
-        await update.message.reply_text(
-            "🔑 Enter your password:"
-        )
-
-        return self.NETWORK_SELECTION
 
     async def process_network_switch(self, update, context):
         """
         Handle network switching logic
         """
-        password = update.message.text
         network = context.user_data.get('network', 'mainnet-beta') 
         
         # Check if custom network selected
         if network == 'custom':
-            await update.message.reply_text(
-                "🔗 Enter your custom RPC URL:"
-            )
-            return self.CUSTOM_RPC_URL
+            await self.process_custom_network(update, context)
+            return
         
         # Prepare network switch payload
         switch_payload = {
             'telegramId': str(update.effective_user.id),
-            'password': context.user_data.get('password', ''),
             'network': network,
-            'password': password,
             'API_TOKEN': API_TOKEN
         }
+        success_message = f"✅ Switched to {network} network successfully!"
+
+        if network.endswith(AUTO_SUFFIX):
+            network = network[:-len(AUTO_SUFFIX)]
+            fastest = await self.rpc_health.fastest(network)
+            if fastest is None:
+                await update.effective_message.reply_text(
+                    f"🔴 No healthy {network} RPC endpoint right now. "
+                    f"Pick {network} without ⚡ or try again later."
+                )
+                return
+            switch_payload.update(network=network, rpcUrl=fastest.url)
+            success_message = (
+                f"✅ Switched to {network} network successfully!\n"
+                f"⚡ Fastest RPC: {fastest.url} ({fastest.rtt * 1000:.0f} ms)"
+            )
         
         try:
-            response = requests.post(
-                f"http://{self.server_url}/api/network/switch", 
-                json=switch_payload
+            response = await self.post_authenticated(
+                update, context, 'switchnetwork',
+                "/api/network/switch",
+                switch_payload
             )
             
+            if response is None:
+                return
             if response.status_code == 200:
-                await update.message.reply_text(
-                    f"✅ Switched to {network} network successfully!"
-                )
+                self.balance_cache.invalidate_owner(switch_payload['telegramId'])
+                await update.effective_message.reply_text(success_message)
             else:
                 await self.handle_server_error(update, response.json())
         
-        except requests.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             self.logger.error(f"Network switch error: {e}")
-            await update.message.reply_text(
+            await update.effective_message.reply_text(
                 "🔴 Network error. Please try again later."
             )
-        
-        return ConversationHandler.END
 
     async def process_custom_network(self, update, context):
         """
         Handle custom RPC URL network switch
         """
-        custom_rpc_url = update.message.text
-        password = context.user_data.get('password', '')
-        
         # Prepare custom network payload
         switch_payload = {
             'telegramId': str(update.effective_user.id),
-            'password': context.user_data.get('password', ''),
             'network': 'custom',
-            'rpcUrl': custom_rpc_url,
-            'password': password,
+            'rpcUrl': context.user_data.get('rpc_url', ''),
             'API_TOKEN': API_TOKEN
         }
+
+        # Don't point the user's wallet at a dead or lagging node
+        probe = await self.rpc_health.check(switch_payload['rpcUrl'])
+        if not probe.healthy:
+            await self.router.goto(
+                update, context, 'switchnetwork', 'rpc_url',
+                notice=f"🔴 That RPC can't be used: {probe.error}."
+            )
+            return
         
         try:
-            response = requests.post(
-                f"http://{self.server_url}/api/network/switch", 
-                json=switch_payload
+            response = await self.post_authenticated(
+                update, context, 'switchnetwork',
+                "/api/network/switch",
+                switch_payload
             )
             
+            if response is None:
+                return
             if response.status_code == 200:
-                await update.message.reply_text(
+                self.balance_cache.invalidate_owner(switch_payload['telegramId'])
+                await update.effective_message.reply_text(
                     "✅ Custom network switched successfully!"
                 )
             else:
                 await self.handle_server_error(update, response.json())
         
-        except requests.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             self.logger.error(f"Custom network switch error: {e}")
-            await update.message.reply_text(
+            await update.effective_message.reply_text(
                 "🔴 Network error. Please try again later."
             )
-        
-        return ConversationHandler.END
 
-    async def balance_command(self, update, context):
+    async def fetch_balance(self, balance_payload):
         """
-        Initiate balance check process
+        Call /api/balance and return (status_code, json body)
         """
-        await update.message.reply_text(
-            "🏦 Enter the wallet name to check balance:"
-        )
-        return self.SIGNUP_PASSWORD  # Reuse password collection state
-    
-    async def process_password_for_balance(self, update, context):
+        response = await self.backend.post("/api/balance", balance_payload)
+        return response.status_code, response.json()
+
+    def balance_cache_key(self, telegram_id, wallet_name, context, credentials):
         """
-        Collect password for network switch
+        Balance cache key, bound to the credentials that fetched the entry
+        without keeping them around
         """
-        name = update.message.text
-        context.user_data['wallet_name'] = name
-
-        await update.message.reply_text(
-            "🔑 Enter your password:"
+        return (
+            telegram_id,
+            wallet_name,
+            context.user_data.get('network', 'default'),
+            hmac.new(
+                self._cache_key_secret,
+                json.dumps(credentials, sort_keys=True).encode('utf-8'),
+                hashlib.sha256
+            ).digest()
         )
 
-        return self.BALANCE
+    @staticmethod
+    def format_sol(lamports):
+        return f"{lamports / 1_000_000_000} SOL"
 
     async def process_balance(self, update, context):
         """
         Retrieve and display wallet balance
         """
-        password = update.message.text
         wallet_name = context.user_data.get('wallet_name', 'null')
         
-        # Prepare balance check payload
-        balance_payload = {
-            'telegramId': str(update.effective_user.id),
-            'password': password,
-            'walletName': wallet_name, # Default to first wallet
-            'API_TOKEN': API_TOKEN 
-        }
-        
         try:
-            response = requests.post(
-                f"http://{self.server_url}/api/balance", 
-                json=balance_payload
+            credentials = await self.credentials(update, context)
+            if credentials is None:
+                await self.reauthenticate(update, context, 'balance')
+                return
+
+            # Prepare balance check payload
+            balance_payload = {
+                'telegramId': str(update.effective_user.id),
+                'walletName': wallet_name, # Default to first wallet
+                'API_TOKEN': API_TOKEN,
+                **credentials
+            }
+            
+            cache_key = self.balance_cache_key(balance_payload['telegramId'], wallet_name, context, credentials)
+            
+            status_code, balance_data = await self.balance_cache.get_or_load(
+                cache_key,
+                lambda: self.fetch_balance(balance_payload),
+                should_cache=lambda result: result[0] == 200
             )
             
-            if response.status_code == 200:
-                balance_data = response.json()
-                await update.message.reply_text(
-                    f"💰 Balance: {balance_data['balance'] / 1_000_000_000} SOL"
+            if status_code == 401 and 'sessionToken' in credentials:
+                await self.reauthenticate(update, context, 'balance')
+                return
+            if status_code == 200:
+                self.remember_wallet(context, wallet_name)
+                await update.effective_message.reply_text(
+                    f"💰 Balance: {self.format_sol(balance_data['balance'])}"
                 )
             else:
-                await self.handle_server_error(update, response.json())
+                await self.handle_server_error(update, balance_data)
         
-        except requests.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             self.logger.error(f"Balance retrieval error: {e}")
-            await update.message.reply_text(
+            await update.effective_message.reply_text(
                 "🔴 Network error. Please try again later."
             )
         
-        return ConversationHandler.END
-
-    async def transfer_command(self, update, context):
-        """
-        Initiate SOL transfer process
+    async def fan_out_balances(self, telegram_id, wallet_names, context, credentials):
         """
-        await update.message.reply_text(
-            "💸 Enter receiver's wallet address:"
-        )
-        return self.TRANSFER_RECEIVER
+        Fetch each wallet from /api/balance, BALANCE_FANOUT_CONCURRENCY at a
+        time, sharing the balance cache with /balance
 
-    async def process_transfer_receiver(self, update, context):
-        """
-        Collect receiver's wallet address
+        Returns:
+            list: (wallet name, status code, json body) per wallet; status is
+            None when the backend couldn't be reached
         """
-        context.user_data['receiver_address'] = update.message.text
-        
-        await update.message.reply_text(
-            "💰 Enter amount of SOL to transfer:"
-        )
-        
-        return self.TRANSFER_AMOUNT
+        semaphore = asyncio.Semaphore(BALANCE_FANOUT_CONCURRENCY)
+
+        async def fetch_one(wallet_name):
+            payload = {
+                'telegramId': telegram_id,
+                'walletName': wallet_name,
+                'API_TOKEN': API_TOKEN,
+                **credentials
+            }
+
+            async def load():
+                async with semaphore:
+                    return await self.fetch_balance(payload)
+
+            try:
+                status_code, body = await self.balance_cache.get_or_load(
+                    self.balance_cache_key(telegram_id, wallet_name, context, credentials),
+                    load,
+                    should_cache=lambda result: result[0] == 200
+                )
+            except (httpx.HTTPError, ValueError) as e:
+                self.logger.error(f"Balance retrieval error for {wallet_name}: {e}")
+                return wallet_name, None, {}
+            return wallet_name, status_code, body
 
-    async def process_transfer_amount(self, update, context):
+        return await asyncio.gather(*(fetch_one(name) for name in wallet_names))
+
+    async def process_balances(self, update, context):
         """
-        Collect transfer amount
+        Retrieve and display the balance of every wallet in one reply
         """
+        telegram_id = str(update.effective_user.id)
+
         try:
-            amount = float(update.message.text)
-            context.user_data['transfer_amount'] = amount
-            
-            await update.message.reply_text(
-                "🏦 Enter wallet name to send SOL from:"
-            )
-            
-            return self.SIGNUP_PASSWORD
+            credentials = await self.credentials(update, context)
+            if credentials is None:
+                await self.reauthenticate(update, context, 'balances')
+                return
+
+            results = None
+            if self.batch_balances_supported:
+                response = await self.backend.post(
+                    "/api/balances",
+                    {'telegramId': telegram_id, 'API_TOKEN': API_TOKEN, **credentials}
+                )
+                if response.status_code == 404:
+                    # Backend without a batch endpoint; fan out from now on
+                    self.logger.warning("Backend has no /api/balances, falling back to /api/balance")
+                    self.batch_balances_supported = False
+                elif response.status_code == 200:
+                    results = [
+                        (item['walletName'], 200, item)
+                        for item in response.json().get('balances', [])
+                    ]
+                    for wallet_name, status_code, body in results:
+                        self.balance_cache.set(
+                            self.balance_cache_key(telegram_id, wallet_name, context, credentials),
+                            (status_code, body)
+                        )
+                elif response.status_code == 401 and 'sessionToken' in credentials:
+                    await self.reauthenticate(update, context, 'balances')
+                    return
+                else:
+                    await self.handle_server_error(update, response.json())
+                    return
+
+            if results is None:
+                # Without a batch endpoint only the wallets used before are known
+                wallet_names = context.user_data.get('wallets', [])
+                if not wallet_names:
+                    await update.effective_message.reply_text(
+                        "🏦 No wallets known yet. Check one with /balance first."
+                    )
+                    return
+                results = await self.fan_out_balances(telegram_id, wallet_names, context, credentials)
+                if 'sessionToken' in credentials and any(status == 401 for _, status, _ in results):
+                    await self.reauthenticate(update, context, 'balances')
+                    return
         
-        except ValueError:
-            await update.message.reply_text(
-                "❌ Invalid amount. Please enter a valid number."
+        except (httpx.HTTPError, ValueError) as e:
+            self.logger.error(f"Balance retrieval error: {e}")
+            await update.effective_message.reply_text(
+                "🔴 Network error. Please try again later."
             )
-            return self.TRANSFER_AMOUNT
-    
-    async def process_password_for_sol_transfer(self, update, context):
-        """
-        Collect password for network switch
-        """
-        wallet_name = update.message.text
-        context.user_data['wallet_name'] = wallet_name
-        await update.message.reply_text(
-            "🔑 Enter your password:"
-        )
+            return
+
+        lines = ["💰 Balances:"]
+        total = 0
+        for wallet_name, status_code, body in results:
+            if status_code == 200:
+                total += body['balance']
+                lines.append(f"• {wallet_name}: {self.format_sol(body['balance'])}")
+            elif status_code is None:
+                lines.append(f"• {wallet_name}: 🔴 unavailable")
+            elif body.get('error') == "Account not found":
+                lines.append(f"• {wallet_name}: {self.format_sol(0)}")
+            else:
+                lines.append(f"• {wallet_name}: ❌ {body.get('error', 'Unknown Error')}")
+        if len(results) > 1:
+            lines.append(f"\nTotal: {self.format_sol(total)}")
+        if not results:
+            lines.append("No wallets found.")
 
-        return self.TRANSFER_WALLET
+        for wallet_name, status_code, _ in reversed(results[:RECENT_WALLETS]):
+            if status_code == 200:
+                self.remember_wallet(context, wallet_name)
+        await update.effective_message.reply_text('\n'.join(lines))
 
     async def complete_transfer(self, update, context):
         """
-        Execute SOL transfer
+        Queue the SOL transfer and reply at once; the transfer pipeline
+        sends it and edits the reply as it confirms
         """
-        password = update.message.text
+        telegram_id = str(update.effective_user.id)
         
         # Prepare transfer payload
         transfer_payload = {
-            'telegramId': str(update.effective_user.id),
-            'password': password,
+            'telegramId': telegram_id,
             'to': context.user_data.get('receiver_address', ''),
             'amount': context.user_data.get('transfer_amount', 0),
             'walletName': context.user_data.get('wallet_name', 0),
             'API_TOKEN': API_TOKEN  
         }
+        summary = f"{transfer_payload['amount']} SOL to {transfer_payload['to']}"
         
-        try:
-            response = requests.post(
-                f"http://{self.server_url}/api/transfer", 
-                json=transfer_payload
+        credentials = await self.credentials(update, context)
+        if credentials is None:
+            await self.reauthenticate(update, context, 'transfer')
+            return
+
+        message = await self.send_reply(
+            update, context,
+            f"⏳ Transfer submitted: {summary}",
+            priority=PRIORITY_HIGH
+        )
+        job = TransferJob(
+            telegram_id=telegram_id,
+            chat_id=message.chat_id,
+            message_id=message.message_id,
+            payload={**transfer_payload, **credentials},
+            # One key per transfer attempt, reused by every retry of it, so
+            # the backend can drop duplicates
+            idempotency_key=uuid.uuid4().hex,
+            summary=summary
+        )
+        if not self.transfers.submit(job):
+            await message.edit_text("🔴 Too many transfers in progress. Please try again shortly.")
+            return
+        self.remember_wallet(context, transfer_payload['walletName'])
+
+    async def complete_bulk_transfer(self, update, context):
+        """
+        Start sending the validated rows in the background and reply with
+        the message that reports their progress
+        """
+        telegram_id = str(update.effective_user.id)
+        if self.bulk_transfers.busy(telegram_id):
+            await update.effective_message.reply_text(
+                "⏳ A bulk transfer is already running. Wait for its result file, then try again."
             )
-            
-            if response.status_code == 200:
-                transfer_data = response.json()
-                await update.message.reply_text(
-                    f"✅ Transfer successful!\n"
-                    f"Transaction Signature: {transfer_data['signature']}"
+            return
+
+        credentials = await self.credentials(update, context)
+        if credentials is None:
+            await self.reauthenticate(update, context, 'bulktransfer')
+            return
+
+        rows = context.user_data.pop('bulk_rows', None) or []
+        default_wallet = context.user_data.get('wallet_name')
+        message = await self.send_reply(
+            update, context,
+            f"🚚 Bulk transfer in progress…\n0/{len(rows)} processed",
+            priority=PRIORITY_HIGH
+        )
+        # Every retry of a row reuses its key, so the backend can drop duplicates
+        batch_key = uuid.uuid4().hex
+        batch = BulkTransfer(telegram_id=telegram_id, chat_id=message.chat_id, message_id=message.message_id)
+        for line, address, amount, wallet_name in rows:
+            payload = {
+                'telegramId': telegram_id,
+                'to': address,
+                'amount': amount,
+                'walletName': wallet_name or default_wallet,
+                'API_TOKEN': API_TOKEN,
+                **credentials
+            }
+            batch.rows.append(BulkRow(
+                line=line,
+                job=TransferJob(
+                    telegram_id=telegram_id,
+                    chat_id=batch.chat_id,
+                    message_id=batch.message_id,
+                    payload=payload,
+                    idempotency_key=f"{batch_key}-{line}",
+                    summary=f"{amount} SOL to {address}"
                 )
-            else:
-                await self.handle_server_error(update, response.json())
-        
-        except requests.RequestException as e:
-            self.logger.error(f"Transfer error: {e}")
-            await update.message.reply_text(
-                "🔴 Network error. Please try again later."
+            ))
+        self.bulk_transfers.launch(context.application, batch, update=update)
+        self.remember_wallet(context, default_wallet)
+
+    async def complete_broadcast(self, update, context):
+        """
+        Start sending the announcement in the background and reply with the
+        message that reports its progress
+        """
+        if not self.is_admin(update):
+            return
+        segment = context.user_data.pop('broadcast_segment', ALL)
+        text = context.user_data.pop('broadcast_text', '')
+        context.user_data.pop('confirmed', None)
+        if self.broadcasts.busy:
+            await update.effective_message.reply_text(
+                "⏳ A broadcast is already running. Wait for it to finish, then try again."
             )
-        
-        return ConversationHandler.END
+            return
+        message = await self.send_reply(
+            update, context,
+            f"📣 Broadcast to {segment} starting…",
+            priority=PRIORITY_HIGH
+        )
+        broadcast = Broadcast(
+            broadcast_id=uuid.uuid4().hex,
+            segment=segment,
+            text=text,
+            chat_id=message.chat_id,
+            message_id=message.message_id,
+            owner=self.broadcasts.owner
+        )
+        self.logger.info(f"Broadcast {broadcast.broadcast_id} to {segment} started by {update.effective_user.id}")
+        self.broadcasts.launch(context.application, broadcast)
+
+    async def track_user(self, update, context):
+        """
+        Remember everyone who writes to the bot privately as a broadcast
+        recipient, segmented by their client language
+        """
+        if update.effective_user is None or update.effective_chat is None \
+                or update.effective_chat.type != telegram.constants.ChatType.PRIVATE:
+            return
+        user_info = self.extract_telegram_user_info(update)
+        self.recipients.record(user_info['telegramId'], user_info['language_code'])
+
+    async def send_transfer(self, job):
+        """
+        TransferPipeline submit callback: POST /api/transfer
+
+        Returns:
+            str: Transaction signature
+        """
+        response = await self.backend.post(
+            "/api/transfer",
+            job.payload,
+            idempotency_key=job.idempotency_key
+        )
+        if response.status_code == 200:
+            return response.json()['signature']
+        if response.status_code == 401 and 'sessionToken' in job.payload:
+            self.sessions.revoke(job.telegram_id)
+            raise SessionExpired(
+                "🔒 Your session has expired and the transfer was not sent. Please /transfer again."
+            )
+        raise TransferRejected(self.format_server_error(response.json()))
 
+    def handle_account_event(self, event_type, data):
+        """
+        EventStream callback: an account of one of our users changed
+        """
+        self.bot_data[self.cursor_key] = self.events.cursor
+        telegram_id = str(data.get('telegramId', ''))
+        if not telegram_id or not self.owns_user(telegram_id):
+            return
+        self.balance_cache.invalidate_owner(telegram_id)
+        if event_type == 'transfer.received':
+            self.notifier.notify(
+                telegram_id,
+                f"📥 Received {self.format_sol(data.get('amount', 0))} in {data.get('walletName')}\n"
+                f"From: {data.get('from')}\n"
+                f"Transaction Signature: {data.get('signature')}"
+            )
+
+    def owns_user(self, telegram_id):
+        """
+        Whether this process handles `telegram_id`'s updates. Every worker
+        reads the whole event stream and acts on the users routed to it.
+        """
+        if self.worker is None:
+            return True
+        index, count = self.worker
+        return int(telegram_id) % count == index
+
+    def transfer_changed(self, job):
+        # Sending, confirming or failing all move the wallet's balance
+        self.balance_cache.invalidate_owner(job.telegram_id)
+        
     def setup_handlers(self, dispatcher):
         """
-        Configure conversation handlers for bot commands
+        Configure handlers for bot commands and conversation flows
         """
+        # Runs before every other handler, in a group of its own so it never
+        # stops an update from reaching them
+        dispatcher.add_handler(TypeHandler(telegram.Update, self.track_user), group=-1)
 
         # Start command handler
         start_handler = CommandHandler('start', self.start_command)
-        dispatcher.add_handler(start_handler)
+        dispatcher.add_handler(instrument_handler(start_handler))
 
         # Help command handler
         help_handler = CommandHandler('help', self.start_command)
-        dispatcher.add_handler(help_handler)
-
-        # Signup conversation handler
-        signup_handler = ConversationHandler(
-            entry_points=[CommandHandler('signup', self.signup_command)],
-            states={
-                self.SIGNUP_PASSWORD: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.password_handler)
-                ],
-                self.WALLET_NAME: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.wallet_name_handler)
-                ],
-            },
-            fallbacks=[],
-        )
+        dispatcher.add_handler(instrument_handler(help_handler))
 
-        # Network switch conversation handler
-        network_switch_handler = ConversationHandler(
-            entry_points=[CommandHandler('switchnetwork', self.switchnetwork_command)],
-            states={
-                self.SIGNUP_PASSWORD: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.process_password_for_network_switch)
-                ],
-                self.NETWORK_SELECTION: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.process_network_switch)
-                ],
-                self.CUSTOM_RPC_URL: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.process_custom_network)
-                ]
-            },
-            fallbacks=[]
-        )
+        notifications_handler = CommandHandler('notifications', self.notifications_command)
+        dispatcher.add_handler(instrument_handler(notifications_handler))
 
-        # Balance check conversation handler
-        balance_handler = ConversationHandler(
-            entry_points=[CommandHandler('balance', self.balance_command)],
-            states={
-                self.SIGNUP_PASSWORD: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.process_password_for_balance)
-                ],
-                self.BALANCE: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.process_balance)
-                ]
-            },
-            fallbacks=[]
-        )
+        # Admin diagnostics; ignored for everyone not in ADMIN_IDS
+        dispatcher.add_handler(instrument_handler(CommandHandler('diag', self.diag_command)))
+
+        # /cancel works inside and outside of a flow
+        dispatcher.add_handler(instrument_handler(CommandHandler('cancel', self.cancel_command)))
+
+        # Main menu buttons
+        menu_handler = CallbackQueryHandler(self.menu_callback, pattern=f"^{re.escape(MENU_CALLBACK_PREFIX)}")
+        dispatcher.add_handler(instrument_handler(menu_handler))
+
+        # Every flow is served by the router's command, button and message handlers
+        for handler in self.router.handlers():
+            dispatcher.add_handler(instrument_handler(handler))
+        track_conversations(self.router.active_counts)
+
+def build_application(bot, workers=1, updater=True):
+    """
+    Build the Application around `bot` with its handlers
+
+    Args:
+        bot (SolanaWalletTelegramBot): Bot whose hooks and handlers to use
+        workers (int): Processes sharing Telegram's outbound rate limit
+        updater (bool): False for supervised workers, fed by the supervisor
+    """
+    builder = (
+        Application.builder()
+        .token(bot.bot_token)
+        .post_init(bot.post_init)
+        .post_stop(bot.post_stop)
+        .post_shutdown(bot.post_shutdown)
+        .rate_limiter(OutboundScheduler(
+            overall_rate=BOT_API_RATE / workers,
+            paid_broadcast_rate=BROADCAST_PAID_RATE / workers
+        ))
+        .concurrent_updates(UserShardedUpdateProcessor(
+            concurrency=UPDATE_CONCURRENCY,
+            shard_backlog=UPDATE_SHARD_BACKLOG,
+            admission=bot.admission,
+            slow_update=SLOW_UPDATE_SECONDS
+        ))
+    )
+    if not updater:
+        builder = builder.updater(None)
+    if PERSISTENCE_URL:
+        builder = builder.persistence(StatePersistence(store_from_url(PERSISTENCE_URL), owns_user=bot.owns_user))
+    application = builder.build()
+
+    # Setup conversation handlers
+    bot.setup_handlers(application)
+    return application
+
+def run_worker(index, inbox, taken):
+    """
+    Entry point of a supervised worker process
+    """
+    bot = SolanaWalletTelegramBot(
+        bot_token=TELEGRAM_TOKEN,
+        server_url=API_BASE_URL,
+        worker=(index, WORKERS)
+    )
+    application = build_application(bot, workers=WORKERS, updater=False)
+    asyncio.run(serve_inbox(application, inbox, taken, drain_timeout=DRAIN_TIMEOUT))
+
+async def poll_updates(pool, stopping):
+    """
+    Supervisor ingress in polling mode: long poll getUpdates and route each
+    update to its worker until `stopping` is set
+    """
+    logger = logging.getLogger(__name__)
+    offset = None
+    failures = 0
+    async with telegram.Bot(TELEGRAM_TOKEN) as telegram_bot:
+        await telegram_bot.delete_webhook()
+        stopped = asyncio.create_task(stopping.wait())
+        while not stopping.is_set():
+            polling = asyncio.create_task(telegram_bot.get_updates(
+                offset=offset,
+                timeout=30,
+                read_timeout=40,
+                allowed_updates=telegram.Update.ALL_TYPES
+            ))
+            # Don't sit out a long poll on shutdown; unconfirmed updates
+            # are delivered again on the next start
+            await asyncio.wait({polling, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            if not polling.done():
+                polling.cancel()
+                await asyncio.gather(polling, return_exceptions=True)
+                break
+            try:
+                updates = polling.result()
+            except telegram.error.TelegramError as e:
+                failures += 1
+                logger.warning(f"getUpdates failed: {e}")
+                await asyncio.sleep(min(30, 2 ** failures))
+                continue
+            failures = 0
+            for update in updates:
+                await pool.route(update.to_dict())
+                offset = update.update_id + 1
+        if offset is not None:
+            # Confirm the last routed updates so a restart doesn't replay them
+            await telegram_bot.get_updates(offset=offset, timeout=0)
 
-        # Transfer conversation handler
-        transfer_handler = ConversationHandler(
-            entry_points=[CommandHandler('transfer', self.transfer_command)],
-            states={
-                self.TRANSFER_RECEIVER: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.process_transfer_receiver)
-                ],
-                self.TRANSFER_AMOUNT: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.process_transfer_amount)
-                ],
-                self.SIGNUP_PASSWORD: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.process_password_for_sol_transfer)
-                ],
-                self.TRANSFER_WALLET: [
-                    MessageHandler(Filters.TEXT & ~Filters.COMMAND, self.complete_transfer)
-                ]
-            },
-            fallbacks=[]
+async def supervise(pool):
+    """
+    Supervisor: start the workers, feed them from polling or the webhook,
+    restart crashed ones and report their load, until SIGINT/SIGTERM
+    """
+    pool.start()
+    track_component('workers', pool.stats)
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = BackgroundServer(
+            RouteApp({('GET', '/metrics'): handle_metrics}),
+            host=METRICS_LISTEN,
+            port=int(METRICS_PORT)
         )
+        await metrics_server.start()
+    supervisor = asyncio.create_task(pool.supervise(report_interval=WORKER_REPORT_INTERVAL))
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stopping.set)
+    try:
+        if BOT_MODE == 'webhook':
+            secret_token = WEBHOOK_SECRET or hashlib.sha256(TELEGRAM_TOKEN.encode('utf-8')).hexdigest()
+            await run_ingress_webhook(
+                pool,
+                TELEGRAM_TOKEN,
+                stopping,
+                webhook_url=WEBHOOK_URL,
+                secret_token=secret_token,
+                listen=WEBHOOK_LISTEN,
+                port=PORT,
+                path=WEBHOOK_PATH
+            )
+        else:
+            await poll_updates(pool, stopping)
+    finally:
+        supervisor.cancel()
+        await asyncio.gather(supervisor, return_exceptions=True)
+        # Workers finish what was routed to them before exiting; allow for
+        # their drain and the transfer and notification queues after it
+        await pool.stop(timeout=DRAIN_TIMEOUT + 15)
+        if metrics_server is not None:
+            await metrics_server.stop()
 
-        # Add handlers to dispatcher
-        dispatcher.add_handler(signup_handler)
-        dispatcher.add_handler(network_switch_handler)
-        dispatcher.add_handler(balance_handler)
-        dispatcher.add_handler(transfer_handler)
+async def serve(bot, application):
+    """
+    Run a single process bot until SIGINT/SIGTERM, or with DEV_RELOAD
+    until a source file changes
+
+    Returns:
+        bool: Whether to restart the process
+    """
+    logger = logging.getLogger(__name__)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stopping.set)
+
+    reload = False
+    watcher = None
+    if DEV_RELOAD and BOT_MODE == 'webhook':
+        logger.warning("DEV_RELOAD is for local polling only; ignored in webhook mode")
+    elif DEV_RELOAD:
+        logger.warning("DEV_RELOAD is on: the bot restarts whenever a source file changes")
+        source_watcher = SourceWatcher(os.path.dirname(os.path.abspath(__file__)))
+
+        async def watch():
+            nonlocal reload
+            path = await source_watcher.changed()
+            logger.info(f"{os.path.basename(path)} changed, reloading")
+            reload = True
+            stopping.set()
+
+        watcher = asyncio.create_task(watch())
+    try:
+        if BOT_MODE == 'webhook':
+            # Every replica must share the secret; derive one from the token if unset
+            secret_token = WEBHOOK_SECRET or hashlib.sha256(bot.bot_token.encode('utf-8')).hexdigest()
+            await run_webhook(
+                application,
+                webhook_url=WEBHOOK_URL,
+                secret_token=secret_token,
+                listen=WEBHOOK_LISTEN,
+                port=PORT,
+                path=WEBHOOK_PATH,
+                stopping=stopping,
+                drain_timeout=DRAIN_TIMEOUT
+            )
+        else:
+            await run_polling(application, stopping, drain_timeout=DRAIN_TIMEOUT)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+    return reload
 
 def main():
     """
     Main bot setup and execution
     """
+    if WORKERS > 1:
+        # Logging for the supervisor process; every worker sets up its own
+        LogPipeline(
+            level=LOG_LEVEL,
+            sample_rates=LOG_SAMPLE_RATES,
+            queue_size=LOG_QUEUE_SIZE,
+            json_output=LOG_FORMAT == 'json'
+        ).install()
+        if DEV_RELOAD:
+            logging.getLogger(__name__).warning("DEV_RELOAD is for a single process; ignored with WORKERS > 1")
+        asyncio.run(supervise(WorkerPool(run_worker, workers=WORKERS, queue_size=WORKER_QUEUE_SIZE)))
+        return
+
     # Initialize bot
     bot = SolanaWalletTelegramBot(
         bot_token=TELEGRAM_TOKEN,
@@ -628,13 +1824,13 @@ def main():
     )
     
     # Create the application
-    application = Application.builder().token(bot.bot_token).build()
-
-    # Setup conversation handlers
-    bot.setup_handlers(application)
+    application = build_application(bot)
 
     # Start the bot
-    application.run_polling()
+    if asyncio.run(serve(bot, application)):
+        # Everything is flushed; the new process warm starts from it
+        bot.log_pipeline.stop()
+        restart_process()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
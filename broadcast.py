@@ -0,0 +1,426 @@
+import json
+import time
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+
+import telegram
+
+from rate_limiter import PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH
+
+# Store namespaces: every recipient with their language, one namespace per
+# language so a segment loads without reading everyone, and checkpoints of
+# running broadcasts
+RECIPIENTS = 'recipients'
+SEGMENT_PREFIX = 'recipients:'
+BROADCASTS = 'broadcasts'
+
+# Segment of every recipient, and language of users whose client sends none
+ALL = 'all'
+UNKNOWN_LANGUAGE = 'unknown'
+
+
+class RecipientStore:
+    def __init__(self, store, flush_interval=5.0):
+        """
+        Users the bot can message, indexed by language
+
+        Users are recorded as their private chat updates arrive. Only new
+        users and language changes are written, batched every
+        `flush_interval` seconds. Users who blocked the bot are removed.
+
+        Args:
+            store: SQLiteStore, RedisStore or MemoryStore
+            flush_interval (float): Seconds between batched writes
+        """
+        self.logger = logging.getLogger(__name__)
+        self.store = store
+        self.flush_interval = flush_interval
+        # telegram id -> language, as written to the store
+        self._known = {}
+        self._pending = {}
+        self._task = None
+
+        # Metrics
+        self.recorded = 0
+        self.pruned = 0
+
+    async def start(self):
+        rows = await self.store.load(RECIPIENTS)
+        self._known = {telegram_id: json.loads(language) for telegram_id, language in rows.items()}
+        self._task = asyncio.create_task(self._flush_periodically(), name='RecipientStore')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self.store.write(batch)
+        except Exception as e:
+            self.logger.error(f"Recipient store write error: {e}")
+            for namespace, changes in batch.items():
+                pending = self._pending.setdefault(namespace, {})
+                for key, value in changes.items():
+                    pending.setdefault(key, value)
+
+    def _stage(self, namespace, key, value):
+        self._pending.setdefault(namespace, {})[key] = value
+
+    def record(self, telegram_id, language_code):
+        """
+        Remember `telegram_id` as a recipient in `language_code`'s segment
+        """
+        language = (language_code or UNKNOWN_LANGUAGE).lower()
+        previous = self._known.get(telegram_id)
+        if previous == language:
+            return
+        self._known[telegram_id] = language
+        self._stage(RECIPIENTS, telegram_id, json.dumps(language))
+        self._stage(SEGMENT_PREFIX + language, telegram_id, '1')
+        if previous is not None:
+            self._stage(SEGMENT_PREFIX + previous, telegram_id, None)
+        self.recorded += 1
+
+    def remove(self, telegram_id, language=None):
+        """
+        Forget a recipient, e.g. one who blocked the bot
+        """
+        language = self._known.pop(telegram_id, None) or language
+        self._stage(RECIPIENTS, telegram_id, None)
+        if language is not None:
+            self._stage(SEGMENT_PREFIX + language, telegram_id, None)
+        self.pruned += 1
+
+    def __len__(self):
+        return len(self._known)
+
+    def languages(self):
+        """
+        Recipients per language known to this process, most common first
+        """
+        return Counter(self._known.values()).most_common()
+
+    async def load_segment(self, segment):
+        """
+        Recipients of `segment` (ALL or a language code) from the store
+
+        Returns:
+            dict: telegram id -> language
+        """
+        # Users recorded in the last few seconds are included
+        await self.flush()
+        if segment == ALL:
+            rows = await self.store.load(RECIPIENTS)
+            return {telegram_id: json.loads(language) for telegram_id, language in rows.items()}
+        rows = await self.store.load(SEGMENT_PREFIX + segment)
+        return {telegram_id: segment for telegram_id in rows}
+
+    def stats(self):
+        return {
+            'recipients': len(self._known),
+            'pending_writes': sum(len(changes) for changes in self._pending.values()),
+            'recorded': self.recorded,
+            'pruned': self.pruned,
+        }
+
+
+@dataclass
+class Broadcast:
+    """
+    One announcement and how far it got; saved as its checkpoint
+
+    Attributes:
+        broadcast_id (str): Unique id, also the checkpoint key
+        segment (str): ALL or a language code
+        text (str): Message sent to every recipient
+        chat_id (int): Chat of the admin who started it
+        message_id (int): Progress message edited while sending
+        owner (int): Worker process that sends it
+        total (int): Recipients when it started
+        cursor (str): Telegram id up to which (in id order) every recipient
+            was handled; a resumed broadcast starts after it
+        handled_after (list): Telegram ids past the cursor that were
+            handled too, while an earlier recipient was still in flight
+        sent (int): Messages delivered
+        blocked (int): Recipients pruned because they blocked the bot
+        failed (int): Other delivery errors
+        elapsed (float): Seconds spent sending, across restarts
+        done (bool): Finished
+    """
+    broadcast_id: str
+    segment: str
+    text: str
+    chat_id: int
+    message_id: int
+    owner: int = 0
+    total: int = 0
+    cursor: str = None
+    handled_after: list = field(default_factory=list)
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    done: bool = False
+
+    @property
+    def handled(self):
+        return self.sent + self.blocked + self.failed
+
+    def progress_text(self, rate=0.0):
+        head = "✅ Broadcast finished" if self.done else "📣 Broadcast in progress…"
+        percent = 100 * self.handled / self.total if self.total else 100
+        text = (
+            f"{head} ({self.segment})\n"
+            f"{self.handled}/{self.total} ({percent:.0f}%): {self.sent} sent, "
+            f"{self.blocked} blocked, {self.failed} failed"
+        )
+        if rate > 0:
+            text += f"\n⚡ {rate:.1f} messages/s"
+            if not self.done:
+                text += f", about {max(0, self.total - self.handled) / rate / 60:.0f} min left"
+        elif self.done and self.elapsed > 0:
+            text += f"\n⏱️ {self.elapsed / 60:.1f} min"
+        return text
+
+
+class BroadcastRunner:
+    def __init__(self, recipients, on_blocked=None, owner=0, concurrency=50, paid=False,
+                 progress_interval=5.0, clock=time.monotonic):
+        """
+        Sends broadcasts to a segment of recipients, resumable after a restart
+
+        Recipients are sent to in telegram id order by `concurrency`
+        senders at low outbound priority, so the rate limiter hands
+        interactive replies the next free slot. Every `progress_interval`
+        the admin's progress message is edited with the rate and an ETA,
+        and a checkpoint (the id up to which every recipient is done) is
+        saved. Broadcasts still running when the process stopped are resumed
+        from their checkpoint on the next start. Recipients who blocked the
+        bot or deleted their account are pruned.
+
+        Args:
+            recipients (RecipientStore): Recipient index, also used to save
+                checkpoints
+            on_blocked (callable): Called with the telegram id of every
+                recipient who blocked the bot
+            owner (int): This process's worker index; only its own
+                broadcasts are resumed
+            concurrency (int): Messages waiting for the rate limiter at once
+            paid (bool): Send with allow_paid_broadcast, which lifts
+                Telegram's 30 messages per second limit for a fee
+            progress_interval (float): Seconds between progress edits and
+                checkpoints
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.recipients = recipients
+        self.on_blocked = on_blocked
+        self.owner = owner
+        self.concurrency = concurrency
+        self.paid = paid
+        self.progress_interval = progress_interval
+        self.clock = clock
+        # broadcast_id -> Broadcast being sent
+        self.running = {}
+        self._tasks = set()
+
+        # Metrics
+        self.broadcasts = 0
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+
+    @property
+    def busy(self):
+        return bool(self.running)
+
+    async def resume(self, application):
+        """
+        Restart this process's broadcasts that an earlier run left unfinished
+        """
+        rows = await self.recipients.store.load(BROADCASTS)
+        for value in rows.values():
+            broadcast = Broadcast(**json.loads(value))
+            if not broadcast.done and broadcast.owner == self.owner:
+                self.logger.info(f"Resuming broadcast {broadcast.broadcast_id} after {broadcast.cursor}")
+                self.launch(application, broadcast)
+
+    def launch(self, application, broadcast):
+        """
+        Start sending `broadcast` in the background. It outlives the update
+        that started it; stop() interrupts it and the next start resumes it.
+        """
+        self.running[broadcast.broadcast_id] = broadcast
+        self.broadcasts += 1
+        task = asyncio.create_task(
+            self.run(application.bot, broadcast),
+            name=f"Broadcast:{broadcast.broadcast_id}"
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def stop(self):
+        """
+        Interrupt running broadcasts; each saves its checkpoint on the way out
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def checkpoint(self, broadcast):
+        await self.recipients.store.write({BROADCASTS: {broadcast.broadcast_id: json.dumps(asdict(broadcast))}})
+
+    async def run(self, bot, broadcast):
+        """
+        Send `broadcast` to every remaining recipient of its segment
+
+        Returns:
+            Broadcast: `broadcast`, finished
+        """
+        self.running[broadcast.broadcast_id] = broadcast
+        recipients = await self.recipients.load_segment(broadcast.segment)
+        ids = sorted(recipients, key=int)
+        if broadcast.cursor is not None:
+            handled = set(broadcast.handled_after)
+            ids = [
+                telegram_id for telegram_id in ids
+                if int(telegram_id) > int(broadcast.cursor) and telegram_id not in handled
+            ]
+        if not broadcast.total:
+            broadcast.total = len(ids)
+        await self.checkpoint(broadcast)
+
+        started = self.clock()
+        prior_elapsed = broadcast.elapsed
+        handled_before = broadcast.handled
+        next_index = 0
+        in_flight = set()
+        last_report = started
+        reporting = False
+
+        def rate():
+            seconds = self.clock() - started
+            return (broadcast.handled - handled_before) / seconds if seconds > 0 else 0.0
+
+        def advance_cursor():
+            # Everything before the oldest message not known to be handled
+            # is done; past it, remember the ones that are
+            lowest = min(in_flight, default=next_index)
+            if lowest > 0:
+                broadcast.cursor = ids[lowest - 1]
+            broadcast.handled_after = [ids[index] for index in range(lowest + 1, next_index) if index not in in_flight]
+
+        async def report():
+            advance_cursor()
+            broadcast.elapsed = prior_elapsed + self.clock() - started
+            await self.checkpoint(broadcast)
+            await self._edit(bot, broadcast, broadcast.progress_text(rate()))
+
+        async def send_next():
+            nonlocal next_index, last_report, reporting
+            while next_index < len(ids):
+                index = next_index
+                next_index += 1
+                in_flight.add(index)
+                await self._send(bot, broadcast, ids[index], recipients[ids[index]])
+                # Left in flight if interrupted: it may not have gone out, so
+                # the resumed broadcast sends it
+                in_flight.discard(index)
+                if not reporting and self.clock() - last_report >= self.progress_interval:
+                    reporting = True
+                    last_report = self.clock()
+                    try:
+                        await report()
+                    finally:
+                        reporting = False
+
+        try:
+            await asyncio.gather(*(send_next() for _ in range(min(self.concurrency, len(ids)) or 1)))
+        finally:
+            if next_index >= len(ids) and not in_flight:
+                broadcast.done = True
+            advance_cursor()
+            broadcast.elapsed = prior_elapsed + self.clock() - started
+            self.running.pop(broadcast.broadcast_id, None)
+            await self.checkpoint(broadcast)
+        await self._edit(bot, broadcast, broadcast.progress_text(rate()), priority=PRIORITY_HIGH)
+        self.logger.info(
+            f"Broadcast {broadcast.broadcast_id} finished: {broadcast.sent} sent, "
+            f"{broadcast.blocked} blocked, {broadcast.failed} failed in {broadcast.elapsed:.0f}s"
+        )
+        return broadcast
+
+    async def _send(self, bot, broadcast, telegram_id, language):
+        rate_limit_args = {'priority': PRIORITY_LOW, 'paid_broadcast': self.paid} if bot.rate_limiter else None
+        try:
+            await bot.send_message(
+                chat_id=int(telegram_id),
+                text=broadcast.text,
+                allow_paid_broadcast=self.paid or None,
+                rate_limit_args=rate_limit_args
+            )
+        except telegram.error.Forbidden:
+            # Blocked the bot or deactivated their account
+            self._prune(broadcast, telegram_id, language)
+            return
+        except telegram.error.BadRequest as e:
+            if 'chat not found' in str(e).lower():
+                self._prune(broadcast, telegram_id, language)
+                return
+            self._failed(broadcast, e)
+            return
+        except telegram.error.TelegramError as e:
+            self._failed(broadcast, e)
+            return
+        broadcast.sent += 1
+        self.sent += 1
+
+    def _prune(self, broadcast, telegram_id, language):
+        broadcast.blocked += 1
+        self.blocked += 1
+        self.recipients.remove(telegram_id, language)
+        if self.on_blocked is not None:
+            self.on_blocked(telegram_id)
+
+    def _failed(self, broadcast, error):
+        broadcast.failed += 1
+        self.failed += 1
+        self.logger.debug(f"Broadcast delivery error: {error}")
+
+    async def _edit(self, bot, broadcast, text, priority=PRIORITY_NORMAL):
+        rate_limit_args = {'priority': priority} if bot.rate_limiter else None
+        try:
+            await bot.edit_message_text(
+                text,
+                chat_id=broadcast.chat_id,
+                message_id=broadcast.message_id,
+                rate_limit_args=rate_limit_args
+            )
+        except telegram.error.BadRequest as e:
+            # Deleted by the admin, or unchanged
+            self.logger.debug(f"Broadcast progress edit skipped: {e}")
+        except telegram.error.TelegramError as e:
+            self.logger.error(f"Broadcast progress edit error: {e}")
+
+    def stats(self):
+        return {
+            'running': len(self.running),
+            'broadcasts': self.broadcasts,
+            'sent': self.sent,
+            'blocked': self.blocked,
+            'failed': self.failed,
+        }
@@ -0,0 +1,318 @@
+import io
+import csv
+import math
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+import httpx
+import telegram
+
+from backend_client import may_have_arrived
+from rate_limiter import PRIORITY_HIGH, PRIORITY_NORMAL
+from transfer_pipeline import TransferJob, TransferRejected, SessionExpired
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+_BASE58_INDEX = {char: index for index, char in enumerate(BASE58_ALPHABET)}
+
+# Outcome of each row, as written to the result file
+SENT = 'sent'
+REJECTED = 'rejected'
+SKIPPED = 'skipped'
+# The connection broke after the backend may have sent it; check before resending
+UNKNOWN = 'unknown'
+
+# Invalid rows listed back to the user before the rest are summarised
+MAX_REPORTED_ERRORS = 10
+
+
+def is_solana_address(text):
+    """
+    Whether `text` is base58 that decodes to a 32 byte public key
+    """
+    if not 32 <= len(text) <= 44:
+        return False
+    value = 0
+    for char in text:
+        index = _BASE58_INDEX.get(char)
+        if index is None:
+            return False
+        value = value * 58 + index
+    # Leading '1's stand for leading zero bytes
+    zeros = len(text) - len(text.lstrip('1'))
+    return zeros + (value.bit_length() + 7) // 8 == 32
+
+
+def parse_rows(text, parse_amount, max_rows=1000):
+    """
+    Parse and validate "address,amount[,wallet]" lines
+
+    A header row and blank lines are skipped. Every row is checked before
+    anything is sent, so one bad line rejects the whole list.
+
+    Args:
+        text (str): CSV document or message text
+        parse_amount (callable): text -> amount, raising ValueError
+        max_rows (int): Rows accepted in one list
+
+    Returns:
+        list: [line number, address, amount, wallet name or None] per row
+    """
+    rows = []
+    errors = []
+    for line, cells in enumerate(csv.reader(io.StringIO(text.strip())), start=1):
+        cells = [cell.strip() for cell in cells]
+        if not any(cells):
+            continue
+        if line == 1 and cells[0].lower() in ('address', 'to', 'receiver'):
+            continue
+        if len(cells) not in (2, 3):
+            errors.append(f"Line {line}: expected address,amount")
+            continue
+        address, amount = cells[0], cells[1]
+        wallet_name = cells[2] if len(cells) == 3 and cells[2] else None
+        if not is_solana_address(address):
+            errors.append(f"Line {line}: invalid address {address[:50]}")
+            continue
+        try:
+            amount = parse_amount(amount)
+        except ValueError:
+            errors.append(f"Line {line}: invalid amount {amount[:20]}")
+            continue
+        if not math.isfinite(amount) or amount <= 0:
+            errors.append(f"Line {line}: amount must be positive")
+            continue
+        rows.append([line, address, amount, wallet_name])
+
+    if errors:
+        listed = errors[:MAX_REPORTED_ERRORS]
+        if len(errors) > len(listed):
+            listed.append(f"…and {len(errors) - len(listed)} more")
+        raise ValueError(
+            f"❌ {len(errors)} invalid row(s), nothing was sent:\n" + '\n'.join(listed) +
+            "\n\nFix them and send the list again:"
+        )
+    if not rows:
+        raise ValueError("❌ No transfers found. Send address,amount lines:")
+    if len(rows) > max_rows:
+        raise ValueError(f"❌ At most {max_rows} transfers per list. Please split it up:")
+    return rows
+
+
+@dataclass
+class BulkRow:
+    """
+    One line of a bulk transfer and its outcome
+    """
+    line: int
+    job: TransferJob
+    status: str = None
+    error: str = ''
+
+
+@dataclass
+class BulkTransfer:
+    """
+    A validated list of transfers and the message reporting its progress
+
+    Attributes:
+        telegram_id (str): Owner of the transfers
+        chat_id (int): Chat holding the progress message
+        message_id (int): Progress message edited as rows are sent
+        rows (list): BulkRow per line, in file order
+        session_expired (bool): Set once the backend refuses the session
+    """
+    telegram_id: str
+    chat_id: int
+    message_id: int
+    rows: list = field(default_factory=list)
+    session_expired: bool = False
+
+    def count(self, status):
+        return sum(1 for row in self.rows if row.status == status)
+
+    def progress_text(self, done=False):
+        sent, rejected, skipped = self.count(SENT), self.count(REJECTED), self.count(SKIPPED)
+        unknown = self.count(UNKNOWN)
+        head = "✅ Bulk transfer finished" if done else "🚚 Bulk transfer in progress…"
+        text = (
+            f"{head}\n{sent + rejected + skipped + unknown}/{len(self.rows)} processed: "
+            f"{sent} sent, {rejected} rejected"
+        )
+        if skipped:
+            text += f", {skipped} not sent"
+        if unknown:
+            text += f", {unknown} unknown"
+        return text
+
+    def results_csv(self):
+        """
+        Per-row result file: the input columns plus status, signature, error
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['line', 'address', 'amount', 'wallet', 'status', 'signature', 'error'])
+        for row in self.rows:
+            payload = row.job.payload
+            writer.writerow([
+                row.line, payload['to'], payload['amount'], payload['walletName'],
+                row.status or SKIPPED, row.job.signature or '', row.error
+            ])
+        return buffer.getvalue().encode('utf-8')
+
+
+class BulkTransferRunner:
+    def __init__(self, submit, on_change=None, concurrency=4, progress_interval=2.0, clock=time.monotonic):
+        """
+        Sends bulk transfers row by row and streams progress into one message
+
+        Rows are grouped by source wallet. Each wallet's rows go out one at
+        a time in file order, so the backend sees them in the order the user
+        wrote them; different wallets are sent in parallel. At most
+        `concurrency` transfers are in flight across every running list. The
+        progress message is edited at most once per `progress_interval`, and
+        a CSV with the outcome of every row is sent when the list is done.
+
+        Args:
+            submit (callable): Coroutine taking a TransferJob and returning
+                its signature; raises TransferRejected or httpx.HTTPError
+            on_change (callable): Called with the job of every row sent
+            concurrency (int): Transfers sent at once
+            progress_interval (float): Minimum seconds between progress edits
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.submit_transfer = submit
+        self.on_change = on_change
+        self.progress_interval = progress_interval
+        self.clock = clock
+        self._slots = asyncio.Semaphore(concurrency)
+        # telegram_id -> BulkTransfer being sent
+        self.running = {}
+
+        # Metrics
+        self.lists = 0
+        self.counts = {SENT: 0, REJECTED: 0, SKIPPED: 0, UNKNOWN: 0}
+        self.progress_edits = 0
+
+    def busy(self, telegram_id):
+        return telegram_id in self.running
+
+    def launch(self, application, batch, update=None):
+        """
+        Start sending `batch` in the background. The application waits for
+        it on stop, so a list is never cut off halfway.
+        """
+        self.running[batch.telegram_id] = batch
+        self.lists += 1
+        return application.create_task(
+            self.run(application.bot, batch),
+            update=update,
+            name=f"BulkTransfer:{batch.telegram_id}"
+        )
+
+    async def run(self, bot, batch):
+        """
+        Send every row of `batch`, then report the result file
+
+        Returns:
+            BulkTransfer: `batch`, with the outcome of every row
+        """
+        self.running[batch.telegram_id] = batch
+        lanes = {}
+        for row in batch.rows:
+            lanes.setdefault(row.job.payload['walletName'], []).append(row)
+        last_edit = self.clock()
+
+        async def send_lane(rows):
+            nonlocal last_edit
+            for row in rows:
+                if batch.session_expired:
+                    # Every remaining row would be refused as well
+                    self._record(row, SKIPPED, 'not sent, session expired')
+                    continue
+                async with self._slots:
+                    await self._send(batch, row)
+                if self.clock() - last_edit >= self.progress_interval:
+                    last_edit = self.clock()
+                    await self._edit(bot, batch, batch.progress_text())
+
+        try:
+            await asyncio.gather(*(send_lane(rows) for rows in lanes.values()))
+        finally:
+            self.running.pop(batch.telegram_id, None)
+            await self._edit(bot, batch, batch.progress_text(done=True), priority=PRIORITY_HIGH)
+            await self._send_results(bot, batch)
+        return batch
+
+    def _record(self, row, status, error=''):
+        row.status = status
+        row.error = error
+        self.counts[status] += 1
+
+    async def _send(self, batch, row):
+        try:
+            row.job.signature = await self.submit_transfer(row.job)
+        except SessionExpired:
+            batch.session_expired = True
+            self._record(row, SKIPPED, 'not sent, session expired')
+            return
+        except TransferRejected as e:
+            self._record(row, REJECTED, str(e))
+            return
+        except (httpx.HTTPError, ValueError) as e:
+            self.logger.error(f"Bulk transfer error: {e!r}")
+            if may_have_arrived(e):
+                self._record(row, UNKNOWN, 'connection lost, may have been sent: check before resending')
+            else:
+                self._record(row, REJECTED, 'network error, not sent')
+            return
+        self._record(row, SENT)
+        if self.on_change is not None:
+            self.on_change(row.job)
+
+    async def _edit(self, bot, batch, text, priority=PRIORITY_NORMAL):
+        rate_limit_args = {'priority': priority} if bot.rate_limiter else None
+        self.progress_edits += 1
+        try:
+            await bot.edit_message_text(
+                text,
+                chat_id=batch.chat_id,
+                message_id=batch.message_id,
+                rate_limit_args=rate_limit_args
+            )
+        except telegram.error.BadRequest as e:
+            # Deleted by the user, or unchanged
+            self.logger.debug(f"Progress edit skipped: {e}")
+        except telegram.error.TelegramError as e:
+            self.logger.error(f"Progress edit error: {e}")
+
+    async def _send_results(self, bot, batch):
+        rate_limit_args = {'priority': PRIORITY_HIGH} if bot.rate_limiter else None
+        caption = batch.progress_text(done=True)
+        if batch.session_expired:
+            caption += "\n🔒 Your session expired. Send the rows marked skipped again with /bulktransfer."
+        if batch.count(UNKNOWN):
+            caption += "\n⚠️ Rows marked unknown may have been sent. Check /balance before sending them again."
+        try:
+            await bot.send_document(
+                chat_id=batch.chat_id,
+                document=batch.results_csv(),
+                filename='bulktransfer-results.csv',
+                caption=caption,
+                rate_limit_args=rate_limit_args
+            )
+        except telegram.error.TelegramError as e:
+            self.logger.error(f"Bulk transfer result error: {e}")
+
+    def stats(self):
+        return {
+            'running': len(self.running),
+            'lists': self.lists,
+            'sent': self.counts[SENT],
+            'rejected': self.counts[REJECTED],
+            'skipped': self.counts[SKIPPED],
+            'unknown': self.counts[UNKNOWN],
+            'progress_edits': self.progress_edits,
+        }
@@ -0,0 +1,120 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, maxsize=10000, ttl=15.0, clock=time.monotonic):
+        """
+        Bounded LRU cache with per-entry expiry and request coalescing
+
+        Keys are tuples whose first element is the owner (telegramId), so all
+        of a user's entries can be dropped at once with `invalidate_owner`.
+
+        Args:
+            maxsize (int): Maximum number of entries before LRU eviction
+            ttl (float): Seconds an entry stays fresh
+            clock (callable): Monotonic time source
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._owners = {}
+        self._in_flight = {}
+        self._stale = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        keys = self._owners.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._owners[key[0]]
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        self._owners.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    async def get_or_load(self, key, loader, should_cache=lambda value: True):
+        """
+        Return the cached value for `key`, or await `loader()` to fill it.
+        Concurrent callers for the same key share one in-flight load.
+
+        Args:
+            key (tuple): Cache key, owner first
+            loader (callable): Coroutine function producing the value
+            should_cache (callable): Whether a loaded value may be stored
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited future doesn't log a warning
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            # Don't store a value that was invalidated while it was loading
+            if should_cache(value) and key not in self._stale:
+                self.set(key, value)
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+            self._stale.discard(key)
+
+    def invalidate_owner(self, owner):
+        """
+        Drop every entry belonging to `owner` (e.g. after a transfer)
+        """
+        self._stale.update(key for key in self._in_flight if key[0] == owner)
+        for key in list(self._owners.get(owner, ())):
+            self._drop(key)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'coalesced': self.coalesced,
+        }
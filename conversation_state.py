@@ -0,0 +1,130 @@
+import time
+import logging
+from collections import OrderedDict
+
+from persistence import SECRET_KEYS
+
+# Idle timeout per flow, in seconds
+FLOW_TIMEOUTS = {
+    'signup': 300,
+    'switchnetwork': 180,
+    'balance': 180,
+    'balances': 180,
+    'transfer': 300,
+    'bulktransfer': 600,
+    'broadcast': 600,
+}
+
+# user_data keys that outlive flows: the recent wallet list and the chosen network
+PROFILE_KEYS = frozenset({'wallets', 'network', 'rpc_url'})
+
+
+class ConversationLifecycle:
+    def __init__(self, max_conversations=10000, idle_ttl=900, owns_user=None, clock=time.monotonic):
+        """
+        Keeps conversation state bounded
+
+        The flow router reports every step here. Users are kept in LRU
+        order; past `max_conversations` the least recently active user's
+        flow is ended and its answers dropped. A periodic sweep scrubs
+        secrets of users with no live flow and, once a user is idle for
+        longer than `idle_ttl`, drops everything in their user_data but
+        PROFILE_KEYS, from memory and the store alike.
+
+        Args:
+            max_conversations (int): Users allowed to be mid-conversation at once
+            idle_ttl (float): Seconds before an idle user's flow answers are dropped
+            owns_user (callable): In supervisor mode, whether a user id is
+                routed to this worker; other users' user_data is never
+                dropped here, since dropping it deletes it from the shared store
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_conversations = max_conversations
+        self.idle_ttl = idle_ttl
+        self.owns_user = owns_user
+        self.clock = clock
+        self.router = None
+        self._active = OrderedDict()
+        self._last_seen = {}
+        self.evictions = 0
+
+    def attach(self, router):
+        """
+        Track the flows of `router` (a FlowRouter)
+        """
+        self.router = router
+        router.on_activity = self.touch
+
+    def touch(self, user_id, application, ended=False):
+        """
+        Record activity for `user_id`; evict the LRU user when over the cap
+        """
+        now = self.clock()
+        self._last_seen[user_id] = now
+        if ended:
+            self._active.pop(user_id, None)
+            self.scrub(application, user_id, SECRET_KEYS)
+            return
+
+        self._active[user_id] = now
+        self._active.move_to_end(user_id)
+        while len(self._active) > self.max_conversations:
+            evicted, _ = self._active.popitem(last=False)
+            self.router.end(application, evicted, discard=True, notify=False)
+            self.scrub(application, evicted, SECRET_KEYS)
+            self.evictions += 1
+
+    @staticmethod
+    def scrub(application, user_id, keys):
+        user_data = application.user_data.get(user_id)
+        if not user_data:
+            return
+        removed = [key for key in keys if user_data.pop(key, None) is not None]
+        if removed:
+            application.mark_data_for_update_persistence(user_ids=user_id)
+
+    @classmethod
+    def forget(cls, application, user_id):
+        """
+        Drop the flow answers of `user_id`, keeping PROFILE_KEYS; user_data
+        left with nothing to keep is dropped whole
+        """
+        user_data = application.user_data.get(user_id)
+        if user_data and not PROFILE_KEYS.isdisjoint(user_data):
+            cls.scrub(application, user_id, [key for key in user_data if key not in PROFILE_KEYS])
+        else:
+            application.drop_user_data(user_id)
+
+    async def sweep(self, context):
+        """
+        JobQueue callback: forget users whose flows have ended or timed out,
+        scrub their secrets and drop the answers of long-idle users
+        """
+        application = context.application
+        live_users = self.router.sessions
+        now = self.clock()
+
+        for user_id in list(self._active):
+            if user_id not in live_users:
+                del self._active[user_id]
+
+        for user_id in list(application.user_data):
+            if user_id in live_users:
+                continue
+            if self.owns_user is not None and not self.owns_user(user_id):
+                continue
+            self.scrub(application, user_id, SECRET_KEYS)
+            # user_data restored from persistence starts ageing now
+            if now - self._last_seen.setdefault(user_id, now) > self.idle_ttl:
+                self.forget(application, user_id)
+                self._last_seen.pop(user_id, None)
+
+        for user_id in [u for u, seen in self._last_seen.items() if now - seen > self.idle_ttl]:
+            del self._last_seen[user_id]
+
+    def stats(self):
+        return {
+            'active_users': len(self._active),
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,226 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+
+from metrics import LOOP_LAG, LOOP_STALLS, handler_name
+
+# Frames of the event loop waiting for I/O; a sample ending here is idle time
+IDLE_FUNCTIONS = frozenset({'select', 'poll', 'epoll', '_run_once'})
+IDLE = '(idle)'
+OTHER = '(outside handlers)'
+
+# Frames of one stall logged with the stack
+STACK_LIMIT = 30
+
+
+def _where(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+
+
+class LoopLagMonitor:
+    def __init__(self, threshold=0.25, interval=0.1, clock=time.monotonic):
+        """
+        Detects event loop stalls and logs what blocked it
+
+        A heartbeat task wakes every `interval` seconds and records how late
+        it was. A watchdog thread checks the heartbeat; when the loop has not
+        beaten for `threshold` seconds it logs the loop thread's current
+        stack once, i.e. the code that is blocking it right now.
+
+        Args:
+            threshold (float): Seconds without a heartbeat counted as a stall
+            interval (float): Seconds between heartbeats
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.threshold = threshold
+        self.interval = interval
+        self.clock = clock
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._beat = clock()
+        self._reported_beat = None
+
+        # Metrics
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = self.clock()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name='LoopLagMonitor')
+        self._thread = threading.Thread(target=self._watch, name='LoopLagWatchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = self.clock()
+            lag = max(0.0, now - self._beat - self.interval)
+            self._beat = now
+            LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked = self.clock() - beat - self.interval
+            if blocked < self.threshold or beat == self._reported_beat:
+                continue
+            # One report per stall
+            self._reported_beat = beat
+            self.stalls += 1
+            LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread)
+            task = asyncio.current_task(self._loop)
+            stack = ''.join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame is not None else ''
+            self.logger.warning(
+                f"Event loop blocked for {blocked:.2f}s in {handler_name(frame) or OTHER}",
+                extra={
+                    'blocked_ms': round(blocked * 1000, 1),
+                    'task': task.get_name() if task is not None else None,
+                    'stack': stack,
+                }
+            )
+
+    def stats(self):
+        return {
+            'stalls': self.stalls,
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+        }
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, top=10):
+        """
+        Samples the event loop thread's stack to show where its time goes
+
+        A background thread reads the loop thread's current frame every
+        `interval` seconds. Samples are grouped by the handler the stack
+        runs in (its timed_callback wrapper), and each group lists its most
+        frequent innermost frames. Samples where the loop waits for I/O are
+        counted as idle.
+
+        Args:
+            interval (float): Seconds between samples
+            top (int): Frames listed per handler
+        """
+        self.logger = logging.getLogger(__name__)
+        self.interval = interval
+        self.top = top
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    async def profile(self, seconds):
+        """
+        Sample the running loop for `seconds`; one profile at a time
+
+        Returns:
+            str: Report of samples per handler and their top frames
+        """
+        async with self._lock:
+            target = threading.get_ident()
+            stop = threading.Event()
+            handlers = Counter()
+            frames = {}
+            samples = 0
+
+            def sample():
+                nonlocal samples
+                while not stop.wait(self.interval):
+                    frame = sys._current_frames().get(target)
+                    if frame is None:
+                        continue
+                    samples += 1
+                    if frame.f_code.co_name in IDLE_FUNCTIONS:
+                        handlers[IDLE] += 1
+                        continue
+                    name = handler_name(frame) or OTHER
+                    handlers[name] += 1
+                    frames.setdefault(name, Counter())[_where(frame)] += 1
+
+            thread = threading.Thread(target=sample, name='SamplingProfiler', daemon=True)
+            started = time.monotonic()
+            thread.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.get_running_loop().run_in_executor(None, thread.join)
+            elapsed = time.monotonic() - started
+            return self._report(elapsed, samples, handlers, frames)
+
+    def _report(self, elapsed, samples, handlers, frames):
+        lines = [f"Profile: {samples} samples over {elapsed:.1f}s, every {self.interval * 1000:g}ms", '']
+        for name, count in handlers.most_common():
+            lines.append(f"{name}: {count} samples ({100 * count / max(samples, 1):.1f}%)")
+            for where, hits in frames.get(name, Counter()).most_common(self.top):
+                lines.append(f"    {hits:6d}  {where}")
+        return '\n'.join(lines) + '\n'
+
+
+def _await_frames(coroutine):
+    """
+    Frames of a suspended coroutine and of everything it awaits, outermost
+    first. Task.get_stack stops at the task's own coroutine.
+    """
+    frames = []
+    while coroutine is not None:
+        frame = getattr(coroutine, 'cr_frame', None) or getattr(coroutine, 'gi_frame', None) \
+            or getattr(coroutine, 'ag_frame', None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coroutine = getattr(coroutine, 'cr_await', None) or getattr(coroutine, 'gi_yieldfrom', None) \
+            or getattr(coroutine, 'ag_await', None)
+    return frames
+
+
+def dump_tasks(backend=None, stack_limit=8):
+    """
+    Live asyncio tasks with the code each is waiting in, and the backend
+    calls in flight
+
+    Args:
+        backend (BackendClient): Client whose in-flight calls to list
+        stack_limit (int): Frames shown per task
+
+    Returns:
+        str: Plain text report
+    """
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    lines = [f"{len(tasks)} tasks", '']
+    for task in tasks:
+        lines.append(f"{task.get_name()}: {getattr(task.get_coro(), '__qualname__', task.get_coro())}")
+        # The innermost frames say what the task is waiting on
+        for frame in _await_frames(task.get_coro())[-stack_limit:]:
+            lines.append(f"    {_where(frame)}")
+    if backend is not None:
+        calls = backend.in_flight()
+        lines += ['', f"{len(calls)} backend calls in flight"]
+        for call in calls:
+            lines.append(f"    {call['endpoint']} for {call['seconds']:.2f}s (trace {call['trace_id']})")
+    return '\n'.join(lines) + '\n'
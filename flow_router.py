@@ -0,0 +1,416 @@
+import re
+import time
+import heapq
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler, filters as Filters
+
+# user_data key holding the user's position:
+# [flow name, step name, chat id, id of the prompt message]
+FLOW_STATE_KEY = 'flow'
+
+# Inline button data: 'flow|<step>|<choice index>' or 'flow|cancel'. Choices
+# are sent by index to stay within Telegram's 64 byte callback_data limit.
+CALLBACK_PREFIX = 'flow|'
+CANCEL_CALLBACK = 'flow|cancel'
+
+
+class RetryStep(Exception):
+    """
+    Raised by a flow action that can't run right now; the user is put back
+    on the step they just answered, with the message as a notice, and keeps
+    the answers given so far
+    """
+
+
+def required(message):
+    """
+    Validator rejecting empty input with `message`
+    """
+    def validate(text):
+        text = (text or '').strip()
+        if not text:
+            raise ValueError(message)
+        return text
+    return validate
+
+
+def one_of(options, message):
+    """
+    Validator accepting only one of `options`
+    """
+    def validate(text):
+        if text not in options:
+            raise ValueError(message)
+        return text
+    return validate
+
+
+@dataclass(frozen=True)
+class Step:
+    """
+    One prompt/answer exchange of a flow
+
+    Attributes:
+        key (str): user_data key the validated answer is stored under
+        prompt (str | callable): Text sent when the flow reaches this step,
+            or a callable taking user_data and returning it
+        validate (callable): text -> value; raise ValueError(message) to re-ask
+        next (str | callable | None): Next step name, a callable taking
+            (update, context) and returning one, or None to run the flow's
+            action
+        choices (callable): Optional callable taking user_data and returning
+            (label, answer) pairs, offered as inline buttons. Typed answers
+            are still accepted.
+        columns (int): Buttons per keyboard row
+        cancel_button (bool): Add a button that cancels the flow
+        accepts_document (bool): Also accept an uploaded text file, whose
+            content is validated like a typed answer
+    """
+    key: str
+    prompt: Union[str, Callable]
+    validate: Optional[Callable] = None
+    next: Union[str, Callable, None] = None
+    choices: Optional[Callable] = None
+    columns: int = 1
+    cancel_button: bool = False
+    accepts_document: bool = False
+
+
+@dataclass(frozen=True)
+class Flow:
+    """
+    A command-started conversation
+
+    Attributes:
+        name (str): Flow name, used in metrics and persisted state
+        command (str): Command that starts the flow
+        first (str | callable): Name of the first step, or a callable taking
+            (update, context) and returning one, or None to run the action
+            straight away
+        steps (dict): Step name -> Step
+        action (callable): Terminal backend action, awaited with (update, context).
+            The update is a message or a callback query, so actions reply
+            through update.effective_message. Raising RetryStep re-asks the
+            last step.
+        timeout (float): Idle seconds before the flow is abandoned
+    """
+    name: str
+    command: str
+    first: Union[str, Callable]
+    steps: dict = field(default_factory=dict)
+    action: Optional[Callable] = None
+    timeout: float = 300
+
+
+class _InFlowFilter(Filters.UpdateFilter):
+    def __init__(self, router):
+        super().__init__(name='in_flow')
+        self.router = router
+
+    def filter(self, update):
+        user = update.effective_user
+        return user is not None and user.id in self.router.sessions
+
+
+class FlowRouter:
+    def __init__(self, flows, on_activity=None, timeout_message='⌛ Session timed out.',
+                 cancel_message='🚫 Operation cancelled.', max_document_size=256 * 1024,
+                 clock=time.monotonic):
+        """
+        Dispatches every flow from one command handler, one message handler
+        and one callback query handler, replacing a ConversationHandler per
+        flow
+
+        The user's position lives in user_data (so it is persisted with
+        it); `sessions` mirrors it per user for O(1) routing, timeouts and
+        eviction. A button press edits the prompt it belongs to into the
+        next prompt instead of sending a new message.
+
+        Args:
+            flows (list): Flow definitions
+            on_activity (callable): Called with (user_id, application, ended)
+                after every step, e.g. ConversationLifecycle.touch
+            timeout_message (str): Sent when a flow is abandoned for too long
+            cancel_message (str): Shown when the cancel button is pressed
+            max_document_size (int): Largest upload accepted as an answer, in bytes
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.flows = {flow.name: flow for flow in flows}
+        self._by_command = {flow.command: flow for flow in flows}
+        self.on_activity = on_activity
+        self.timeout_message = timeout_message
+        self.cancel_message = cancel_message
+        self.max_document_size = max_document_size
+        self.clock = clock
+        # user_id -> (flow name, chat id, deadline)
+        self.sessions = {}
+        self._deadlines = []
+        self.timed_out = 0
+
+    def handlers(self):
+        """
+        The PTB handlers to register, in order
+        """
+        return [
+            CommandHandler(list(self._by_command), self.start_flow),
+            CallbackQueryHandler(self.route_callback, pattern=f"^{re.escape(CALLBACK_PREFIX)}"),
+            MessageHandler(
+                (Filters.TEXT & ~Filters.COMMAND | Filters.Document.ALL) & _InFlowFilter(self),
+                self.route_message
+            ),
+        ]
+
+    def flow_for_command(self, command):
+        return self._by_command.get(command)
+
+    def restore(self, application):
+        """
+        Rebuild the session index from user_data loaded by the persistence
+        """
+        for user_id, user_data in application.user_data.items():
+            state = user_data.get(FLOW_STATE_KEY)
+            if state and state[0] in self.flows:
+                self._track(user_id, self.flows[state[0]], state[2])
+            elif state:
+                user_data.pop(FLOW_STATE_KEY, None)
+
+    def _track(self, user_id, flow, chat_id):
+        deadline = self.clock() + flow.timeout
+        self.sessions[user_id] = (flow.name, chat_id, deadline)
+        heapq.heappush(self._deadlines, (deadline, user_id))
+
+    def _notify(self, user_id, application, ended):
+        if self.on_activity is not None:
+            self.on_activity(user_id, application, ended)
+
+    @staticmethod
+    def _keyboard(step_name, step, user_data):
+        buttons = [
+            InlineKeyboardButton(label, callback_data=f"{CALLBACK_PREFIX}{step_name}|{index}")
+            for index, (label, _) in enumerate(step.choices(user_data) if step.choices else ())
+        ]
+        rows = [buttons[i:i + step.columns] for i in range(0, len(buttons), step.columns)]
+        if step.cancel_button:
+            rows.append([InlineKeyboardButton('❌ Cancel', callback_data=CANCEL_CALLBACK)])
+        return InlineKeyboardMarkup(rows) if rows else None
+
+    async def _prompt(self, update, context, flow, step_name, edit, notice=None):
+        """
+        Show the prompt of `step_name`, editing the pressed message in place
+        when `edit` is set, and record it as the user's position
+        """
+        step = flow.steps[step_name]
+        text = step.prompt(context.user_data) if callable(step.prompt) else step.prompt
+        if notice:
+            text = f"{notice}\n{text}"
+        reply_markup = self._keyboard(step_name, step, context.user_data)
+        if edit:
+            message = await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+        else:
+            message = await update.effective_message.reply_text(text, reply_markup=reply_markup)
+        context.user_data[FLOW_STATE_KEY] = [flow.name, step_name, update.effective_chat.id, message.message_id]
+
+    async def begin(self, update, context, flow, edit=False):
+        """
+        Put the user on the first step of `flow`, replacing any flow in
+        progress. With `edit`, the pressed message becomes the first prompt.
+        """
+        user_id = update.effective_user.id
+        # Answers left over from an earlier run must not skip steps
+        for step in flow.steps.values():
+            context.user_data.pop(step.key, None)
+        first = flow.first(update, context) if callable(flow.first) else flow.first
+        if first is None:
+            self.end(context.application, user_id, notify=False)
+            try:
+                await self._finish(update, context, flow)
+            except RetryStep as e:
+                await update.effective_message.reply_text(str(e))
+            return
+        self._track(user_id, flow, update.effective_chat.id)
+        await self._prompt(update, context, flow, first, edit)
+        self._notify(user_id, context.application, ended=False)
+
+    async def goto(self, update, context, flow_name, step_name, notice=None):
+        """
+        Put the user back on `step_name` of `flow_name`, keeping the answers
+        collected so far, e.g. when an action finds the session expired
+        """
+        flow = self.flows[flow_name]
+        user_id = update.effective_user.id
+        self._track(user_id, flow, update.effective_chat.id)
+        await self._prompt(update, context, flow, step_name, edit=False, notice=notice)
+        self._notify(user_id, context.application, ended=False)
+
+    async def start_flow(self, update, context):
+        """
+        Entry point for every flow command
+        """
+        command = update.message.text.split()[0][1:].split('@')[0].lower()
+        await self.begin(update, context, self._by_command[command])
+
+    def _current(self, context):
+        state = context.user_data.get(FLOW_STATE_KEY)
+        flow = self.flows.get(state[0]) if state else None
+        step = flow.steps.get(state[1]) if flow else None
+        return state, flow, step
+
+    async def _read_document(self, document):
+        """
+        Text content of an uploaded file
+
+        Raises:
+            ValueError: The file is too large or not UTF-8 text
+        """
+        if document.file_size and document.file_size > self.max_document_size:
+            raise ValueError(f"📄 File too large, the limit is {self.max_document_size // 1024} KB.")
+        file = await document.get_file()
+        content = await file.download_as_bytearray()
+        try:
+            return bytes(content).decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ValueError("📄 Couldn't read the file. Please send a UTF-8 text or CSV file.")
+
+    async def route_message(self, update, context):
+        """
+        Hand a text message, or a file where the step accepts one, to the
+        step the user is currently on
+        """
+        state, flow, step = self._current(context)
+        if step is None:
+            self.end(context.application, update.effective_user.id)
+            return
+
+        message = update.message
+        answer = message.text
+        if message.document is not None:
+            try:
+                if not step.accepts_document:
+                    raise ValueError("📄 Please answer with a text message.")
+                answer = await self._read_document(message.document)
+            except ValueError as e:
+                await message.reply_text(str(e))
+                return
+        await self._answer(update, context, flow, step, answer, edit=False)
+
+    async def route_callback(self, update, context):
+        """
+        Hand a button press to the step whose prompt it belongs to. Buttons
+        of older prompts are answered as expired.
+        """
+        query = update.callback_query
+        user_id = update.effective_user.id
+        state, flow, step = self._current(context)
+
+        if query.data == CANCEL_CALLBACK:
+            await query.answer()
+            if step is not None and state[3] == query.message.message_id:
+                self.end(context.application, user_id, discard=True)
+                await query.edit_message_text(self.cancel_message)
+            return
+
+        _, step_name, index = query.data.split('|', 2)
+        choices = step.choices(context.user_data) if step is not None and step.choices else []
+        if state is None or state[1] != step_name or state[3] != query.message.message_id \
+                or not index.isdigit() or int(index) >= len(choices):
+            await query.answer('⌛ This menu has expired.')
+            return
+
+        await query.answer()
+        _, answer = choices[int(index)]
+        await self._answer(update, context, flow, step, answer, edit=True)
+
+    async def _finish(self, update, context, flow):
+        user_id = update.effective_user.id
+        try:
+            await flow.action(update, context)
+        finally:
+            # The action may have sent the user back into the flow
+            self._notify(user_id, context.application, ended=user_id not in self.sessions)
+
+    async def _answer(self, update, context, flow, step, answer, edit):
+        """
+        Validate and store the answer to `step`, then move on to the next
+        step or run the flow's action
+        """
+        user_id = update.effective_user.id
+        try:
+            value = step.validate(answer) if step.validate else answer
+        except ValueError as e:
+            await update.effective_message.reply_text(str(e))
+            self._track(user_id, flow, update.effective_chat.id)
+            self._notify(user_id, context.application, ended=False)
+            return
+
+        context.user_data[step.key] = value
+        next_step = step.next(update, context) if callable(step.next) else step.next
+        if next_step is None:
+            step_name = context.user_data[FLOW_STATE_KEY][1]
+            # Leave the flow before the backend call, so a failure there
+            # can't strand the user on a finished step
+            self.end(context.application, user_id, notify=False)
+            try:
+                await self._finish(update, context, flow)
+            except RetryStep as e:
+                await self.goto(update, context, flow.name, step_name, notice=str(e))
+            return
+
+        self._track(user_id, flow, update.effective_chat.id)
+        await self._prompt(update, context, flow, next_step, edit)
+        self._notify(user_id, context.application, ended=False)
+
+    def end(self, application, user_id, discard=False, notify=True):
+        """
+        Take `user_id` out of whatever flow it is in
+
+        Args:
+            application (Application): The running application
+            user_id (int): User to release
+            discard (bool): Also drop the answers the flow collected
+            notify (bool): Report the end to `on_activity`
+        """
+        self.sessions.pop(user_id, None)
+        user_data = application.user_data.get(user_id)
+        if user_data is not None:
+            state = user_data.pop(FLOW_STATE_KEY, None)
+            flow = self.flows.get(state[0]) if state else None
+            if discard and flow is not None:
+                for step in flow.steps.values():
+                    user_data.pop(step.key, None)
+            if state is not None:
+                application.mark_data_for_update_persistence(user_ids=user_id)
+        if notify:
+            self._notify(user_id, application, ended=True)
+
+    async def expire(self, context):
+        """
+        JobQueue callback: end flows idle past their timeout and tell the user
+        """
+        now = self.clock()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, user_id = heapq.heappop(self._deadlines)
+            session = self.sessions.get(user_id)
+            # Stale heap entries are skipped; the session moved on
+            if session is None or session[2] != deadline:
+                continue
+            _, chat_id, _ = session
+            self.end(context.application, user_id, discard=True)
+            self.timed_out += 1
+            await context.bot.send_message(chat_id=chat_id, text=self.timeout_message)
+
+    def active_counts(self):
+        counts = {name: 0 for name in self.flows}
+        for flow_name, _, _ in self.sessions.values():
+            counts[flow_name] += 1
+        return counts
+
+    def stats(self):
+        return {
+            'live_conversations': len(self.sessions),
+            'timed_out': self.timed_out,
+        }
@@ -0,0 +1,133 @@
+import os
+import sys
+import asyncio
+import logging
+
+
+async def drain(application, timeout):
+    """
+    Give updates already received `timeout` seconds to be handled
+
+    Updates that were never started are set aside by the update processor
+    and persisted with bot_data, so the next process handles them.
+    Call after ingress stopped and before Application.stop().
+
+    Returns:
+        bool: Whether everything was handled in time
+    """
+    processor = application.update_processor
+    if not hasattr(processor, 'drain'):
+        return True
+    return await processor.drain(application.update_queue, timeout)
+
+
+async def run_polling(application, stopping, drain_timeout=20.0):
+    """
+    Serve the bot by long polling until `stopping` is set, then stop
+    fetching, drain in-flight updates and shut down
+
+    Stopping the Updater confirms the offset of every update it fetched, so
+    the next process starts right after them without repeating any.
+
+    Args:
+        application (Application): Built python-telegram-bot application
+        stopping (asyncio.Event): Set to shut down
+        drain_timeout (float): Seconds in-flight updates get to finish
+    """
+    # run_polling normally drives these hooks; do it by hand here
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.updater.start_polling()
+        await application.start()
+        await stopping.wait()
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await drain(application, drain_timeout)
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+class _SourceEvents:
+    def __init__(self, pattern, found):
+        """
+        watchdog event handler reporting changed source files to `found`.
+        The observer only calls `dispatch`, so no watchdog base class is needed.
+        """
+        self.pattern = pattern
+        self.found = found
+
+    def dispatch(self, event):
+        # Opening or closing a file without writing doesn't change it
+        if event.is_directory or event.event_type not in ('created', 'modified', 'deleted', 'moved'):
+            return
+        # Editors often save by renaming a temporary file over the source
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            path = os.fsdecode(path)
+            if path.endswith(self.pattern):
+                self.found(path)
+                return
+
+
+class SourceWatcher:
+    def __init__(self, root, pattern='.py'):
+        """
+        Watches the bot's source files through watchdog's observer, for
+        reloading on change during development
+
+        Args:
+            root (str): Directory whose files (not subdirectories) are watched
+            pattern (str): Suffix of the watched file names
+        """
+        # Only needed with DEV_RELOAD; fail at startup, not in the watch task
+        from watchdog.observers import Observer
+
+        self.logger = logging.getLogger(__name__)
+        self.root = root
+        self.pattern = pattern
+        self._observer_class = Observer
+
+    async def changed(self):
+        """
+        Wait until a watched file is added, removed or modified
+
+        Returns:
+            str: Path of a changed file
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def found(path):
+            if not future.done():
+                future.set_result(path)
+
+        observer = self._observer_class()
+        # Events arrive on the observer's thread
+        observer.schedule(
+            _SourceEvents(self.pattern, lambda path: loop.call_soon_threadsafe(found, path)),
+            self.root,
+            recursive=False
+        )
+        observer.start()
+        try:
+            return await future
+        finally:
+            observer.stop()
+            await asyncio.to_thread(observer.join)
+
+
+def restart_process():
+    """
+    Replace this process with a fresh one running the same command line.
+    Only after a complete shutdown: nothing past this point runs.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
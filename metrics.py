@@ -0,0 +1,286 @@
+import time
+import types
+import bisect
+import datetime
+import functools
+
+from telegram.ext import ConversationHandler
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        """
+        Collection of metrics rendered together in Prometheus text format
+        """
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._callbacks = []
+        registry.register(self)
+
+    def set(self, value, **labels):
+        self._values[tuple(labels[name] for name in self.labelnames)] = value
+
+    def set_function(self, callback):
+        """
+        Compute values at scrape time. `callback` returns a dict of
+        label-value tuples to numbers.
+        """
+        self._callbacks.append(callback)
+
+    def samples(self):
+        values = dict(self._values)
+        for callback in self._callbacks:
+            values.update(callback())
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        counts = self._values.get(key)
+        if counts is None:
+            counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        for key, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+HANDLER_LATENCY = Histogram(
+    'bot_handler_duration_seconds',
+    'Time spent in each bot handler callback.',
+    ['handler']
+)
+UPDATE_LAG = Histogram(
+    'bot_update_lag_seconds',
+    'Time from the user sending a message to the handler starting; button presses are not counted.',
+    buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+BACKEND_LATENCY = Histogram(
+    'bot_backend_request_duration_seconds',
+    'Backend request latency per endpoint.',
+    ['endpoint']
+)
+BACKEND_RESPONSES = Counter(
+    'bot_backend_responses_total',
+    'Backend responses per endpoint and HTTP status ("error" for transport failures).',
+    ['endpoint', 'status']
+)
+ACTIVE_CONVERSATIONS = Gauge(
+    'bot_active_conversations',
+    'Conversations currently in progress per flow.',
+    ['conversation']
+)
+SERVER_ERRORS = Counter(
+    'bot_server_errors_total',
+    'Errors reported to users by handle_server_error, by backend error.',
+    ['category']
+)
+LOOP_LAG = Histogram(
+    'bot_event_loop_lag_seconds',
+    'How late the event loop heartbeat woke up.',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+LOOP_STALLS = Counter(
+    'bot_event_loop_stalls_total',
+    'Times the event loop was blocked longer than LOOP_LAG_THRESHOLD.'
+)
+COMPONENT_STATS = Gauge(
+    'bot_component_stats',
+    'Internal counters of the balance cache, outbound rate limiter and update shards.',
+    ['component', 'stat']
+)
+
+
+def track_component(component, stats):
+    """
+    Export the numeric entries of a component's stats() dict
+    """
+    COMPONENT_STATS.set_function(lambda: {
+        (component, stat): value
+        for stat, value in stats().items()
+        if isinstance(value, (int, float))
+    })
+
+
+def _sent_at(update):
+    """
+    When the user sent the update, if Telegram says. A callback query's
+    message is the bot's own prompt, dated when the bot sent it, so button
+    presses have no usable date.
+    """
+    message = getattr(update, 'message', None)
+    if message is not None:
+        return message.date
+    edited = getattr(update, 'edited_message', None)
+    if edited is not None:
+        return edited.edit_date or edited.date
+    return None
+
+
+def timed_callback(callback, record_lag=True):
+    """
+    Wrap a handler callback to record its latency and the update's queue lag
+
+    Args:
+        callback (callable): Coroutine function taking (update, context)
+        record_lag (bool): Also observe the update's lag; off for callbacks
+            nested inside an already timed handler
+    """
+    name = getattr(callback, '__name__', repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        if record_lag:
+            sent_at = _sent_at(update)
+            if sent_at is not None:
+                lag = datetime.datetime.now(datetime.timezone.utc) - sent_at
+                UPDATE_LAG.observe(max(lag.total_seconds(), 0.0))
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+# Code of the wrapper timed_callback returns; its frames mark which handler
+# a stack belongs to
+_TIMED_WRAPPER_CODE = next(
+    const for const in timed_callback.__code__.co_consts
+    if isinstance(const, types.CodeType) and const.co_name == 'wrapper'
+)
+
+
+def handler_name(frame):
+    """
+    Name of the innermost timed handler `frame` runs in, or None
+
+    Args:
+        frame: Innermost frame of a stack, e.g. from sys._current_frames()
+    """
+    while frame is not None:
+        if frame.f_code is _TIMED_WRAPPER_CODE:
+            return frame.f_locals.get('name')
+        frame = frame.f_back
+    return None
+
+
+def instrument_handler(handler, wrap=timed_callback):
+    """
+    Wrap the callback of `handler` and, for a ConversationHandler, of every
+    handler in its entry points, states and fallbacks
+
+    Returns:
+        The same handler, for chaining into add_handler
+    """
+    if isinstance(handler, ConversationHandler):
+        nested = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            nested.extend(state_handlers)
+        for child in nested:
+            instrument_handler(child, wrap)
+    else:
+        handler.callback = wrap(handler.callback)
+    return handler
+
+
+def track_conversations(counts):
+    """
+    Report the number of live conversations per flow
+
+    Args:
+        counts (callable): Returns a dict of flow name -> live conversations,
+            e.g. FlowRouter.active_counts
+    """
+    ACTIVE_CONVERSATIONS.set_function(lambda: {(name,): value for name, value in counts().items()})
+
+
+async def handle_metrics(scope, body):
+    """
+    RouteApp handler for GET /metrics
+    """
+    return 200, 'text/plain; version=0.0.4; charset=utf-8', REGISTRY.render().encode('utf-8')
@@ -0,0 +1,279 @@
+import json
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+
+import httpx
+import telegram
+
+from rate_limiter import PRIORITY_LOW
+from structured_logging import start_trace
+
+# bot_data keys: one per subscribed telegram id, so the persistence writes
+# only the subscriptions that changed, and the id of the last event handled
+SUBSCRIBER_PREFIX = 'notify:'
+CURSOR_KEY = 'event_cursor'
+
+
+class EventStream:
+    def __init__(self, backend, on_event, api_token=None, endpoint='/api/events', cursor=None,
+                 min_backoff=1.0, max_backoff=60.0, dedupe_window=1000):
+        """
+        One long-lived server-sent event connection to the backend
+
+        Every account change the backend sees arrives on this stream, so
+        the bot learns about incoming transfers without polling balances.
+        Events are `id:`/`event:`/`data:` blocks; `data` is JSON. After a
+        dropped connection the stream reconnects with full jitter backoff
+        and resumes from the last event id (sent as `cursor` and
+        Last-Event-ID). Events replayed around a reconnect are dropped.
+
+        Args:
+            backend (BackendClient): Shared backend client
+            on_event (callable): Called with (event type, data dict) per event
+            api_token (str): API_TOKEN sent when connecting
+            endpoint (str): Event stream endpoint
+            cursor (str): Event id to resume after, e.g. from the last run
+            min_backoff (float): First reconnect delay, in seconds
+            max_backoff (float): Reconnect delay cap, in seconds
+            dedupe_window (int): Recent event ids remembered to drop replays
+        """
+        self.logger = logging.getLogger(__name__)
+        self.backend = backend
+        self.on_event = on_event
+        self.api_token = api_token
+        self.endpoint = endpoint
+        self.cursor = cursor
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.dedupe_window = dedupe_window
+        self._seen = OrderedDict()
+        self._task = None
+        # Cleared if the backend turns out not to have the event stream
+        self.supported = True
+        self.connected = False
+
+        # Metrics
+        self.connects = 0
+        self.disconnects = 0
+        self.events = 0
+        self.duplicates = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run(), name='EventStream')
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        failures = 0
+        while self.supported:
+            try:
+                delivered = await self._consume()
+            except (httpx.HTTPError, ValueError) as e:
+                self.logger.warning(f"Event stream error: {e!r}")
+                delivered = 0
+            if self.connected:
+                self.connected = False
+                self.disconnects += 1
+            if not self.supported:
+                break
+            # A connection that delivered events was healthy; start over
+            failures = 0 if delivered else failures + 1
+            await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.min_backoff * 2 ** failures)))
+
+    async def _consume(self):
+        """
+        Read one connection until it ends
+
+        Returns:
+            int: Events received on it
+        """
+        payload = {'API_TOKEN': self.api_token, 'cursor': self.cursor}
+        headers = {'Accept': 'text/event-stream'}
+        if self.cursor is not None:
+            headers['Last-Event-ID'] = str(self.cursor)
+
+        delivered = 0
+        async with self.backend.stream(self.endpoint, payload, headers=headers) as response:
+            if response.status_code == 404:
+                self.logger.warning(f"Backend has no {self.endpoint}, push notifications disabled")
+                self.supported = False
+                return 0
+            if response.status_code != 200:
+                self.logger.warning(f"Event stream refused with {response.status_code}")
+                return 0
+            self.connected = True
+            self.connects += 1
+            self.logger.info(f"Event stream connected (cursor={self.cursor})")
+
+            event_id, event_type, data = None, 'message', []
+            async for line in response.aiter_lines():
+                if line:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'id':
+                        event_id = value
+                    elif field == 'event':
+                        event_type = value
+                    elif field == 'data':
+                        data.append(value)
+                    elif field == 'retry' and value.isdigit():
+                        self.min_backoff = int(value) / 1000
+                    # Lines starting with ':' are heartbeats
+                    continue
+                if data:
+                    self._dispatch(event_id, event_type, '\n'.join(data))
+                    delivered += 1
+                event_id, event_type, data = None, 'message', []
+        return delivered
+
+    def _dispatch(self, event_id, event_type, data):
+        if event_id is not None:
+            if event_id in self._seen:
+                self.duplicates += 1
+                return
+            self._seen[event_id] = None
+            if len(self._seen) > self.dedupe_window:
+                self._seen.popitem(last=False)
+            self.cursor = event_id
+        self.events += 1
+        # Each event is its own trace, like an update
+        start_trace()
+        try:
+            self.on_event(event_type, json.loads(data))
+        except Exception as e:
+            self.logger.exception(f"Event handler error: {e}")
+
+    def stats(self):
+        return {
+            'connected': int(self.connected),
+            'connects': self.connects,
+            'disconnects': self.disconnects,
+            'events': self.events,
+            'duplicates': self.duplicates,
+        }
+
+
+class Notifier:
+    def __init__(self, workers=2, queue_size=10000):
+        """
+        Subscriptions and a bounded outbound queue for push notifications
+
+        Subscribed telegram ids are kept in bot_data, so they are persisted
+        with it and survive user_data being dropped for inactivity.
+        Notifications wait in a queue drained by `workers` senders at low
+        outbound priority, so a burst of events can't crowd out replies;
+        past `queue_size` new notifications are dropped.
+
+        Args:
+            workers (int): Notifications sent at once
+            queue_size (int): Notifications allowed to wait
+        """
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers
+        self.subscribers = set()
+        self.bot = None
+        self._bot_data = {}
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+
+        # Metrics
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def load(self, bot_data):
+        """
+        Restore subscriptions from (persisted) bot_data
+        """
+        self._bot_data = bot_data
+        self.subscribers = {
+            key[len(SUBSCRIBER_PREFIX):]
+            for key, value in bot_data.items()
+            if key.startswith(SUBSCRIBER_PREFIX) and value
+        }
+
+    def is_subscribed(self, telegram_id):
+        return telegram_id in self.subscribers
+
+    def subscribe(self, telegram_id):
+        if telegram_id not in self.subscribers:
+            self.subscribers.add(telegram_id)
+            self._bot_data[SUBSCRIBER_PREFIX + telegram_id] = True
+
+    def unsubscribe(self, telegram_id):
+        if telegram_id in self.subscribers:
+            self.subscribers.discard(telegram_id)
+            # None deletes the key from the store on the next persistence run
+            self._bot_data[SUBSCRIBER_PREFIX + telegram_id] = None
+
+    async def start(self, bot):
+        self.bot = bot
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f"Notifier:{index}")
+            for index in range(self.workers)
+        ]
+
+    async def stop(self, timeout=5.0):
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"{self._queue.qsize()} notifications dropped at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self, telegram_id, text):
+        """
+        Queue `text` for `telegram_id` if subscribed
+
+        Returns:
+            bool: Whether the notification was queued
+        """
+        if telegram_id not in self.subscribers:
+            return False
+        try:
+            self._queue.put_nowait((telegram_id, text))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def _work(self):
+        while True:
+            telegram_id, text = await self._queue.get()
+            try:
+                await self._send(telegram_id, text)
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, telegram_id, text):
+        rate_limit_args = {'priority': PRIORITY_LOW} if self.bot.rate_limiter else None
+        try:
+            await self.bot.send_message(chat_id=int(telegram_id), text=text, rate_limit_args=rate_limit_args)
+        except telegram.error.Forbidden:
+            # The user blocked the bot; stop pushing to them
+            self.unsubscribe(telegram_id)
+            self.failed += 1
+            return
+        except telegram.error.TelegramError as e:
+            self.logger.error(f"Notification error: {e}")
+            self.failed += 1
+            return
+        self.sent += 1
+
+    def stats(self):
+        return {
+            'subscribers': len(self.subscribers),
+            'queued': self._queue.qsize(),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
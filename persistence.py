@@ -0,0 +1,306 @@
+import json
+import asyncio
+import logging
+import sqlite3
+from urllib.parse import urlparse
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# user_data keys that must never leave process memory
+SECRET_KEYS = frozenset({'password'})
+
+USER_DATA = 'user_data'
+CHAT_DATA = 'chat_data'
+BOT_DATA = 'bot_data'
+CONVERSATIONS = 'conversations:'
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        """
+        Key/value store on a local SQLite database in WAL mode
+
+        Args:
+            path (str): Database file path
+        """
+        self.path = path
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                'PRIMARY KEY (namespace, key))'
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _load(self, namespace):
+        rows = self._connect().execute(
+            'SELECT key, value FROM state WHERE namespace = ?', (namespace,)
+        )
+        return dict(rows.fetchall())
+
+    def _write(self, batch):
+        connection = self._connect()
+        with connection:
+            for namespace, changes in batch.items():
+                for key, value in changes.items():
+                    if value is None:
+                        connection.execute(
+                            'DELETE FROM state WHERE namespace = ? AND key = ?',
+                            (namespace, key)
+                        )
+                    else:
+                        connection.execute(
+                            'INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)',
+                            (namespace, key, value)
+                        )
+
+    async def load(self, namespace):
+        return await asyncio.to_thread(self._load, namespace)
+
+    async def write(self, batch):
+        """
+        Apply {namespace: {key: json_value_or_None}} in a single transaction
+        """
+        await asyncio.to_thread(self._write, batch)
+
+    async def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class RedisStore:
+    def __init__(self, url, prefix='telegram-bot', client=None):
+        """
+        Key/value store on any Redis-protocol server (one hash per namespace)
+
+        Args:
+            url (str): redis:// connection URL
+            prefix (str): Key prefix shared by every worker
+            client: Optional redis.asyncio client with decode_responses
+                set, e.g. an in-memory fake for tests; built from `url` if
+                not given
+
+        Raises:
+            ValueError: The optional `redis` package is not installed
+        """
+        self.prefix = prefix
+        if client is None:
+            client = self._connect(url)
+        self._redis = client
+
+    @staticmethod
+    def _connect(url):
+        # Optional dependency, only needed when PERSISTENCE_URL is redis://
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise ValueError(
+                f"PERSISTENCE_URL {url} needs the redis package: pip install redis"
+            ) from None
+        return redis.asyncio.from_url(url, decode_responses=True)
+
+    def _key(self, namespace):
+        return f"{self.prefix}:{namespace}"
+
+    async def load(self, namespace):
+        return await self._redis.hgetall(self._key(namespace))
+
+    async def write(self, batch):
+        pipeline = self._redis.pipeline(transaction=True)
+        for namespace, changes in batch.items():
+            upserts = {k: v for k, v in changes.items() if v is not None}
+            deletes = [k for k, v in changes.items() if v is None]
+            if upserts:
+                pipeline.hset(self._key(namespace), mapping=upserts)
+            if deletes:
+                pipeline.hdel(self._key(namespace), *deletes)
+        await pipeline.execute()
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+class MemoryStore:
+    """
+    Store that keeps everything in process memory, for when PERSISTENCE_URL
+    is empty but a component still wants the store interface
+    """
+    def __init__(self):
+        self._namespaces = {}
+
+    async def load(self, namespace):
+        return dict(self._namespaces.get(namespace, {}))
+
+    async def write(self, batch):
+        for namespace, changes in batch.items():
+            values = self._namespaces.setdefault(namespace, {})
+            for key, value in changes.items():
+                if value is None:
+                    values.pop(key, None)
+                else:
+                    values[key] = value
+
+    async def close(self):
+        pass
+
+
+def store_from_url(url):
+    """
+    Build a store from a PERSISTENCE_URL such as 'sqlite:///bot_state.sqlite3'
+    or 'redis://localhost:6379/0'
+
+    Raises:
+        ValueError: The URL is unsupported, or needs a package that is not installed
+    """
+    parsed = urlparse(url)
+    if parsed.scheme in ('redis', 'rediss', 'unix'):
+        return RedisStore(url)
+    if parsed.scheme == 'sqlite':
+        return SQLiteStore(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported persistence URL: {url}")
+
+
+class StatePersistence(BasePersistence):
+    def __init__(self, store, update_interval=5, secret_keys=SECRET_KEYS, owns_user=None):
+        """
+        Write-behind persistence for conversations, user_data and bot_data
+
+        The Application hands us its data every `update_interval` seconds.
+        Values are JSON encoded and compared against what was last written,
+        so only keys that actually changed reach the store, in one batch.
+
+        Args:
+            store: SQLiteStore or RedisStore
+            update_interval (float): Seconds between persistence runs
+            secret_keys (set): user_data keys that are never persisted
+            owns_user (callable): In supervisor mode, whether a user id is
+                routed to this worker; only those users' user_data is loaded,
+                so this worker never writes or drops another worker's rows
+        """
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.logger = logging.getLogger(__name__)
+        self.store = store
+        self.secret_keys = secret_keys
+        self.owns_user = owns_user
+        self._written = {}
+        self._pending = {}
+        self._write_task = None
+
+    @staticmethod
+    def _encode(value):
+        return json.dumps(value, sort_keys=True, default=str)
+
+    async def _load(self, namespace):
+        rows = await self.store.load(namespace)
+        self._written[namespace] = dict(rows)
+        return rows
+
+    def _stage(self, namespace, key, value):
+        """
+        Queue a change unless it matches what is already in the store
+        """
+        encoded = None if value is None else self._encode(value)
+        if self._written.setdefault(namespace, {}).get(key) == encoded:
+            self._pending.get(namespace, {}).pop(key, None)
+            return
+        self._pending.setdefault(namespace, {})[key] = encoded
+        if self._write_task is None or self._write_task.done():
+            # The Application gathers all update_* calls of one run together;
+            # this task runs after all of them, so they land in one batch.
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self.store.write(batch)
+        except Exception as e:
+            self.logger.error(f"Persistence write error: {e}")
+            # Keep the batch for the next run, without clobbering newer changes
+            for namespace, changes in batch.items():
+                pending = self._pending.setdefault(namespace, {})
+                for key, value in changes.items():
+                    pending.setdefault(key, value)
+            return
+        for namespace, changes in batch.items():
+            written = self._written.setdefault(namespace, {})
+            for key, value in changes.items():
+                if value is None:
+                    written.pop(key, None)
+                else:
+                    written[key] = value
+
+    def _scrub(self, data):
+        return {k: v for k, v in data.items() if k not in self.secret_keys}
+
+    async def get_user_data(self):
+        rows = await self._load(USER_DATA)
+        return {
+            int(user_id): json.loads(value) for user_id, value in rows.items()
+            if self.owns_user is None or self.owns_user(int(user_id))
+        }
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        rows = await self._load(BOT_DATA)
+        return {key: json.loads(value) for key, value in rows.items()}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await self._load(CONVERSATIONS + name)
+        return {tuple(json.loads(key)): json.loads(value) for key, value in rows.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(CONVERSATIONS + name, json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._stage(USER_DATA, str(user_id), self._scrub(data))
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        for key, value in data.items():
+            self._stage(BOT_DATA, key, value)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._stage(USER_DATA, str(user_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Workers own a user for the lifetime of a conversation, so the
+        # in-memory copy is authoritative; the store is only read at startup.
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_pending()
+        await self.store.close()
@@ -0,0 +1,261 @@
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Priority classes, lower is sent first. Pass them per call with
+# `rate_limit_args={'priority': PRIORITY_HIGH}`.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Calls that don't post to a chat and skip the buckets. A callback query
+# has to be answered promptly or the user's button keeps spinning.
+UNTHROTTLED_ENDPOINTS = frozenset({'answerCallbackQuery'})
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, now):
+        """
+        Args:
+            rate (float): Tokens added per second
+            capacity (float): Maximum burst size
+            now (float): Current clock reading
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """
+        Seconds until one token is available
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class OutboundScheduler(BaseRateLimiter):
+    def __init__(
+        self,
+        overall_rate=30,
+        chat_rate=1,
+        chat_burst=3,
+        group_rate=20 / 60,
+        max_retries=3,
+        max_tracked_chats=10000,
+        paid_broadcast_rate=1000,
+        clock=time.monotonic
+    ):
+        """
+        Priority-aware rate limiter for outgoing Bot API requests
+
+        Requests wait in one priority queue. A dispatcher releases them
+        while both the global bucket and the target chat's bucket have a
+        token, and skips chats that are still throttled so they don't block
+        other chats. A 429 pauses all sending for `retry_after` seconds, then
+        the request is retried. Requests sent with `allow_paid_broadcast`
+        (marked `{'paid_broadcast': True}` in rate_limit_args) are exempt
+        from the global limit and draw on their own bucket instead.
+
+        Args:
+            overall_rate (float): Global messages per second
+            chat_rate (float): Messages per second to one private chat
+            chat_burst (float): Burst allowance per private chat
+            group_rate (float): Messages per second to one group or channel
+            max_retries (int): Retries after a RetryAfter before giving up
+            max_tracked_chats (int): Per-chat buckets kept (LRU)
+            paid_broadcast_rate (float): Paid broadcast messages per second
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_tracked_chats = max_tracked_chats
+        self.clock = clock
+
+        self._global = TokenBucket(overall_rate, overall_rate, clock())
+        self._paid = TokenBucket(paid_broadcast_rate, paid_broadcast_rate, clock())
+        self._paid_waiting = 0
+        self._chat_buckets = OrderedDict()
+        self._queue = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._dispatcher = None
+
+        # Metrics
+        self.sent = 0
+        self.retry_after_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    async def initialize(self):
+        # ExtBot.initialize runs for the Application and again for the
+        # Updater; start only one dispatcher
+        if self._dispatcher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        # Let anything still queued through rather than leaving it hanging
+        for item in self._queue:
+            if not item[3].done():
+                item[3].set_result(None)
+        self._queue.clear()
+        self._paid_waiting = 0
+
+    def _chat_bucket(self, chat_id, now):
+        if chat_id is None:
+            return None
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups/supergroups, strings are @channel names
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, 1, now)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst, now)
+            self._chat_buckets[chat_id] = bucket
+            if len(self._chat_buckets) > self.max_tracked_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self):
+        while True:
+            if not self._queue:
+                await self._wait(None)
+                continue
+
+            now = self.clock()
+            # Without paid broadcasts waiting, nothing can go out before the
+            # global bucket refills
+            delay = self._paused_until - now
+            if not self._paid_waiting:
+                delay = max(delay, self._global.delay(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            granted = None
+            deferred = []
+            next_ready = None
+            while self._queue:
+                item = heapq.heappop(self._queue)
+                chat_id, future, paid = item[2], item[3], item[5]
+                if future.done():
+                    # Caller was cancelled while waiting
+                    if paid:
+                        self._paid_waiting -= 1
+                    continue
+                overall = self._paid if paid else self._global
+                bucket = self._chat_bucket(chat_id, now)
+                item_delay = max(overall.delay(now), bucket.delay(now) if bucket else 0.0)
+                if item_delay <= 0:
+                    granted = (item, overall, bucket)
+                    break
+                deferred.append(item)
+                next_ready = item_delay if next_ready is None else min(next_ready, item_delay)
+            for item in deferred:
+                heapq.heappush(self._queue, item)
+
+            if granted is None:
+                await self._wait(next_ready)
+                continue
+
+            item, overall, bucket = granted
+            if item[5]:
+                self._paid_waiting -= 1
+            overall.consume(now)
+            if bucket:
+                bucket.consume(now)
+            waited = now - item[4]
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            self.sent += 1
+            item[3].set_result(None)
+
+    async def _acquire(self, priority, chat_id, paid=False):
+        future = asyncio.get_running_loop().create_future()
+        if paid:
+            self._paid_waiting += 1
+        heapq.heappush(self._queue, (priority, next(self._seq), chat_id, future, self.clock(), paid))
+        self._wakeup.set()
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in UNTHROTTLED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get('priority', PRIORITY_NORMAL)
+        paid = bool((rate_limit_args or {}).get('paid_broadcast'))
+        chat_id = data.get('chat_id')
+
+        for attempt in range(self.max_retries + 1):
+            queued_at = self.clock()
+            await self._acquire(priority, chat_id, paid)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                # Runs in the caller's task, so the line carries its trace ID
+                waited = self.clock() - queued_at
+                self.logger.debug(
+                    f"{endpoint} released after {waited:.3f}s",
+                    extra={'endpoint': endpoint, 'chat_id': chat_id, 'queued_ms': round(waited * 1000, 1)}
+                )
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                self.retry_after_count += 1
+                self._paused_until = max(self._paused_until, self.clock() + float(retry_after))
+                if attempt == self.max_retries:
+                    raise
+                self.logger.warning(
+                    f"Rate limited on {endpoint}, retrying in {retry_after}s "
+                    f"(attempt {attempt + 1}/{self.max_retries})"
+                )
+
+    def stats(self):
+        return {
+            'queue_depth': len(self._queue),
+            'sent': self.sent,
+            'retry_after': self.retry_after_count,
+            'wait_time_total': self.wait_time_total,
+            'wait_time_max': self.wait_time_max,
+        }
@@ -0,0 +1,292 @@
+import time
+import socket
+import asyncio
+import logging
+import ipaddress
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import httpx
+
+from cache import TTLCache
+
+# Genesis hash of each public cluster, to tell which one a custom RPC serves
+GENESIS_HASHES = {
+    '5eykt4UsFv8P8NJdTREpY1vzqKqZKvdpKuc147dw2N9d': 'mainnet-beta',
+    'EtWTRABZaYq6iMfeYKouRu166VU2xqa1wcaWoxPkrZBG': 'devnet',
+    '4uhcVJyU9pJkvQyS88uRDiswHXSCkY3zQawwpjk2NsNY': 'testnet',
+}
+
+# Public endpoints probed for "fastest" when RPC_CANDIDATES doesn't list a cluster
+DEFAULT_CANDIDATES = {
+    'mainnet-beta': ['https://api.mainnet-beta.solana.com'],
+    'devnet': ['https://api.devnet.solana.com'],
+    'testnet': ['https://api.testnet.solana.com'],
+}
+
+# Target slot time, used to age cached slots before comparing them
+SLOT_SECONDS = 0.4
+
+# getHealth, getSlot and getGenesisHash in one batched round trip
+PROBE_BATCH = [
+    {'jsonrpc': '2.0', 'id': 1, 'method': 'getHealth'},
+    {'jsonrpc': '2.0', 'id': 2, 'method': 'getSlot'},
+    {'jsonrpc': '2.0', 'id': 3, 'method': 'getGenesisHash'},
+]
+
+
+@dataclass
+class RpcProbe:
+    """
+    Outcome of one RPC health probe
+
+    Attributes:
+        url (str): Probed endpoint
+        healthy (bool): Answered and reported itself healthy
+        rtt (float): Round trip time of the probe, in seconds
+        slot (int): Slot the node was at
+        cluster (str): Cluster name from the genesis hash, None if unknown
+        error (str): Why the endpoint is unusable
+        probed_at (float): Monotonic time of the probe
+    """
+    url: str
+    healthy: bool
+    rtt: float = None
+    slot: int = None
+    cluster: str = None
+    error: str = ''
+    probed_at: float = 0.0
+
+    def projected_slot(self, now):
+        """
+        Where the node should be by `now`, if it keeps up
+        """
+        return self.slot + int((now - self.probed_at) / SLOT_SECONDS)
+
+
+class RpcHealth:
+    def __init__(self, candidates=None, ttl=60.0, timeout=3.0, max_slot_lag=150, smoothing=0.3,
+                 allow_private=False, maxsize=1000, transport=None, clock=time.monotonic):
+        """
+        Probes Solana RPC endpoints and ranks them by latency
+
+        A probe is one batched getHealth/getSlot/getGenesisHash request.
+        Results are cached for `ttl` seconds, and concurrent probes of the
+        same URL share one request. Each candidate keeps an exponentially
+        weighted round trip time, so one lucky probe doesn't make a slow
+        node look fast. An endpoint is rejected if it is down, reports
+        itself unhealthy, or is more than `max_slot_lag` slots behind the
+        best candidate of its cluster.
+
+        Args:
+            candidates (dict): Cluster name -> RPC URLs considered for "fastest"
+            ttl (float): Seconds a probe result is reused
+            timeout (float): Seconds a probe may take
+            max_slot_lag (int): Slots an endpoint may trail its cluster
+            smoothing (float): Weight of the newest sample in the rolling RTT
+            allow_private (bool): Accept URLs resolving to private addresses
+            maxsize (int): Probe results cached, custom URLs included
+            transport (httpx.AsyncBaseTransport): Optional transport, e.g. an
+                in-process stub for benchmarks
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.candidates = {**DEFAULT_CANDIDATES, **(candidates or {})}
+        self._candidate_urls = {url for urls in self.candidates.values() for url in urls}
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_slot_lag = max_slot_lag
+        self.smoothing = smoothing
+        self.allow_private = allow_private
+        self.transport = transport
+        self.clock = clock
+        self._client = None
+        self._probes = TTLCache(maxsize=maxsize, ttl=ttl, clock=clock)
+        # candidate url -> rolling round trip time, in seconds
+        self.scores = {}
+
+        # Metrics
+        self.probes = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, transport=self.transport)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def probe(self, url, fresh=False, address=None):
+        """
+        Health of `url`, from the cache when fresh enough
+
+        Args:
+            url (str): RPC endpoint
+            fresh (bool): Probe even if a cached result is still valid,
+                and cache the new one
+            address (str): Connect to this IP instead of resolving the
+                host again, e.g. one vetted by `check`
+
+        Returns:
+            RpcProbe
+        """
+        if fresh:
+            probe = await self._probe(url, address)
+            self._probes.set((url,), probe)
+            return probe
+        return await self._probes.get_or_load((url,), lambda: self._probe(url, address))
+
+    async def _probe(self, url, address=None):
+        if self._client is None:
+            await self.start()
+        self.probes += 1
+        started = self.clock()
+        target = httpx.URL(url)
+        headers = extensions = None
+        if address is not None:
+            # Host header and TLS (SNI, certificate) still name the host
+            headers = {'Host': target.netloc.decode('ascii')}
+            extensions = {'sni_hostname': target.raw_host.decode('ascii')}
+            target = target.copy_with(host=address)
+        try:
+            response = await self._client.post(target, json=PROBE_BATCH, headers=headers, extensions=extensions)
+            response.raise_for_status()
+            results = {item.get('id'): item for item in response.json()}
+        except (httpx.HTTPError, ValueError, AttributeError, TypeError) as e:
+            return self._observe(
+                RpcProbe(url, healthy=False, error=f"unreachable ({e.__class__.__name__})", probed_at=started)
+            )
+        rtt = self.clock() - started
+
+        health = results.get(1, {})
+        slot = results.get(2, {}).get('result')
+        genesis = results.get(3, {}).get('result')
+        error = ''
+        if health.get('result') != 'ok':
+            # e.g. "Node is behind by 42 slots"
+            error = (health.get('error') or {}).get('message') or 'unhealthy'
+        elif not isinstance(slot, int):
+            error = 'no slot reported'
+        probe = RpcProbe(
+            url,
+            healthy=not error,
+            rtt=rtt,
+            slot=slot if isinstance(slot, int) else None,
+            cluster=GENESIS_HASHES.get(genesis),
+            error=error,
+            probed_at=started
+        )
+        return self._observe(probe)
+
+    def _observe(self, probe):
+        if probe.url not in self._candidate_urls:
+            return probe
+        if probe.healthy:
+            previous = self.scores.get(probe.url)
+            self.scores[probe.url] = probe.rtt if previous is None else \
+                self.smoothing * probe.rtt + (1 - self.smoothing) * previous
+        else:
+            self.scores.pop(probe.url, None)
+        return probe
+
+    def score(self, url):
+        """
+        Rolling round trip time of `url`; infinite until it probes healthy
+        """
+        return self.scores.get(url, float('inf'))
+
+    async def probe_cluster(self, cluster, fresh=False):
+        """
+        Probe every candidate of `cluster` at once
+
+        Args:
+            cluster (str): Cluster name
+            fresh (bool): Bypass cached probe results
+
+        Returns:
+            list: Healthy RpcProbes that keep up with the cluster, fastest first
+        """
+        probes = await asyncio.gather(*(self.probe(url, fresh) for url in self.candidates.get(cluster, [])))
+        healthy = [probe for probe in probes if probe.healthy]
+        if not healthy:
+            return []
+        now = self.clock()
+        head = max(probe.projected_slot(now) for probe in healthy)
+        current = [probe for probe in healthy if head - probe.projected_slot(now) <= self.max_slot_lag]
+        return sorted(current, key=lambda probe: self.score(probe.url))
+
+    async def refresh(self, context=None):
+        """
+        JobQueue callback: re-probe every candidate so the rolling scores
+        stay current and "fastest" rarely waits on a probe. Cached results
+        are bypassed, otherwise a job running every `ttl` seconds would
+        mostly find them still valid and measure nothing.
+        """
+        await asyncio.gather(*(self.probe_cluster(cluster, fresh=True) for cluster in self.candidates))
+
+    async def fastest(self, cluster):
+        """
+        The healthy candidate of `cluster` with the best rolling latency, or None
+        """
+        ranked = await self.probe_cluster(cluster)
+        return ranked[0] if ranked else None
+
+    async def _public_address(self, host):
+        """
+        One of the addresses `host` resolves to, or None unless all are public
+        """
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+            addresses = [info[4][0] for info in infos]
+            # Drop an IPv6 zone such as %eth0
+            public = addresses and all(ipaddress.ip_address(a.split('%')[0]).is_global for a in addresses)
+        except (OSError, ValueError):
+            return None
+        return addresses[0] if public else None
+
+    async def check(self, url):
+        """
+        Vet a user supplied RPC URL before switching to it
+
+        Returns:
+            RpcProbe: `healthy` is False and `error` says why if the URL
+            must not be used
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            self.rejected += 1
+            return RpcProbe(url, healthy=False, error='not an http(s) URL')
+        address = None
+        if not self.allow_private:
+            address = await self._public_address(parsed.hostname)
+            if address is None:
+                self.rejected += 1
+                return RpcProbe(url, healthy=False, error='host is not publicly reachable')
+
+        # Probe the vetted address: resolving again could give another one
+        # (DNS rebinding) and point the probe at a private service
+        probe = await self.probe(url, address=address)
+        if probe.healthy and probe.cluster in self.candidates:
+            reference = await self.probe_cluster(probe.cluster)
+            if reference:
+                now = self.clock()
+                lag = max(ref.projected_slot(now) for ref in reference) - probe.projected_slot(now)
+                if lag > self.max_slot_lag:
+                    probe = RpcProbe(
+                        url, healthy=False, rtt=probe.rtt, slot=probe.slot, cluster=probe.cluster,
+                        error=f"{lag} slots behind {probe.cluster}", probed_at=probe.probed_at
+                    )
+        if not probe.healthy:
+            self.rejected += 1
+        return probe
+
+    def stats(self):
+        return {
+            'cached': len(self._probes),
+            'healthy_candidates': len(self.scores),
+            'probes': self.probes,
+            'cache_hits': self._probes.hits,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,95 @@
+import os
+import time
+from collections import OrderedDict
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+class SessionTokenCache:
+    def __init__(self, maxsize=10000, max_ttl=600.0, expiry_margin=5.0, clock=time.monotonic):
+        """
+        In-memory store of backend session tokens, one per telegramId
+
+        Tokens are sealed with AES-GCM under a key that only lives in this
+        process, with the owner as associated data. The key sits in the
+        same heap, so this does not protect against anyone who can read the
+        process's memory. It keeps plain tokens out of reprs, logs and debug
+        dumps of the cache, and an entry can't be replayed for another user.
+        The cache is never persisted. Entries expire `expiry_margin` seconds
+        before the backend's own expiry and are evicted LRU past `maxsize`.
+
+        Args:
+            maxsize (int): Maximum number of sessions kept
+            max_ttl (float): Upper bound on a token's lifetime, in seconds
+            expiry_margin (float): Seconds subtracted from the backend expiry
+            clock (callable): Monotonic time source
+        """
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.expiry_margin = expiry_margin
+        self.clock = clock
+        self._aead = AESGCM(AESGCM.generate_key(bit_length=256))
+        # owner -> (expires_at, nonce + ciphertext)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.issued = 0
+        self.revoked = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, owner, token, expires_in=None):
+        """
+        Store `token` for `owner`
+
+        Args:
+            owner (str): telegramId the token belongs to
+            token (str): Session token issued by the backend
+            expires_in (float): Backend lifetime of the token, in seconds
+        """
+        ttl = min(self.max_ttl, float(expires_in)) if expires_in else self.max_ttl
+        ttl -= self.expiry_margin
+        if ttl <= 0:
+            return
+        nonce = os.urandom(12)
+        sealed = nonce + self._aead.encrypt(nonce, token.encode('utf-8'), owner.encode('utf-8'))
+        self._entries[owner] = (self.clock() + ttl, sealed)
+        self._entries.move_to_end(owner)
+        self.issued += 1
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, owner):
+        """
+        The live token of `owner`, or None
+        """
+        entry = self._entries.get(owner)
+        if entry is None or entry[0] <= self.clock():
+            self._entries.pop(owner, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(owner)
+        self.hits += 1
+        sealed = entry[1]
+        return self._aead.decrypt(sealed[:12], sealed[12:], owner.encode('utf-8')).decode('utf-8')
+
+    def has(self, owner):
+        """
+        Whether `owner` has a live token, without decrypting it
+        """
+        entry = self._entries.get(owner)
+        return entry is not None and entry[0] > self.clock()
+
+    def revoke(self, owner):
+        if self._entries.pop(owner, None) is not None:
+            self.revoked += 1
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'issued': self.issued,
+            'revoked': self.revoked,
+        }
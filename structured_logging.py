@@ -0,0 +1,246 @@
+import re
+import sys
+import json
+import zlib
+import queue
+import atexit
+import random
+import secrets
+import logging
+import datetime
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# Trace ID of the update (or background job) the current task works for.
+# Tasks copy the context they are created in, so anything a handler starts
+# inherits it.
+TRACE_ID = contextvars.ContextVar('trace_id', default=None)
+
+# Payload fields that must never reach the log output, compared lowercased
+SENSITIVE_KEYS = frozenset({'password', 'api_token', 'sessiontoken', 'privatekey', 'secretkey', 'mnemonic'})
+REDACTED = '[redacted]'
+
+# `password=...`, `'password': '...'` and `"API_TOKEN": "..."` in message text
+_SENSITIVE_TEXT = re.compile(
+    r"""(?P<key>["']?(?:password|api_token|sessiontoken|privatekey|secretkey|mnemonic)["']?\s*[:=]\s*)"""
+    r"""(?P<value>"[^"]*"|'[^']*'|[^\s,;&}]+)""",
+    re.IGNORECASE
+)
+# Bot API URLs (httpx, telegram) carry the bot token in the path
+_BOT_TOKEN_TEXT = re.compile(r'/bot\d+:[\w-]+')
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'trace_id'}
+
+# Share of records kept per level when no rates are configured. WARNING and
+# above are always kept.
+DEFAULT_SAMPLE_RATES = {'DEBUG': 1.0, 'INFO': 1.0}
+
+
+def new_trace_id():
+    return secrets.token_hex(8)
+
+
+def start_trace(trace_id=None):
+    """
+    Make `trace_id` (a new one if None) the current task's trace ID
+
+    Returns:
+        str: The trace ID
+    """
+    trace_id = trace_id or new_trace_id()
+    TRACE_ID.set(trace_id)
+    return trace_id
+
+
+def redact(value):
+    """
+    Copy of `value` with sensitive dict fields masked, at any depth
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if isinstance(key, str) and key.lower() in SENSITIVE_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    return value
+
+
+def redact_text(text):
+    """
+    Mask sensitive `key=value` pairs and bot tokens in formatted text
+    """
+    text = _SENSITIVE_TEXT.sub(lambda match: match.group('key') + REDACTED, text)
+    return _BOT_TOKEN_TEXT.sub('/bot' + REDACTED, text)
+
+
+class TraceFilter(logging.Filter):
+    """
+    Stamp records with the trace ID of the task that logged them. Runs
+    before the record is queued, while that task's context is current.
+    """
+    def filter(self, record):
+        record.trace_id = TRACE_ID.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates=None):
+        """
+        Keep a share of records per level
+
+        Records of a trace are all kept or all dropped, so a sampled trace
+        is complete; records outside a trace are sampled at random.
+
+        Args:
+            rates (dict): Level name -> share of records kept, 0 to 1
+        """
+        super().__init__()
+        self.rates = {
+            logging.getLevelName(level.upper()): float(rate)
+            for level, rate in {**DEFAULT_SAMPLE_RATES, **(rates or {})}.items()
+        }
+        self.sampled_out = 0
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id is not None:
+            keep = zlib.crc32(trace_id.encode('ascii')) / 0xFFFFFFFF < rate
+        else:
+            keep = random.random() < rate
+        if not keep:
+            self.sampled_out += 1
+        return keep
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, logger, msg, trace_id, any `extra`
+    fields and the exception, with sensitive values masked
+    """
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec='milliseconds'
+            ),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact_text(record.getMessage()),
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id is not None:
+            entry['trace_id'] = trace_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = REDACTED if key.lower() in SENSITIVE_KEYS else redact(value)
+        if record.exc_info:
+            entry['exc'] = redact_text(self.formatException(record.exc_info))
+        elif record.exc_text:
+            entry['exc'] = redact_text(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The classic single line format, for reading logs in a terminal
+    """
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(trace)s%(message)s')
+
+    def format(self, record):
+        trace_id = getattr(record, 'trace_id', None)
+        record.trace = f"[{trace_id}] " if trace_id else ''
+        return redact_text(super().format(record))
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread and drops
+    records instead of blocking when the queue is full
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The stock prepare() formats the message here, on the event loop.
+        # Only mask sensitive arguments now, before anything else can see
+        # them; the listener formats.
+        if record.args:
+            record.args = redact(record.args)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    def __init__(self, level='INFO', sample_rates=None, queue_size=10000, json_output=True, stream=None):
+        """
+        Logging that keeps formatting and I/O off the event loop
+
+        Every record is stamped with the current trace ID and sampled in
+        the thread that logs it, then put on a bounded queue. A listener thread
+        formats it (JSON or text) and writes it out. When the queue is full
+        records are dropped rather than blocking the loop.
+
+        Args:
+            level (str): Root log level
+            sample_rates (dict): Level name -> share of records kept, e.g.
+                {"DEBUG": 0.1}; WARNING and above are always kept
+            queue_size (int): Records allowed to wait for the listener
+            json_output (bool): JSON lines, else the classic text format
+            stream: Output stream, stderr by default
+        """
+        self.level = level
+        self.sampler = SamplingFilter(sample_rates)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = _NonBlockingQueueHandler(self.queue)
+        self.handler.addFilter(TraceFilter())
+        self.handler.addFilter(self.sampler)
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if json_output else TextFormatter())
+        self.listener = QueueListener(self.queue, output, respect_handler_level=True)
+        self._running = False
+
+    def install(self):
+        """
+        Route the root logger through the queue and start the listener
+        """
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        # httpx logs one INFO line per request, with the bot token in the
+        # URL; the backend client logs its own calls with the trace ID
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        # At DEBUG the Bot API client echoes raw updates, passwords typed
+        # into flows included
+        logging.getLogger('telegram').setLevel(max(logging.INFO, root.level))
+        if not self._running:
+            self.listener.start()
+            self._running = True
+            atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Write out what is queued and stop the listener
+        """
+        if self._running:
+            self._running = False
+            self.listener.stop()
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'sampled_out': self.sampler.sampled_out,
+        }
@@ -0,0 +1,47 @@
+from admission import AdmissionController, BUSY, USER_BUSY
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limit_grows_slowly_and_backs_off_once_per_cooldown():
+    clock = Clock()
+    admission = AdmissionController(initial_limit=10, min_limit=4, backoff=0.5, cooldown=1.0, clock=clock)
+
+    # Additive increase: about one per limit's worth of fast responses
+    for _ in range(10):
+        admission.observe('/api/balance', 0.1, failed=False)
+    assert 10.9 < admission.limit < 11.0
+
+    # Multiplicative decrease, counted once for a burst of slow responses
+    admission.observe('/api/balance', 3.0, failed=False)
+    admission.observe('/api/balance', 0.1, failed=True)
+    assert 5.4 < admission.limit < 5.6
+    assert admission.decreases == 1
+
+    # Slow transfers are expected; only past their own target they count
+    clock.now = 2.0
+    admission.observe('/api/transfer', 3.0, failed=False)
+    assert admission.decreases == 1
+
+    for _ in range(5):
+        clock.now += 1.0
+        admission.observe('/api/balance', 0.1, failed=True)
+    assert admission.limit == 4
+
+
+def test_actions_beyond_the_limit_or_per_user_are_turned_away():
+    admission = AdmissionController(initial_limit=2, min_limit=1, per_user=1)
+    assert admission.acquire(1, 'balance') is None
+    assert admission.acquire(1, 'transfer') == USER_BUSY
+    assert admission.acquire(2, 'balance') is None
+    assert admission.acquire(3, 'balance') == BUSY
+
+    admission.release(1, 'balance')
+    assert admission.acquire(3, 'balance') is None
+    assert admission.stats()['in_flight'] == 2
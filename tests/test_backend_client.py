@@ -0,0 +1,150 @@
+import asyncio
+
+import httpx
+
+from backend_client import BackendClient, CircuitBreaker
+
+
+class SlowBackend(httpx.AsyncBaseTransport):
+    """
+    Answers every request after `delay` seconds, counting cancelled ones
+    """
+    def __init__(self, delay):
+        self.delay = delay
+        self.cancelled = 0
+
+    async def handle_async_request(self, request):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return httpx.Response(200, json={})
+
+
+def test_cancelled_hedged_call_leaves_no_request_behind():
+    async def main(cancel_after):
+        backend = SlowBackend(delay=10)
+        client = BackendClient('backend', transport=backend)
+        call = asyncio.create_task(client.post('/api/balance', {}))
+        await asyncio.sleep(cancel_after)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        others = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await client.close()
+        return backend, client, others
+
+    # Before and after the hedged copy (hedge_after=1.5) went out
+    for cancel_after, requests in ((0.1, 1), (1.7, 2)):
+        backend, client, others = asyncio.run(main(cancel_after))
+        assert others == []
+        assert backend.cancelled == requests
+        assert client.in_flight() == []
+        assert client.breaker('/api/balance').state == 'closed'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedBackend(httpx.AsyncBaseTransport):
+    """
+    Answers each endpoint from a list of statuses or exceptions, the last
+    one repeating, and records every request
+    """
+    def __init__(self, script):
+        self.script = script
+        self.requests = []
+
+    async def handle_async_request(self, request):
+        self.requests.append(request)
+        outcomes = self.script[request.url.path]
+        outcome = outcomes.pop(0) if len(outcomes) > 1 else outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome, json={})
+
+    def calls(self, endpoint):
+        return [request for request in self.requests if request.url.path == endpoint]
+
+
+def run(script, calls, breaker_factory=None):
+    async def main():
+        backend = ScriptedBackend(script)
+        client = BackendClient('backend', transport=backend, **(
+            {'breaker_factory': breaker_factory} if breaker_factory else {}
+        ))
+        results = []
+        for endpoint, kwargs in calls:
+            try:
+                results.append((await client.post(endpoint, {}, **kwargs)).status_code)
+            except httpx.HTTPError as e:
+                results.append(type(e).__name__)
+        await client.close()
+        return backend, client, results
+
+    return asyncio.run(main())
+
+
+def test_transfers_are_only_retried_with_their_idempotency_key():
+    backend, _, results = run(
+        {'/api/transfer': [503, 503, 200], '/api/signup': [503]},
+        [('/api/transfer', {}), ('/api/transfer', {'idempotency_key': 'key'}), ('/api/signup', {})]
+    )
+    # Without a key: one try. With it: retried, the same key every time
+    assert results == [503, 200, 503]
+    transfers = backend.calls('/api/transfer')
+    assert len(transfers) == 3
+    assert 'Idempotency-Key' not in transfers[0].headers
+    assert [request.headers['Idempotency-Key'] for request in transfers[1:]] == ['key', 'key']
+    # Signup creates a wallet and is never retried
+    assert len(backend.calls('/api/signup')) == 1
+
+
+def test_a_retry_that_never_left_doesnt_hide_one_that_may_have_arrived():
+    _, _, results = run(
+        {'/api/transfer': [httpx.ReadTimeout("slow"), httpx.ConnectError("refused")]},
+        [('/api/transfer', {'idempotency_key': 'key'})]
+    )
+    assert results == ['ReadTimeout']
+
+
+def test_breaker_opens_per_endpoint_on_retryable_failures_only():
+    clock = Clock()
+    backend, client, results = run(
+        {'/api/session': [httpx.ConnectError("refused")], '/api/balances': [500], '/api/network/switch': [200]},
+        [('/api/session', {})] * 3 + [('/api/balances', {})] * 3 + [('/api/network/switch', {})],
+        breaker_factory=lambda: CircuitBreaker(failure_threshold=5, reset_timeout=30.0, clock=clock)
+    )
+    # Two tries per call: the fifth failure opens the circuit, so the last
+    # retry is refused without going out
+    assert results == ['ConnectError', 'ConnectError', 'CircuitOpenError', 500, 500, 500, 200]
+    assert len(backend.calls('/api/session')) == 5
+    assert client.breaker('/api/session').state == 'open'
+    # A 500 comes from a live backend; other endpoints keep their own breaker
+    assert client.breaker('/api/balances').state == 'closed'
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    clock.now = 30.0
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A failed probe opens it again for another reset_timeout
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    clock.now = 60.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
@@ -0,0 +1,62 @@
+import json
+import random
+import asyncio
+from collections import Counter
+
+from persistence import MemoryStore
+from broadcast import RecipientStore, BroadcastRunner, Broadcast, BROADCASTS, ALL
+
+
+class FakeBot:
+    """
+    Bot API stand-in: a message counts as delivered once its send returns
+    """
+    rate_limiter = None
+
+    def __init__(self, delivered, seed):
+        self.delivered = delivered
+        self.random = random.Random(seed)
+
+    async def send_message(self, chat_id, text, allow_paid_broadcast=None, rate_limit_args=None):
+        await asyncio.sleep(self.random.uniform(0, 0.004))
+        self.delivered[chat_id] += 1
+
+    async def edit_message_text(self, text, chat_id, message_id, rate_limit_args=None):
+        pass
+
+
+async def checkpoint(store, broadcast_id):
+    return Broadcast(**json.loads((await store.load(BROADCASTS))[broadcast_id]))
+
+
+def test_resumed_broadcast_messages_nobody_twice():
+    async def main():
+        store = MemoryStore()
+        recipients = RecipientStore(store)
+        await recipients.start()
+        for telegram_id in range(1, 501):
+            recipients.record(str(telegram_id), 'en')
+
+        delivered = Counter()
+        broadcast = Broadcast('b1', ALL, 'hello', chat_id=1, message_id=1)
+        # Long progress interval: only the final checkpoint can save the cursor
+        runner = BroadcastRunner(recipients, concurrency=20, progress_interval=3600)
+        # Interrupt three times, each with sends still in flight
+        for seed, stop_at in enumerate((100, 200, 300)):
+            task = asyncio.create_task(runner.run(FakeBot(delivered, seed), broadcast))
+            while sum(delivered.values()) < stop_at:
+                await asyncio.sleep(0)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            broadcast = await checkpoint(store, 'b1')
+            assert not broadcast.done
+
+        await runner.run(FakeBot(delivered, 3), broadcast)
+        finished = await checkpoint(store, 'b1')
+        await recipients.stop()
+        return delivered, finished
+
+    delivered, finished = asyncio.run(main())
+    assert finished.done
+    assert set(delivered) == set(range(1, 501))
+    assert max(delivered.values()) == 1
@@ -0,0 +1,100 @@
+import csv
+import io
+import asyncio
+
+import httpx
+import pytest
+
+from backend_client import CircuitOpenError
+from transfer_pipeline import TransferJob, TransferRejected
+from bulk_transfer import BulkTransfer, BulkRow, BulkTransferRunner, parse_rows, SENT, REJECTED, UNKNOWN
+
+ADDRESS = 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v'
+OTHER_ADDRESS = 'So11111111111111111111111111111111111111112'
+
+
+def test_parse_rows_skips_header_and_blank_lines():
+    text = f"address,amount,wallet\n{ADDRESS}, 1.5 ,main\n\n{OTHER_ADDRESS},2\n"
+    assert parse_rows(text, float) == [
+        [2, ADDRESS, 1.5, 'main'],
+        [4, OTHER_ADDRESS, 2.0, None],
+    ]
+
+
+def test_one_bad_row_rejects_the_whole_list():
+    text = "\n".join([
+        f"{ADDRESS},1",
+        f"{ADDRESS[:-1]}0,1",
+        f"{ADDRESS},-1",
+        f"{ADDRESS},nan",
+        f"{ADDRESS},lots",
+        ADDRESS,
+    ])
+    with pytest.raises(ValueError) as error:
+        parse_rows(text, float)
+    message = str(error.value)
+    assert "5 invalid row(s), nothing was sent" in message
+    for line in ("Line 2: invalid address", "Line 3: amount must be positive", "Line 4: amount must be positive",
+                 "Line 5: invalid amount lots", "Line 6: expected address,amount"):
+        assert line in message
+
+
+def test_parse_rows_limits():
+    with pytest.raises(ValueError, match="No transfers found"):
+        parse_rows("address,amount\n", float)
+    with pytest.raises(ValueError, match="At most 2 transfers"):
+        parse_rows("\n".join(f"{ADDRESS},1" for _ in range(3)), float, max_rows=2)
+
+
+class FakeBot:
+    rate_limiter = None
+
+    def __init__(self):
+        self.documents = []
+
+    async def edit_message_text(self, text, chat_id, message_id, rate_limit_args=None):
+        pass
+
+    async def send_document(self, chat_id, document, filename, caption, rate_limit_args=None):
+        self.documents.append((document, caption))
+
+
+def make_batch(count):
+    rows = [
+        BulkRow(line, TransferJob(
+            telegram_id='1', chat_id=1, message_id=1,
+            payload={'to': f"address{line}", 'amount': line, 'walletName': f"wallet{line}"},
+            idempotency_key=f"key{line}"
+        ))
+        for line in range(1, count + 1)
+    ]
+    return BulkTransfer(telegram_id='1', chat_id=1, message_id=1, rows=rows)
+
+
+def test_rows_that_may_have_been_sent_are_unknown_not_rejected():
+    outcomes = {
+        'address1': 'signature1',
+        'address2': TransferRejected("❌ Insufficient funds"),
+        'address3': CircuitOpenError("Backend circuit open"),
+        'address4': httpx.ConnectError("refused"),
+        'address5': httpx.ReadTimeout("timed out"),
+        'address6': ValueError("Expecting value"),
+        'address7': httpx.RemoteProtocolError("disconnected"),
+    }
+
+    async def submit(job):
+        outcome = outcomes[job.payload['to']]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    bot = FakeBot()
+    runner = BulkTransferRunner(submit, progress_interval=0)
+    batch = asyncio.run(runner.run(bot, make_batch(len(outcomes))))
+
+    assert [row.status for row in batch.rows] == [SENT, REJECTED, REJECTED, REJECTED, UNKNOWN, UNKNOWN, UNKNOWN]
+    document, caption = bot.documents[0]
+    statuses = [line['status'] for line in csv.DictReader(io.StringIO(document.decode('utf-8')))]
+    assert statuses == ['sent', 'rejected', 'rejected', 'rejected', 'unknown', 'unknown', 'unknown']
+    assert "Check /balance" in caption
+    assert runner.stats()['unknown'] == 3
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_concurrent_misses_share_one_load():
+    async def main():
+        cache = TTLCache(ttl=15.0)
+        loads = 0
+
+        async def load():
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.01)
+            return {'balance': 5}
+
+        results = await asyncio.gather(*(cache.get_or_load(('1', 'main'), load) for _ in range(10)))
+        return cache, loads, results
+
+    cache, loads, results = asyncio.run(main())
+    assert loads == 1
+    assert all(result == {'balance': 5} for result in results)
+    assert cache.stats()['coalesced'] == 9
+
+
+def test_a_failed_load_is_shared_but_not_cached():
+    async def main():
+        cache = TTLCache()
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError("backend down")
+
+        results = await asyncio.gather(
+            *(cache.get_or_load(('1',), load) for _ in range(3)), return_exceptions=True
+        )
+        with pytest.raises(ValueError):
+            await cache.get_or_load(('1',), load)
+        return calls, results
+
+    calls, results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls == 2
+
+
+def test_invalidated_while_loading_is_not_stored():
+    async def main():
+        cache = TTLCache()
+        loading = asyncio.Event()
+
+        async def load():
+            loading.set()
+            await asyncio.sleep(0.01)
+            return 'old balance'
+
+        task = asyncio.create_task(cache.get_or_load(('1', 'main'), load))
+        await loading.wait()
+        # e.g. a transfer settled while the balance was being fetched
+        cache.invalidate_owner('1')
+        assert await task == 'old balance'
+        return cache
+
+    cache = asyncio.run(main())
+    assert cache.get(('1', 'main')) is None
+
+
+def test_entries_expire_and_are_evicted_least_recently_used_first():
+    clock = Clock()
+    cache = TTLCache(maxsize=2, ttl=10.0, clock=clock)
+    cache.set(('1', 'a'), 'a')
+    cache.set(('2', 'b'), 'b')
+    cache.get(('1', 'a'))
+    cache.set(('3', 'c'), 'c')
+    assert cache.get(('2', 'b')) is None
+    assert cache.get(('1', 'a')) == 'a'
+
+    clock.now = 10.0
+    assert cache.get(('1', 'a')) is None
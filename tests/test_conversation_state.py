@@ -0,0 +1,41 @@
+import asyncio
+from types import SimpleNamespace
+
+from conversation_state import ConversationLifecycle
+
+
+class FakeApplication:
+    def __init__(self, user_data):
+        self.user_data = user_data
+        self.dropped = []
+        self.marked = []
+
+    def drop_user_data(self, user_id):
+        self.dropped.append(user_id)
+        self.user_data.pop(user_id, None)
+
+    def mark_data_for_update_persistence(self, user_ids=None):
+        self.marked.append(user_ids)
+
+
+def test_idle_sweep_keeps_wallets_and_network():
+    now = [0.0]
+    lifecycle = ConversationLifecycle(idle_ttl=900, clock=lambda: now[0])
+    lifecycle.router = SimpleNamespace(sessions={})
+    application = FakeApplication({
+        1: {'wallets': ['main', 'savings'], 'network': 'devnet', 'password': 'secret',
+            'transfer_amount': 1.5, 'receiver_address': 'address'},
+        2: {'transfer_amount': 2.0},
+    })
+    context = SimpleNamespace(application=application)
+
+    asyncio.run(lifecycle.sweep(context))
+    assert 'password' not in application.user_data[1]
+    assert application.user_data[1]['transfer_amount'] == 1.5
+
+    now[0] = 901.0
+    asyncio.run(lifecycle.sweep(context))
+    assert application.user_data[1] == {'wallets': ['main', 'savings'], 'network': 'devnet'}
+    assert 1 in application.marked
+    # Nothing worth keeping: dropped whole, from the store too
+    assert application.dropped == [2]
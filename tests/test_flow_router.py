@@ -0,0 +1,142 @@
+import asyncio
+from types import SimpleNamespace
+
+from flow_router import FlowRouter, Flow, Step, FLOW_STATE_KEY, CALLBACK_PREFIX, required
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Chat:
+    """
+    Records what the bot says; every reply is a new prompt message
+    """
+    def __init__(self):
+        self.replies = []
+        self.sent = []
+        self.answers = []
+
+    def message(self, text=None, message_id=None):
+        async def reply_text(reply, reply_markup=None):
+            self.replies.append(reply)
+            return SimpleNamespace(message_id=len(self.replies))
+        return SimpleNamespace(text=text, document=None, message_id=message_id, reply_text=reply_text)
+
+    def text(self, text):
+        message = self.message(text)
+        return SimpleNamespace(
+            effective_user=SimpleNamespace(id=1), effective_chat=SimpleNamespace(id=1),
+            message=message, effective_message=message, callback_query=None
+        )
+
+    def press(self, data, message_id):
+        async def answer(text=None):
+            self.answers.append(text)
+
+        async def edit_message_text(reply, reply_markup=None):
+            self.replies.append(reply)
+            return SimpleNamespace(message_id=message_id)
+
+        message = self.message(message_id=message_id)
+        query = SimpleNamespace(data=data, message=message, answer=answer, edit_message_text=edit_message_text)
+        return SimpleNamespace(
+            effective_user=SimpleNamespace(id=1), effective_chat=SimpleNamespace(id=1),
+            message=None, effective_message=message, callback_query=query
+        )
+
+
+def make_router(clock, done):
+    def amount(text):
+        value = float(text)
+        if value <= 0:
+            raise ValueError("❌ Invalid amount.")
+        return value
+
+    async def action(update, context):
+        done.append((context.user_data['transfer_amount'], context.user_data['receiver_address']))
+
+    flow = Flow(
+        name='transfer', command='transfer', first='amount', action=action, timeout=300,
+        steps={
+            'amount': Step(key='transfer_amount', prompt="Amount?", validate=amount, next='receiver',
+                           choices=lambda user_data: [('1 SOL', '1'), ('2 SOL', '2')]),
+            'receiver': Step(key='receiver_address', prompt="Receiver?", validate=required("❌ Empty.")),
+        }
+    )
+    return FlowRouter([flow], timeout_message="⌛ Session timed out.", clock=clock)
+
+
+def make_context(chat):
+    async def send_message(chat_id, text):
+        chat.sent.append(text)
+
+    user_data = {}
+    application = SimpleNamespace(
+        user_data={1: user_data}, mark_data_for_update_persistence=lambda user_ids=None: None
+    )
+    return SimpleNamespace(user_data=user_data, application=application, bot=SimpleNamespace(send_message=send_message))
+
+
+def test_flow_validates_each_step_and_runs_its_action():
+    async def main():
+        chat, done = Chat(), []
+        router = make_router(Clock(), done)
+        context = make_context(chat)
+
+        await router.start_flow(chat.text('/transfer'), context)
+        assert context.user_data[FLOW_STATE_KEY][:2] == ['transfer', 'amount']
+        await router.route_message(chat.text('-1'), context)
+        assert chat.replies[-1] == "❌ Invalid amount."
+        # A button of the current prompt answers it
+        await router.route_callback(chat.press(f"{CALLBACK_PREFIX}amount|1", message_id=1), context)
+        assert context.user_data[FLOW_STATE_KEY][:2] == ['transfer', 'receiver']
+        await router.route_message(chat.text('address'), context)
+        return router, context, done
+
+    router, context, done = asyncio.run(main())
+    assert done == [(2.0, 'address')]
+    assert router.sessions == {}
+    assert FLOW_STATE_KEY not in context.user_data
+
+
+def test_buttons_of_old_prompts_are_expired():
+    async def main():
+        chat, done = Chat(), []
+        router = make_router(Clock(), done)
+        context = make_context(chat)
+        await router.start_flow(chat.text('/transfer'), context)
+        await router.route_message(chat.text('1'), context)
+        # The amount prompt (message 1) was answered already
+        await router.route_callback(chat.press(f"{CALLBACK_PREFIX}amount|0", message_id=1), context)
+        return chat, context
+
+    chat, context = asyncio.run(main())
+    assert chat.answers == ['⌛ This menu has expired.']
+    assert context.user_data[FLOW_STATE_KEY][:2] == ['transfer', 'receiver']
+
+
+def test_idle_flows_time_out_and_drop_their_answers():
+    async def main():
+        chat, done, clock = Chat(), [], Clock()
+        router = make_router(clock, done)
+        context = make_context(chat)
+        await router.start_flow(chat.text('/transfer'), context)
+        await router.route_message(chat.text('1'), context)
+
+        clock.now = 299.0
+        await router.expire(context)
+        assert router.sessions
+        clock.now = 301.0
+        await router.expire(context)
+        return router, chat, context
+
+    router, chat, context = asyncio.run(main())
+    assert router.sessions == {}
+    assert chat.sent == ["⌛ Session timed out."]
+    assert context.user_data == {}
+    assert router.stats()['timed_out'] == 1
@@ -0,0 +1,31 @@
+import os
+import asyncio
+
+import pytest
+
+pytest.importorskip('watchdog')
+
+from graceful import SourceWatcher  # noqa: E402
+
+
+def test_source_watcher_reports_changed_source_files_only(tmp_path):
+    source = tmp_path / 'bot.py'
+    source.write_text('x = 1\n')
+    (tmp_path / 'notes.txt').write_text('')
+
+    async def main():
+        watcher = SourceWatcher(str(tmp_path))
+        changed = asyncio.create_task(watcher.changed())
+        await asyncio.sleep(0.3)
+        # Reading a source or writing another file is not a change
+        source.read_text()
+        (tmp_path / 'notes.txt').write_text('edited')
+        await asyncio.sleep(0.3)
+        assert not changed.done()
+
+        # Saved like editors do: written elsewhere, renamed over the source
+        (tmp_path / 'bot.py.tmp').write_text('x = 2\n')
+        os.replace(tmp_path / 'bot.py.tmp', source)
+        return await asyncio.wait_for(changed, 5)
+
+    assert asyncio.run(main()) == str(source)
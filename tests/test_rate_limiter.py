@@ -0,0 +1,63 @@
+import time
+import asyncio
+
+from telegram.error import RetryAfter
+
+from rate_limiter import OutboundScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+def test_throttled_chat_is_served_highest_priority_first():
+    priorities = [PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_HIGH, PRIORITY_NORMAL]
+
+    async def main():
+        # One message per 50ms to the chat, so all but the first have to queue
+        scheduler = OutboundScheduler(chat_rate=20, chat_burst=1)
+        await scheduler.initialize()
+        sent = []
+
+        def request(index, priority):
+            async def callback():
+                sent.append(index)
+            return scheduler.process_request(
+                callback, (), {}, 'sendMessage', {'chat_id': 1}, {'priority': priority}
+            )
+
+        # The first takes the chat's only token; the rest wait together
+        await request('first', PRIORITY_LOW)
+        await asyncio.gather(*(request(index, priority) for index, priority in enumerate(priorities)))
+        await scheduler.shutdown()
+        return sent
+
+    assert asyncio.run(main()) == ['first', 2, 4, 1, 5, 0, 3]
+
+
+def test_retry_after_pauses_every_chat_then_retries():
+    async def main():
+        scheduler = OutboundScheduler()
+        await scheduler.initialize()
+        limited = asyncio.Event()
+        times = {}
+
+        async def rate_limited():
+            if not limited.is_set():
+                limited.set()
+                times['limited'] = time.monotonic()
+                raise RetryAfter(1)
+            times['retried'] = time.monotonic()
+
+        async def other_chat():
+            times['other'] = time.monotonic()
+
+        first = asyncio.create_task(scheduler.process_request(
+            rate_limited, (), {}, 'sendMessage', {'chat_id': 1}, None
+        ))
+        await limited.wait()
+        await scheduler.process_request(other_chat, (), {}, 'sendMessage', {'chat_id': 2}, None)
+        await first
+        await scheduler.shutdown()
+        return times, scheduler.stats()
+
+    times, stats = asyncio.run(main())
+    assert times['other'] - times['limited'] >= 0.95
+    assert times['retried'] - times['limited'] >= 0.95
+    assert stats['retry_after'] == 1
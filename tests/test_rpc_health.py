@@ -0,0 +1,65 @@
+import socket
+import asyncio
+
+import httpx
+
+from rpc_health import RpcHealth
+
+DEVNET_GENESIS = 'EtWTRABZaYq6iMfeYKouRu166VU2xqa1wcaWoxPkrZBG'
+
+
+def healthy_rpc(requests):
+    def handle(request):
+        requests.append(request)
+        return httpx.Response(200, json=[
+            {'jsonrpc': '2.0', 'id': 1, 'result': 'ok'},
+            {'jsonrpc': '2.0', 'id': 2, 'result': 1000},
+            {'jsonrpc': '2.0', 'id': 3, 'result': DEVNET_GENESIS},
+        ])
+    return httpx.MockTransport(handle)
+
+
+def resolving_to(*addresses):
+    """
+    getaddrinfo stand-in answering with `addresses`, one per call
+    """
+    answers = iter(addresses)
+
+    def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (next(answers), 0))]
+    return getaddrinfo
+
+
+def test_check_probes_the_address_it_vetted(monkeypatch):
+    # A rebinding host: public when checked, private when resolved again
+    monkeypatch.setattr(socket, 'getaddrinfo', resolving_to('93.184.216.34', '10.0.0.5'))
+    requests = []
+
+    async def main():
+        health = RpcHealth(candidates={'devnet': []}, transport=healthy_rpc(requests))
+        probe = await health.check('https://rpc.example.com:8899/')
+        await health.close()
+        return probe
+
+    probe = asyncio.run(main())
+    assert probe.healthy
+    (request,) = requests
+    assert request.url.host == '93.184.216.34'
+    assert request.headers['Host'] == 'rpc.example.com:8899'
+    assert request.extensions['sni_hostname'] == 'rpc.example.com'
+
+
+def test_check_rejects_private_addresses(monkeypatch):
+    monkeypatch.setattr(socket, 'getaddrinfo', resolving_to('127.0.0.1'))
+    requests = []
+
+    async def main():
+        health = RpcHealth(transport=healthy_rpc(requests))
+        probe = await health.check('http://rpc.example.com/')
+        await health.close()
+        return probe
+
+    probe = asyncio.run(main())
+    assert not probe.healthy
+    assert probe.error == 'host is not publicly reachable'
+    assert requests == []
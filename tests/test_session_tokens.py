@@ -0,0 +1,51 @@
+from session_tokens import SessionTokenCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_tokens_round_trip_sealed_per_owner():
+    cache = SessionTokenCache()
+    cache.put('1', 'token-of-1', expires_in=300)
+    cache.put('2', 'token-of-2', expires_in=300)
+    assert cache.get('1') == 'token-of-1'
+    assert cache.get('2') == 'token-of-2'
+    assert 'token-of-1' not in repr(cache._entries)
+    assert cache.get('3') is None
+
+
+def test_tokens_expire_before_the_backend_expiry():
+    clock = Clock()
+    cache = SessionTokenCache(max_ttl=600, expiry_margin=5, clock=clock)
+    cache.put('1', 'short', expires_in=60)
+    cache.put('2', 'capped', expires_in=3600)
+    cache.put('3', 'too short to use', expires_in=5)
+    assert not cache.has('3')
+
+    clock.now = 54.9
+    assert cache.get('1') == 'short'
+    clock.now = 55.0
+    assert not cache.has('1')
+    assert cache.get('1') is None
+
+    clock.now = 594.9
+    assert cache.get('2') == 'capped'
+    clock.now = 595.0
+    assert cache.get('2') is None
+
+
+def test_revoked_and_evicted_tokens_are_gone():
+    cache = SessionTokenCache(maxsize=2)
+    cache.put('1', 'a', expires_in=300)
+    cache.put('2', 'b', expires_in=300)
+    cache.put('3', 'c', expires_in=300)
+    assert cache.get('1') is None
+    cache.revoke('2')
+    assert cache.get('2') is None
+    assert cache.get('3') == 'c'
+    assert cache.stats()['revoked'] == 1
@@ -0,0 +1,139 @@
+import asyncio
+import importlib.util
+
+import pytest
+
+from persistence import SQLiteStore, MemoryStore, RedisStore, StatePersistence, store_from_url
+
+
+class FakePipeline:
+    """
+    Queues hset/hdel like a redis.asyncio transaction and applies them on execute
+    """
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.commands = []
+
+    def hset(self, name, mapping):
+        self.commands.append(lambda: self.hashes.setdefault(name, {}).update(mapping))
+
+    def hdel(self, name, *keys):
+        def delete():
+            values = self.hashes.get(name, {})
+            for key in keys:
+                values.pop(key, None)
+            if not values:
+                self.hashes.pop(name, None)
+        self.commands.append(delete)
+
+    async def execute(self):
+        for command in self.commands:
+            command()
+        self.commands = []
+
+
+class FakeRedis:
+    """
+    The part of the redis.asyncio hash API RedisStore uses, decode_responses=True
+    """
+    def __init__(self):
+        self.hashes = {}
+        self.closed = False
+
+    async def hgetall(self, name):
+        return dict(self.hashes.get(name, {}))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.hashes)
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.fixture(params=['sqlite', 'memory', 'redis'])
+def make_store(request, tmp_path):
+    path = tmp_path / 'state.sqlite3'
+    redis = FakeRedis()
+    return {
+        'sqlite': lambda: SQLiteStore(str(path)),
+        'memory': lambda: MemoryStore(),
+        'redis': lambda: RedisStore('redis://localhost:6379/0', client=redis),
+    }[request.param]
+
+
+def test_store_contract(make_store):
+    async def main():
+        store = make_store()
+        assert await store.load('user_data') == {}
+
+        await store.write({
+            'user_data': {'1': '{"language": "en"}', '2': '{"language": "de"}'},
+            'bot_data': {'cursor': '"42"'},
+        })
+        assert await store.load('user_data') == {'1': '{"language": "en"}', '2': '{"language": "de"}'}
+        assert await store.load('bot_data') == {'cursor': '"42"'}
+
+        # Upserts and deletes in one batch; deleting a missing key is fine
+        await store.write({'user_data': {'1': '{"language": "fr"}', '2': None, '3': None}})
+        assert await store.load('user_data') == {'1': '{"language": "fr"}'}
+        assert await store.load('bot_data') == {'cursor': '"42"'}
+
+        await store.write({'bot_data': {'cursor': None}})
+        assert await store.load('bot_data') == {}
+        await store.close()
+
+    asyncio.run(main())
+
+
+def test_store_survives_reopening(make_store):
+    async def main():
+        store = make_store()
+        await store.write({'conversations:transfer': {'[1, 1]': '"amount"'}})
+        await store.close()
+
+        store = make_store()
+        if isinstance(store, MemoryStore):
+            pytest.skip("MemoryStore keeps nothing across instances")
+        assert await store.load('conversations:transfer') == {'[1, 1]': '"amount"'}
+        await store.close()
+
+    asyncio.run(main())
+
+
+@pytest.mark.skipif(importlib.util.find_spec('redis') is not None, reason="redis is installed")
+def test_redis_url_without_redis_package_is_a_configuration_error():
+    with pytest.raises(ValueError, match="pip install redis"):
+        store_from_url('redis://localhost:6379/0')
+
+
+class RecordingStore(MemoryStore):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    async def write(self, batch):
+        self.batches.append(batch)
+        await super().write(batch)
+
+
+def test_persistence_scrubs_secrets_and_writes_only_changed_keys():
+    async def main():
+        store = RecordingStore()
+        await store.write({'bot_data': {'cursor': '"1"', 'subscriptions': '{}'}})
+        store.batches.clear()
+        persistence = StatePersistence(store)
+        assert await persistence.get_bot_data() == {'cursor': '1', 'subscriptions': {}}
+        await persistence.get_user_data()
+
+        await persistence.update_user_data(1, {'password': 'hunter2', 'network': 'devnet'})
+        # Unchanged bot_data keys don't reach the store
+        await persistence.update_bot_data({'cursor': '2', 'subscriptions': {}})
+        await asyncio.sleep(0)
+        await persistence.update_user_data(1, {'password': 'changed', 'network': 'devnet'})
+        await persistence.update_bot_data({'cursor': '2', 'subscriptions': {}})
+        await persistence.flush()
+        return store
+
+    store = asyncio.run(main())
+    assert store.batches == [{'user_data': {'1': '{"network": "devnet"}'}, 'bot_data': {'cursor': '"2"'}}]
+    assert 'hunter2' not in repr(store._namespaces)
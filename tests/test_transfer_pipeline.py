@@ -0,0 +1,46 @@
+import asyncio
+
+import httpx
+
+from transfer_pipeline import TransferPipeline, TransferJob
+
+
+class FakeBot:
+    rate_limiter = None
+
+    def __init__(self):
+        self.edits = {}
+
+    async def edit_message_text(self, text, chat_id, message_id, rate_limit_args=None):
+        self.edits[message_id] = text
+
+
+def test_only_errors_before_sending_ask_the_user_to_try_again():
+    errors = {
+        1: httpx.ConnectError("refused"),
+        2: httpx.ReadTimeout("timed out"),
+        3: ValueError("Expecting value"),
+    }
+
+    async def submit(job):
+        raise errors[job.message_id]
+
+    async def main():
+        bot = FakeBot()
+        pipeline = TransferPipeline(backend=None, submit=submit, workers=2, poll_interval=60)
+        await pipeline.start(bot)
+        for message_id in errors:
+            pipeline.submit(TransferJob(
+                telegram_id='1', chat_id=1, message_id=message_id, payload={},
+                idempotency_key=str(message_id), summary='1 SOL to address'
+            ))
+        await pipeline.stop()
+        return bot, pipeline
+
+    bot, pipeline = asyncio.run(main())
+    assert "try again" in bot.edits[1]
+    for message_id in (2, 3):
+        assert "status unknown" in bot.edits[message_id]
+        assert "Check /balance before trying again" in bot.edits[message_id]
+    assert pipeline.stats()['rejected'] == 1
+    assert pipeline.stats()['unknown'] == 2
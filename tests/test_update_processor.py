@@ -0,0 +1,45 @@
+import random
+import asyncio
+
+from update_processor import UserShardedUpdateProcessor
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeUpdate:
+    def __init__(self, update_id, user_id):
+        self.update_id = update_id
+        self.effective_user = FakeUser(user_id)
+
+
+def test_one_users_updates_are_handled_in_fetch_order():
+    async def main(seed):
+        rng = random.Random(seed)
+        processor = UserShardedUpdateProcessor(concurrency=8, shard_backlog=1)
+        await processor.initialize()
+        handled = []
+
+        async def handle(update):
+            await asyncio.sleep(rng.uniform(0, 0.002))
+            handled.append(update.update_id)
+
+        # Like Application's fetcher with concurrent updates: one task per
+        # update, created in fetch order, far more than the processor admits
+        tasks = []
+        for update_id in range(1, 61):
+            update = FakeUpdate(update_id, user_id=42 if update_id % 3 else update_id)
+            tasks.append(asyncio.create_task(processor.process_update(update, handle(update))))
+            if rng.random() < 0.3:
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        await processor.shutdown()
+        return handled
+
+    for seed in range(20):
+        handled = asyncio.run(main(seed))
+        mine = [update_id for update_id in handled if update_id % 3]
+        assert mine == sorted(mine)
+        assert len(handled) == 60
@@ -0,0 +1,28 @@
+import io
+import json
+import logging
+
+from structured_logging import LogPipeline
+from webhook_server import server_config
+
+
+def test_uvicorn_logs_go_through_the_pipeline():
+    stream = io.StringIO()
+    pipeline = LogPipeline(level='INFO', stream=stream)
+    pipeline.install()
+    try:
+        server_config(object(), '127.0.0.1', 0)
+        error_logger = logging.getLogger('uvicorn.error')
+        access_logger = logging.getLogger('uvicorn.access')
+        # No stream handlers of uvicorn's own; records reach the root queue handler
+        assert error_logger.handlers == []
+        assert error_logger.propagate
+        assert access_logger.handlers == []
+
+        error_logger.warning("Started server process")
+    finally:
+        pipeline.stop()
+        logging.getLogger().removeHandler(pipeline.handler)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert {'logger': 'uvicorn.error', 'msg': 'Started server process'}.items() <= lines[-1].items()
@@ -0,0 +1,339 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import httpx
+import telegram
+
+from backend_client import may_have_arrived
+from rate_limiter import PRIORITY_HIGH, PRIORITY_NORMAL
+from structured_logging import TRACE_ID, start_trace
+
+# Lifecycle of a tracked transfer, as reported by /api/transfer/status
+PENDING = 'pending'
+CONFIRMED = 'confirmed'
+FINALIZED = 'finalized'
+FAILED = 'failed'
+SETTLED = frozenset({FINALIZED, FAILED})
+
+
+class TransferRejected(Exception):
+    """
+    The backend refused a transfer; the message is shown to the user
+    """
+
+
+class SessionExpired(TransferRejected):
+    """
+    The session token sent with the transfer is no longer valid
+    """
+
+
+@dataclass
+class TransferJob:
+    """
+    One transfer on its way through the pipeline
+
+    Attributes:
+        telegram_id (str): Owner of the transfer
+        chat_id (int): Chat holding the status message
+        message_id (int): Status message edited as the transfer progresses
+        payload (dict): /api/transfer body, credentials included
+        idempotency_key (str): Shared by every retry of this transfer
+        summary (str): Human readable "amount to address" line
+        trace_id (str): Trace of the update that requested it, set on submit
+    """
+    telegram_id: str
+    chat_id: int
+    message_id: int
+    payload: dict
+    idempotency_key: str
+    summary: str = ''
+    signature: str = None
+    status: str = None
+    sent_at: float = None
+    trace_id: str = None
+
+
+class TransferPipeline:
+    def __init__(self, backend, submit, on_change=None, api_token=None, workers=8, queue_size=1000,
+                 poll_interval=2.0, status_batch=100, track_timeout=300.0, clock=time.monotonic):
+        """
+        Sends transfers in the background and keeps one status message per
+        transfer up to date until it is finalized or failed
+
+        Handlers enqueue a TransferJob and return. A pool of workers calls
+        `submit` for each job. A single tracker then polls
+        /api/transfer/status for up to `status_batch` pending signatures
+        per request. The status message is edited only when the status
+        changes.
+
+        Args:
+            backend (BackendClient): Shared backend client
+            submit (callable): Coroutine taking a TransferJob and returning
+                its signature; raises TransferRejected or httpx.HTTPError
+            on_change (callable): Called with the job whenever its status
+                changes, e.g. to invalidate cached balances
+            api_token (str): API_TOKEN sent with status requests
+            workers (int): Transfers submitted at once
+            queue_size (int): Transfers allowed to wait for a worker
+            poll_interval (float): Seconds between status polls
+            status_batch (int): Signatures per status request
+            track_timeout (float): Seconds a sent transfer is tracked
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.backend = backend
+        self.submit_transfer = submit
+        self.on_change = on_change
+        self.api_token = api_token
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.status_batch = status_batch
+        self.track_timeout = track_timeout
+        self.clock = clock
+        self.bot = None
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._pending = {}
+        # Jobs whose submit was cancelled by stop(); the backend may have sent them
+        self._interrupted = []
+        self._tasks = []
+        # Cleared if the backend turns out not to have /api/transfer/status
+        self.tracking_supported = True
+
+        # Metrics
+        self.submitted = 0
+        self.rejected = 0
+        # Submits whose connection broke after the backend may have sent them
+        self.unknown = 0
+        self.counts = {CONFIRMED: 0, FINALIZED: 0, FAILED: 0}
+        self.untracked = 0
+        self.status_requests = 0
+
+    async def start(self, bot):
+        self.bot = bot
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f"TransferWorker:{index}")
+            for index in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._track(), name='TransferTracker'))
+
+    async def stop(self, timeout=10.0):
+        """
+        Give queued transfers `timeout` seconds to be sent, then stop.
+        Transfers still queued are reported to their users as not sent,
+        transfers cut off while being submitted as unknown.
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"{self._queue.qsize()} transfers still queued at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            await self._edit(job, f"⚠️ Transfer not sent, the bot is restarting. Please try again.\n{job.summary}")
+        for job in self._interrupted:
+            await self._edit(job, self._unknown_text(job))
+        self._interrupted = []
+        for job in list(self._pending.values()):
+            await self._edit(job, self._untracked_text(job))
+        self._pending.clear()
+
+    def submit(self, job):
+        """
+        Queue `job` for sending
+
+        Returns:
+            bool: False if the queue is full and the job was not accepted
+        """
+        if job.trace_id is None:
+            job.trace_id = TRACE_ID.get()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _edit(self, job, text, priority=PRIORITY_NORMAL):
+        rate_limit_args = {'priority': priority} if self.bot.rate_limiter else None
+        try:
+            await self.bot.edit_message_text(
+                text,
+                chat_id=job.chat_id,
+                message_id=job.message_id,
+                rate_limit_args=rate_limit_args
+            )
+        except telegram.error.BadRequest as e:
+            # Deleted by the user, or unchanged
+            self.logger.debug(f"Status edit skipped: {e}")
+        except telegram.error.TelegramError as e:
+            self.logger.error(f"Status edit error: {e}")
+
+    def _changed(self, job, status):
+        job.status = status
+        if status in self.counts:
+            self.counts[status] += 1
+        if self.on_change is not None:
+            self.on_change(job)
+
+    @staticmethod
+    def _untracked_text(job):
+        # Sent, but nothing confirmed it landed
+        if job.signature is None:
+            return TransferPipeline._unknown_text(job)
+        return (
+            f"📤 Transfer sent, confirmation pending.\n{job.summary}\n"
+            f"Transaction Signature: {job.signature}\n"
+            "Check /balance in a moment to see it settle."
+        )
+
+    @staticmethod
+    def _unknown_text(job, reason="the bot restarted while sending it"):
+        return (
+            f"⚠️ Transfer status unknown, {reason}.\n{job.summary}\n"
+            "Check /balance before trying again, so it isn't sent twice."
+        )
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            # Sending is logged under the trace of the update that asked for it
+            start_trace(job.trace_id)
+            try:
+                await self._send(job)
+            except Exception as e:
+                self.logger.exception(f"Transfer worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, job):
+        try:
+            job.signature = await self.submit_transfer(job)
+        except asyncio.CancelledError:
+            self._interrupted.append(job)
+            raise
+        except TransferRejected as e:
+            self.rejected += 1
+            await self._edit(job, str(e), priority=PRIORITY_HIGH)
+            return
+        except (httpx.HTTPError, ValueError) as e:
+            self.logger.error(f"Transfer error: {e!r}")
+            if may_have_arrived(e):
+                # A retry would carry a new idempotency key, so the backend
+                # couldn't tell it apart from a second transfer
+                self.unknown += 1
+                await self._edit(
+                    job,
+                    self._unknown_text(job, "the connection broke while sending it"),
+                    priority=PRIORITY_HIGH
+                )
+            else:
+                self.rejected += 1
+                await self._edit(job, "🔴 Network error. Please try again later.", priority=PRIORITY_HIGH)
+            return
+
+        self.submitted += 1
+        job.sent_at = self.clock()
+        self._changed(job, PENDING)
+        if not self.tracking_supported:
+            self.untracked += 1
+            await self._edit(job, self._untracked_text(job), priority=PRIORITY_HIGH)
+            return
+        self._pending[job.signature] = job
+        await self._edit(
+            job,
+            f"📤 Transfer sent, waiting for confirmation…\n{job.summary}\n"
+            f"Transaction Signature: {job.signature}",
+            priority=PRIORITY_HIGH
+        )
+
+    async def _track(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                self.logger.exception(f"Transfer tracker error: {e}")
+
+    async def poll(self):
+        """
+        Look up every pending signature once, `status_batch` per request
+        """
+        signatures = list(self._pending)
+        for start in range(0, len(signatures), self.status_batch):
+            if not self.tracking_supported:
+                break
+            await self._poll_batch(signatures[start:start + self.status_batch])
+
+        now = self.clock()
+        for signature, job in list(self._pending.items()):
+            if not self.tracking_supported or now - job.sent_at > self.track_timeout:
+                del self._pending[signature]
+                self.untracked += 1
+                await self._edit(job, self._untracked_text(job))
+
+    async def _poll_batch(self, signatures):
+        self.status_requests += 1
+        try:
+            response = await self.backend.post(
+                "/api/transfer/status",
+                {'signatures': signatures, 'API_TOKEN': self.api_token}
+            )
+        except (httpx.HTTPError, ValueError) as e:
+            self.logger.warning(f"Transfer status error: {e}")
+            return
+        if response.status_code == 404:
+            self.logger.warning("Backend has no /api/transfer/status, transfers are not tracked")
+            self.tracking_supported = False
+            return
+        if response.status_code != 200:
+            return
+        try:
+            statuses = response.json().get('statuses', {})
+        except ValueError as e:
+            # e.g. an HTML error page from a proxy
+            self.logger.warning(f"Transfer status error: {e}")
+            return
+
+        for signature in signatures:
+            job = self._pending.get(signature)
+            result = statuses.get(signature) or {}
+            status = result.get('status', PENDING)
+            if job is None or status == job.status:
+                continue
+            self._changed(job, status)
+            if status in SETTLED:
+                del self._pending[signature]
+
+            if status == CONFIRMED:
+                text = f"✅ Transfer confirmed, finalizing…\n{job.summary}"
+            elif status == FINALIZED:
+                text = f"✅ Transfer finalized!\n{job.summary}"
+            elif status == FAILED:
+                text = f"❌ Transfer failed: {result.get('error', 'Unknown Error')}\n{job.summary}"
+            else:
+                continue
+            await self._edit(
+                job,
+                f"{text}\nTransaction Signature: {signature}",
+                priority=PRIORITY_HIGH if status in SETTLED else PRIORITY_NORMAL
+            )
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'tracking': len(self._pending),
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'unknown': self.unknown,
+            'confirmed': self.counts[CONFIRMED],
+            'finalized': self.counts[FINALIZED],
+            'failed': self.counts[FAILED],
+            'untracked': self.untracked,
+            'status_requests': self.status_requests,
+        }
@@ -0,0 +1,269 @@
+import time
+import asyncio
+import logging
+
+import telegram
+from telegram.ext import BaseUpdateProcessor
+
+from structured_logging import start_trace
+
+
+class UserShardedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency=32, shard_backlog=64, admission=None, slow_update=5.0):
+        """
+        Process updates from different users in parallel while keeping each
+        user's updates strictly in order
+
+        Updates are hashed by effective_user.id onto `concurrency` shards.
+        Each shard is a queue drained by a single worker, so one user's
+        messages never race each other through a ConversationHandler. An
+        update is queued without awaiting anything first, so each shard
+        receives its updates in the order they were fetched. The Application
+        hands over every update at once in concurrent mode; updates beyond
+        `concurrency * (shard_backlog + 1)` queued or running wait on the
+        base semaphore, which lets them through first come, first served.
+        Updates that `admission` sheds are answered instead of queued.
+        Each update gets a trace ID that every log line written while
+        handling it carries, and updates slower than `slow_update` are
+        logged with their queue and handling times.
+
+        `state` records the last update id seen and, after a drain ran out
+        of time, the updates that were never started. Pointed at a
+        bot_data entry it is persisted, so the next process replays those
+        updates and skips any Telegram delivers again.
+
+        Args:
+            concurrency (int): Number of shards, i.e. updates handled at once
+            shard_backlog (int): Updates allowed to wait per shard, on average
+            admission (AdmissionController): Optional; its `shed(update)`
+                returns a reply to send instead of processing the update
+            slow_update (float): Seconds from arrival to handled above which
+                an update is logged as slow
+        """
+        # The base semaphore only caps queued + running updates; the shard
+        # workers are what actually limit concurrency. Its waiters are woken
+        # in order and newcomers can't jump the line, so fetch order holds.
+        super().__init__(max_concurrent_updates=concurrency * (shard_backlog + 1))
+        self.logger = logging.getLogger(__name__)
+        self.concurrency = concurrency
+        self.shard_backlog = shard_backlog
+        self.admission = admission
+        self.slow_update = slow_update
+        self._shards = []
+        self._workers = []
+        self.state = {'last_update_id': None, 'undelivered': []}
+        # Updates queued or being handled, and handlers running
+        self._pending = 0
+        self._running = 0
+        self._deadline = None
+        # After a warm start: updates up to this id were handled by the last
+        # process, except those being replayed
+        self._seen_through = None
+        self._replaying = set()
+        self._dedupe_until = 0.0
+
+        # Metrics
+        self.duplicates = 0
+        self.abandoned = 0
+
+    @staticmethod
+    def shard_key(update):
+        """
+        Key that decides the shard: the user, else the chat, else the update
+        """
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return chat.id
+        return getattr(update, 'update_id', 0)
+
+    async def initialize(self):
+        # Unbounded: put_nowait never fails, the base semaphore bounds the total
+        self._shards = [asyncio.Queue() for _ in range(self.concurrency)]
+        self._start_workers()
+
+    async def shutdown(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._shards = []
+
+    def _start_workers(self):
+        self._workers = [
+            asyncio.create_task(self._work(queue), name=f"UpdateShard:{index}")
+            for index, queue in enumerate(self._shards)
+        ]
+
+    def _keep(self, update):
+        """
+        Set `update` aside for the next process instead of handling it
+        """
+        if isinstance(update, telegram.Update):
+            self.state['undelivered'].append(update.to_dict())
+
+    async def _work(self, queue):
+        while True:
+            coroutine, done, trace_id, update, queued_at = await queue.get()
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                coroutine.close()
+                self._keep(update)
+                done.set_result(None)
+                queue.task_done()
+                continue
+            # The worker task outlives the update; re-point its context
+            start_trace(trace_id)
+            started = time.monotonic()
+            self._running += 1
+            try:
+                await coroutine
+            except asyncio.CancelledError:
+                # Abandoned by drain(); let the Application's wrapper finish
+                done.cancel()
+                raise
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+            else:
+                if not done.done():
+                    done.set_result(None)
+            finally:
+                self._running -= 1
+                queue.task_done()
+                self._log_timing(getattr(update, 'update_id', None), queued_at, started)
+
+    def _log_timing(self, update_id, queued_at, started):
+        now = time.monotonic()
+        total = now - queued_at
+        if total >= self.slow_update:
+            level = logging.WARNING
+        elif self.logger.isEnabledFor(logging.DEBUG):
+            level = logging.DEBUG
+        else:
+            return
+        self.logger.log(
+            level,
+            f"Update {update_id} handled in {total:.3f}s",
+            extra={
+                'update_id': update_id,
+                'queued_ms': round((started - queued_at) * 1000, 1),
+                'handled_ms': round((now - started) * 1000, 1),
+            }
+        )
+
+    def _is_duplicate(self, update_id):
+        if self._seen_through is None:
+            return False
+        if update_id in self._replaying:
+            self._replaying.discard(update_id)
+            return False
+        if update_id > self._seen_through or time.monotonic() >= self._dedupe_until:
+            # Telegram moved past the last process's updates
+            self._seen_through = None
+            return False
+        return True
+
+    async def do_process_update(self, update, coroutine):
+        update_id = getattr(update, 'update_id', None)
+        if update_id is not None:
+            if self._is_duplicate(update_id):
+                self.duplicates += 1
+                coroutine.close()
+                return
+            last = self.state['last_update_id']
+            if last is None or update_id > last:
+                self.state['last_update_id'] = update_id
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            coroutine.close()
+            self._keep(update)
+            return
+        trace_id = start_trace()
+        if self.admission is not None:
+            reply = self.admission.shed(update)
+            if reply is not None:
+                # Not queued, so answering it can't reorder the user's updates
+                coroutine.close()
+                await reply
+                return
+        # No await before this: another update of the user could overtake
+        queue = self._shards[hash(self.shard_key(update)) % self.concurrency]
+        done = asyncio.get_running_loop().create_future()
+        queue.put_nowait((coroutine, done, trace_id, update, time.monotonic()))
+        self._pending += 1
+        try:
+            await done
+        finally:
+            self._pending -= 1
+
+    def resume(self, application, state, window=60.0):
+        """
+        Warm start from the `state` the last process left: queue the updates
+        it set aside, and for `window` seconds skip updates it already saw
+
+        Call before the Application starts, so replayed updates go first.
+
+        Args:
+            application (Application): Application to queue the updates on
+            state (dict): This processor's persisted state, e.g. a bot_data
+                entry; used as `self.state` from now on
+            window (float): Seconds during which redelivered updates are
+                dropped
+        """
+        state.setdefault('last_update_id', None)
+        undelivered, state['undelivered'] = state.get('undelivered') or [], []
+        self.state = state
+        self._seen_through = state['last_update_id']
+        self._dedupe_until = time.monotonic() + window
+        for data in undelivered:
+            update = telegram.Update.de_json(data, application.bot)
+            self._replaying.add(update.update_id)
+            application.update_queue.put_nowait(update)
+        if undelivered:
+            self.logger.info(f"Replaying {len(undelivered)} updates left by the last process")
+
+    async def drain(self, update_queue, timeout):
+        """
+        Wait up to `timeout` seconds for queued and running updates to be
+        handled. Once the time is up, handlers still running are cancelled
+        and updates not started yet are set aside in `state['undelivered']`.
+        Call after the updater stopped fetching, before Application.stop().
+
+        Returns:
+            bool: Whether everything was handled in time
+        """
+        self._deadline = time.monotonic() + timeout
+        while update_queue.qsize() or self._pending:
+            if time.monotonic() >= self._deadline:
+                break
+            await asyncio.sleep(0.05)
+        else:
+            return True
+
+        running = self._running
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        # Fresh workers set aside whatever is still queued
+        self._start_workers()
+        self.abandoned += running
+        self.logger.warning(
+            f"Drain timed out after {timeout:g}s: {running} handlers cancelled, "
+            f"{update_queue.qsize() + sum(queue.qsize() for queue in self._shards)} updates kept for the next start"
+        )
+        return False
+
+    def stats(self):
+        """
+        Backlog per shard, for spotting hot users
+        """
+        backlog = [queue.qsize() for queue in self._shards]
+        return {
+            'shards': self.concurrency,
+            'queued': sum(backlog),
+            'max_shard_backlog': max(backlog, default=0),
+            'backlog': backlog,
+            'duplicates': self.duplicates,
+            'abandoned': self.abandoned,
+        }
@@ -0,0 +1,298 @@
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import contextlib
+
+import telegram
+import uvicorn
+
+from graceful import drain
+
+SECRET_HEADER = b'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def server_config(app, host, port, log_level='info'):
+    """
+    uvicorn configuration that logs through the bot's LogPipeline
+
+    uvicorn's default logging config gives `uvicorn.error` and
+    `uvicorn.access` their own synchronous stream handlers that don't
+    propagate, so their lines would skip the queue, the JSON format and
+    redaction. Without it `uvicorn.error` propagates to the root logger;
+    per-request access lines are dropped, the handlers log what matters.
+    """
+    return uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        lifespan='off',
+        log_level=log_level,
+        log_config=None,
+        access_log=False
+    )
+
+
+class EmbeddedServer(uvicorn.Server):
+    """
+    uvicorn server that leaves signal handling to the bot. Stock uvicorn
+    swaps in its own SIGINT/SIGTERM handlers and re-raises the signal once
+    it stops, which would kill the process before the Application's
+    shutdown hooks (and the persistence flush) have run.
+    """
+
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+
+class RouteApp:
+    def __init__(self, routes=None):
+        """
+        Minimal ASGI app dispatching on (method, path)
+
+        Args:
+            routes (dict): (method, path) -> async handler(scope, body)
+                returning (status, content_type, body_bytes)
+        """
+        self.logger = logging.getLogger(__name__)
+        self.routes = dict(routes or {})
+
+    def add_route(self, method, path, handler):
+        """
+        Register an extra endpoint. Handlers receive (scope, body) and return
+        (status, content_type, body_bytes).
+        """
+        self.routes[(method, path)] = handler
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            await self.respond(send, 404, 'text/plain', b'Not Found')
+            return
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if len(body) > MAX_BODY_SIZE:
+                await self.respond(send, 413, 'text/plain', b'Payload Too Large')
+                return
+
+        status, content_type, payload = await handler(scope, body)
+        await self.respond(send, status, content_type, payload)
+
+    @staticmethod
+    async def respond(send, status, content_type, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', content_type.encode('latin-1')),
+                (b'content-length', str(len(body)).encode('latin-1')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class WebhookApp(RouteApp):
+    def __init__(self, application, secret_token, path='/telegram'):
+        """
+        ASGI app that receives Telegram updates
+
+        Args:
+            application (Application): Initialized python-telegram-bot application
+            secret_token (str): Expected X-Telegram-Bot-Api-Secret-Token header
+            path (str): URL path Telegram posts updates to
+        """
+        super().__init__({
+            ('POST', path): self.handle_update,
+            ('GET', '/healthz'): self.handle_health,
+        })
+        self.application = application
+        self.secret_token = secret_token.encode('utf-8')
+
+    async def handle_update(self, scope, body):
+        """
+        Verify the secret token and hand the update to the Application queue
+        """
+        if not self.authorized(scope):
+            return 403, 'text/plain', b'Forbidden'
+
+        try:
+            update = telegram.Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.error(f"Malformed webhook update: {e}")
+            return 400, 'text/plain', b'Bad Request'
+
+        await self.application.update_queue.put(update)
+        return 200, 'text/plain', b'OK'
+
+    def authorized(self, scope):
+        headers = dict(scope.get('headers', []))
+        return hmac.compare_digest(headers.get(SECRET_HEADER, b''), self.secret_token)
+
+    async def handle_health(self, scope, body):
+        """
+        Report 200 while the Application is processing updates
+        """
+        running = self.application.running
+        payload = json.dumps({'status': 'ok' if running else 'stopped'}).encode('utf-8')
+        return (200 if running else 503), 'application/json', payload
+
+
+class IngressWebhookApp(WebhookApp):
+    def __init__(self, pool, secret_token, path='/telegram'):
+        """
+        Webhook endpoint of the supervisor: forwards raw updates to the
+        worker pool instead of processing them
+
+        Args:
+            pool (WorkerPool): Started worker pool
+            secret_token (str): Expected X-Telegram-Bot-Api-Secret-Token header
+            path (str): URL path Telegram posts updates to
+        """
+        super().__init__(None, secret_token, path=path)
+        self.pool = pool
+
+    async def handle_update(self, scope, body):
+        if not self.authorized(scope):
+            return 403, 'text/plain', b'Forbidden'
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            self.logger.error(f"Malformed webhook update: {e}")
+            return 400, 'text/plain', b'Bad Request'
+        if not isinstance(data, dict):
+            return 400, 'text/plain', b'Bad Request'
+        await self.pool.route(data)
+        return 200, 'text/plain', b'OK'
+
+    async def handle_health(self, scope, body):
+        """
+        Report 200 while every worker is running
+        """
+        alive = sum(1 for slot in self.pool.slots if slot.alive)
+        healthy = alive == self.pool.workers
+        payload = json.dumps({'status': 'ok' if healthy else 'degraded', 'workers_alive': alive}).encode('utf-8')
+        return (200 if healthy else 503), 'application/json', payload
+
+
+async def run_webhook(application, webhook_url, secret_token, listen='0.0.0.0', port=8080, path='/telegram',
+                      stopping=None, drain_timeout=20.0):
+    """
+    Serve the bot in webhook mode behind an embedded uvicorn server. On
+    shutdown the server stops accepting updates first, then in-flight
+    updates get `drain_timeout` seconds to finish.
+
+    Args:
+        application (Application): Built python-telegram-bot application
+        webhook_url (str): Public base URL Telegram should post to
+        secret_token (str): Secret token Telegram sends with every update
+        listen (str): Interface to bind
+        port (int): Port to bind
+        path (str): URL path for updates
+        stopping (asyncio.Event): Set to shut down; SIGINT/SIGTERM set it
+            if not given
+        drain_timeout (float): Seconds in-flight updates get to finish
+    """
+    webhook_app = WebhookApp(application, secret_token, path=path)
+    server = EmbeddedServer(server_config(webhook_app, listen, port))
+
+    # run_polling/run_webhook normally drive these hooks; do it by hand here
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.bot.set_webhook(
+            url=f"{webhook_url.rstrip('/')}{path}",
+            secret_token=secret_token,
+            allowed_updates=telegram.Update.ALL_TYPES
+        )
+        await application.start()
+
+        if stopping is None:
+            stopping = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                with contextlib.suppress(NotImplementedError):
+                    loop.add_signal_handler(sig, stopping.set)
+
+        async def stop_serving():
+            await stopping.wait()
+            server.should_exit = True
+
+        stopper = asyncio.create_task(stop_serving())
+        try:
+            await server.serve()
+        finally:
+            stopper.cancel()
+            await drain(application, drain_timeout)
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def run_ingress_webhook(pool, bot_token, stopping, webhook_url, secret_token, listen='0.0.0.0', port=8080,
+                              path='/telegram'):
+    """
+    Serve the supervisor's webhook, routing updates to the worker pool,
+    until `stopping` is set
+
+    Args:
+        pool (WorkerPool): Started worker pool
+        bot_token (str): Telegram Bot API token, to register the webhook
+        stopping (asyncio.Event): Set to stop serving
+        webhook_url (str): Public base URL Telegram should post to
+        secret_token (str): Secret token Telegram sends with every update
+        listen (str): Interface to bind
+        port (int): Port to bind
+        path (str): URL path for updates
+    """
+    server = EmbeddedServer(server_config(IngressWebhookApp(pool, secret_token, path=path), listen, port))
+    async with telegram.Bot(bot_token) as bot:
+        await bot.set_webhook(
+            url=f"{webhook_url.rstrip('/')}{path}",
+            secret_token=secret_token,
+            allowed_updates=telegram.Update.ALL_TYPES
+        )
+    serving = asyncio.create_task(server.serve())
+    await stopping.wait()
+    server.should_exit = True
+    await serving
+
+
+class BackgroundServer:
+    def __init__(self, app, host, port):
+        """
+        Run an ASGI app on the current event loop next to the bot, e.g. the
+        local /metrics endpoint
+
+        Args:
+            app: ASGI application
+            host (str): Interface to bind
+            port (int): Port to bind
+        """
+        self.server = EmbeddedServer(server_config(app, host, port, log_level='warning'))
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self.server.serve())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self.server.should_exit = True
+        await self._task
+        self._task = None
@@ -0,0 +1,280 @@
+import time
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+import telegram
+
+from graceful import drain
+
+
+def affinity_key(data):
+    """
+    Routing key of a raw update: the sender, else the chat, else the update
+
+    Mirrors UserShardedUpdateProcessor.shard_key on the JSON dict, so the
+    ingress doesn't have to parse updates it only forwards.
+    """
+    for field, value in data.items():
+        if field == 'update_id' or not isinstance(value, dict):
+            continue
+        # `from` on messages, callback and inline queries, `user` on poll
+        # answers and reactions
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return data.get('update_id', 0)
+
+
+class WorkerSlot:
+    def __init__(self, index, inbox, taken):
+        """
+        One worker position in the pool; its process is replaced on a crash,
+        its inbox and counters are kept
+
+        Args:
+            index (int): Position, also what routing hashes onto
+            inbox (multiprocessing.Queue): Raw updates for this worker
+            taken (multiprocessing.Value): Updates the worker took off its inbox
+        """
+        self.index = index
+        self.inbox = inbox
+        self.taken = taken
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.failures = 0
+
+        # Metrics
+        self.routed = 0
+        self.restarts = 0
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def backlog(self):
+        return max(0, self.routed - self.taken.value)
+
+
+class WorkerPool:
+    def __init__(self, target, workers=2, queue_size=1000, restart_delay=1.0, max_restart_delay=60.0,
+                 stable_after=60.0, context=None, clock=time.monotonic):
+        """
+        Supervises worker processes that each run a full Application
+
+        Updates are routed to worker `affinity_key(update) % workers`, so a
+        user always lands on the same process and their conversation state
+        stays where it is. A worker that exits is started again after
+        `restart_delay`, doubling up to `max_restart_delay` while it keeps
+        crashing within `stable_after` seconds of starting. Updates waiting
+        in its inbox are handled by the replacement.
+
+        Args:
+            target (callable): Top-level function run in each worker with
+                (index, inbox, taken); must return once it reads None
+            workers (int): Worker processes
+            queue_size (int): Updates allowed to wait per worker
+            restart_delay (float): First delay before restarting a worker
+            max_restart_delay (float): Restart delay cap
+            stable_after (float): Seconds of uptime after which a worker's
+                crash count is reset
+            context: multiprocessing context, 'spawn' by default so workers
+                don't inherit the supervisor's threads and event loop
+            clock (callable): Monotonic time source
+        """
+        self.logger = logging.getLogger(__name__)
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after
+        self.context = context or multiprocessing.get_context('spawn')
+        self.clock = clock
+        self.slots = [
+            WorkerSlot(index, self.context.Queue(maxsize=queue_size), self.context.Value('Q', 0))
+            for index in range(workers)
+        ]
+        self.stopping = False
+
+        # Metrics
+        self.full_waits = 0
+
+    def start(self):
+        for slot in self.slots:
+            self._spawn(slot)
+
+    def _spawn(self, slot):
+        slot.process = self.context.Process(
+            target=self.target,
+            args=(slot.index, slot.inbox, slot.taken),
+            name=f"BotWorker:{slot.index}",
+            daemon=False
+        )
+        slot.process.start()
+        slot.started_at = self.clock()
+        self.logger.info(f"Worker {slot.index} started (pid={slot.process.pid})")
+
+    def slot_for(self, data):
+        return self.slots[affinity_key(data) % self.workers]
+
+    async def route(self, data):
+        """
+        Hand a raw update to its worker, waiting while that worker's inbox
+        is full so the ingress slows down instead of dropping updates
+        """
+        slot = self.slot_for(data)
+        while True:
+            try:
+                slot.inbox.put_nowait(data)
+                break
+            except queue.Full:
+                self.full_waits += 1
+                await asyncio.sleep(0.05)
+        slot.routed += 1
+
+    def check(self):
+        """
+        Restart workers that exited, with backoff for crash loops
+        """
+        if self.stopping:
+            return
+        now = self.clock()
+        for slot in self.slots:
+            if slot.alive:
+                continue
+            if slot.restart_at == 0.0:
+                uptime = now - slot.started_at
+                slot.failures = 1 if uptime >= self.stable_after else slot.failures + 1
+                delay = min(self.max_restart_delay, self.restart_delay * 2 ** (slot.failures - 1))
+                slot.restart_at = now + delay
+                self.logger.error(
+                    f"Worker {slot.index} exited with {slot.process.exitcode} after {uptime:.0f}s, "
+                    f"restarting in {delay:.1f}s"
+                )
+            elif now >= slot.restart_at:
+                slot.restart_at = 0.0
+                slot.restarts += 1
+                self._spawn(slot)
+
+    async def supervise(self, interval=1.0, report_interval=60.0):
+        """
+        Restart crashed workers every `interval` and log per-worker load
+        every `report_interval` seconds, until cancelled
+        """
+        last_report = self.clock()
+        while True:
+            await asyncio.sleep(interval)
+            self.check()
+            if self.clock() - last_report >= report_interval:
+                last_report = self.clock()
+                self.logger.info(
+                    "Worker load: " + ', '.join(
+                        f"{slot.index}: {slot.routed} routed, {slot.backlog()} waiting"
+                        for slot in self.slots
+                    ),
+                    extra={'workers': self.worker_stats()}
+                )
+
+    async def stop(self, timeout=25.0):
+        """
+        Ask every worker to finish its inbox and shut down, then wait for
+        them; workers still running after `timeout` are terminated
+        """
+        self.stopping = True
+        loop = asyncio.get_running_loop()
+        for slot in self.slots:
+            if slot.alive:
+                # The sentinel queues behind routed updates, so they are handled first
+                await loop.run_in_executor(None, slot.inbox.put, None)
+        deadline = self.clock() + timeout
+        for slot in self.slots:
+            if slot.process is None:
+                continue
+            await loop.run_in_executor(None, slot.process.join, max(0.0, deadline - self.clock()))
+            if slot.process.is_alive():
+                self.logger.warning(f"Worker {slot.index} did not stop in time, terminating")
+                slot.process.terminate()
+                await loop.run_in_executor(None, slot.process.join, 5.0)
+
+    def worker_stats(self):
+        """
+        Load of each worker
+        """
+        return [
+            {
+                'worker': slot.index,
+                'pid': slot.process.pid if slot.process is not None else None,
+                'alive': slot.alive,
+                'routed': slot.routed,
+                'waiting': slot.backlog(),
+                'restarts': slot.restarts,
+            }
+            for slot in self.slots
+        ]
+
+    def stats(self):
+        stats = {
+            'workers': self.workers,
+            'alive': sum(1 for slot in self.slots if slot.alive),
+            'restarts': sum(slot.restarts for slot in self.slots),
+            'full_waits': self.full_waits,
+        }
+        for slot in self.slots:
+            stats[f'worker{slot.index}_routed'] = slot.routed
+            stats[f'worker{slot.index}_waiting'] = slot.backlog()
+        return stats
+
+
+async def serve_inbox(application, inbox, taken, drain_timeout=20.0):
+    """
+    Run `application` on updates read from a worker inbox until the
+    supervisor sends None, then give in-flight updates `drain_timeout`
+    seconds to finish
+
+    Args:
+        application (Application): Built application without an Updater
+        inbox (multiprocessing.Queue): Raw update dicts, then None
+        taken (multiprocessing.Value): Incremented per update read
+        drain_timeout (float): Seconds in-flight updates get to finish
+    """
+    logger = logging.getLogger(__name__)
+    # The supervisor decides when workers stop; a Ctrl+C or SIGTERM sent to
+    # the whole process group must not cut a worker's inbox short
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, signal.SIG_IGN)
+
+    # run_polling/run_webhook normally drive these hooks; do it by hand here
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.start()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await loop.run_in_executor(None, inbox.get)
+                if data is None:
+                    break
+                with taken.get_lock():
+                    taken.value += 1
+                try:
+                    update = telegram.Update.de_json(data, application.bot)
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.error(f"Malformed update: {e}")
+                    continue
+                await application.update_queue.put(update)
+        finally:
+            await drain(application, drain_timeout)
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)